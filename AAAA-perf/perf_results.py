@@ -0,0 +1,115 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+"""
+Processing of the measurement results of measure.ipynb for plot.ipynb.
+
+Each run (unity_<run>.feather and psutil_<run>.feather of an experiment folder) is processed once:
+- The unity table gets the derived duration, env_time, throughput and fps columns.
+- Each psutil sample gets the num_envs of the measurement it was taken during (NaN between measurements).
+The processed tables are cached in <experiment>/derived/ and only recomputed when the measurement files change.
+
+Example:
+    from perf_results import load_experiment
+    runs = load_experiment("outputs/exp_1")
+    df_unity, df_psutil = runs["30"]
+"""
+
+
+def add_derived_columns(df_unity, decision_period=10):
+    # Adds duration, env_time (seconds per step), throughput (steps per second over all envs) and fps
+    df = df_unity.copy()
+    df["duration"] = df["timestamp"] - df["start_timestamp"]
+    df["env_time"] = df["duration"] / df["num_iters"]
+    df["throughput"] = (df["num_iters"] / df["duration"]) * df["num_envs"]
+    df["fps"] = 1 / df["env_time"] * decision_period  # Each step runs decision_period frames
+    return df
+
+
+def measurement_intervals(df_unity):
+    """Returns the start time, end time and num_envs of each measurement, sorted by the start time"""
+    grouped = df_unity.groupby("start_timestamp")
+    intervals = pd.DataFrame({
+        "start": grouped["start_timestamp"].max(),
+        "end": grouped["start_timestamp"].max() + grouped["exec_time"].max(),
+        "num_envs": grouped["num_envs"].max(),
+    })
+    return intervals.sort_values("start").reset_index(drop=True)
+
+
+def assign_num_envs(df_psutil, df_unity):
+    """Adds num_envs to the psutil samples: the number of envs of the measurement that was running
+    at the time of the sample, NaN if no measurement was running"""
+    intervals = measurement_intervals(df_unity)
+    timestamps = df_psutil["timestamp"].to_numpy()
+    # Index of the last measurement that started before each sample
+    index = np.searchsorted(intervals["start"].to_numpy(), timestamps, side="right") - 1
+    valid = index >= 0
+    valid[valid] = timestamps[valid] < intervals["end"].to_numpy()[index[valid]]
+    num_envs = np.full(len(timestamps), np.nan)
+    num_envs[valid] = intervals["num_envs"].to_numpy()[index[valid]]
+    df = df_psutil.copy()
+    df["num_envs"] = num_envs
+    return df
+
+
+def _signature(paths):
+    # Changes when any of the files changes
+    return [[os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in paths]
+
+
+def process_run(experiment_path, run, decision_period=10, use_cache=True):
+    """Returns the processed (unity, psutil) tables of one run, see the module docstring"""
+    sources = [os.path.join(experiment_path, f"{name}_{run}.feather") for name in ["unity", "psutil"]]
+    derived_dir = os.path.join(experiment_path, "derived")
+    cached = [os.path.join(derived_dir, f"{name}_{run}.feather") for name in ["unity", "psutil"]]
+    manifest_path = os.path.join(derived_dir, f"{run}.json")
+    signature = {"sources": _signature(sources), "decision_period": decision_period}
+
+    if use_cache and os.path.isfile(manifest_path) and all(os.path.isfile(path) for path in cached):
+        with open(manifest_path) as f:
+            if json.load(f) == signature:
+                return tuple(pd.read_feather(path) for path in cached)
+
+    df_unity = pd.read_feather(sources[0])
+    df_psutil = pd.read_feather(sources[1])
+    df_unity = add_derived_columns(df_unity, decision_period)
+    df_psutil = assign_num_envs(df_psutil, df_unity)
+
+    os.makedirs(derived_dir, exist_ok=True)
+    for df, path in zip([df_unity, df_psutil], cached):
+        df.to_feather(path)
+    with open(manifest_path, "w") as f:
+        json.dump(signature, f)
+    return df_unity, df_psutil
+
+
+def find_runs(experiment_path):
+    # Runs that have both measurement files
+    runs = [os.path.basename(path)[len("unity_"):-len(".feather")]
+            for path in glob.glob(os.path.join(glob.escape(experiment_path), "unity_*.feather"))]
+    runs = [run for run in runs if os.path.isfile(os.path.join(experiment_path, f"psutil_{run}.feather"))]
+    # Numeric runs (amounts of audio sources) in numeric order
+    return sorted(runs, key=lambda run: (not run.isdigit(), int(run) if run.isdigit() else 0, run))
+
+
+def load_experiment(experiment_path, runs=None, decision_period=10):
+    """Returns run -> (unity, psutil) for the given runs (default: all runs of the experiment)"""
+    runs = find_runs(experiment_path) if runs is None else runs
+    return {run: process_run(experiment_path, run, decision_period) for run in runs}
+
+
+def load_experiments(outputs_path="outputs", decision_period=10):
+    """Returns experiment folder name -> run -> (unity, psutil) for all experiments in outputs_path.
+    Only new or changed runs are processed, the others are loaded from the cache."""
+    experiments = {}
+    for experiment_path in sorted(glob.glob(os.path.join(glob.escape(outputs_path), "*", ""))):
+        runs = find_runs(experiment_path)
+        if runs:
+            name = os.path.basename(os.path.normpath(experiment_path))
+            experiments[name] = load_experiment(experiment_path, runs, decision_period)
+    return experiments
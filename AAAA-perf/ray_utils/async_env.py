@@ -0,0 +1,164 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import List, Optional
+
+from ray.rllib.utils.typing import MultiAgentDict
+
+from .unity_env import BetterUnity3DEnv
+
+
+class AsyncUnity3DEnv:
+    """asyncio interface for a BetterUnity3DEnv.
+
+    `step` sends the actions and awaits the reply of Unity without blocking the
+    event loop, so a single thread can keep many Unity instances in flight
+    (see `step_all`). The ML-Agents communicator hands the messages over a
+    pipe between the gRPC server thread and the caller. The step message is
+    sent to that pipe directly and the reply is awaited with `loop.add_reader`,
+    instead of blocking in `UnityEnvironment.step`.
+
+    Event loops without `add_reader` support (e.g. the Proactor loop on Windows)
+    and the first message of an instance fall back to running the blocking
+    step in `executor`.
+
+    If a step times out or is cancelled, the reply of Unity is still pending
+    and the instance can not be used anymore, it should be closed.
+
+    Example:
+        envs = [AsyncUnity3DEnv(env, timeout=30) for env in launch_many(100, file_name=path)[0]]
+        results = asyncio.run(step_all(envs, max_in_flight=64))
+    """
+
+    def __init__(self, env: BetterUnity3DEnv, timeout: Optional[float] = None, executor: Optional[Executor] = None):
+        """
+        Args:
+            env: The environment to step.
+            timeout: Seconds to wait for the reply of Unity to one step (None for no limit).
+            executor: Executor for the blocking fallback (default executor of the loop if None).
+        """
+        self.env = env
+        self.timeout = timeout
+        self.executor = executor
+        self.broken = False  # True after a step was interrupted
+
+    async def step(self, action_dict: MultiAgentDict):
+        """Same as BetterUnity3DEnv.step."""
+        _, results = await self._step_and_collect(action_dict, self.env._collect_step_results)
+        return results
+
+    async def step_batched(self, action_dict: MultiAgentDict):
+        """Same as BetterUnity3DEnv.step_batched."""
+        _, results = await self._step_and_collect(action_dict, self.env._collect_step_batches)
+        return results
+
+    async def reset(self):
+        """Same as BetterUnity3DEnv.reset. Resets of Unity run in the executor."""
+        self._check_usable()
+        if self.env.soft_horizon or self.env._unity_state_fresh:
+            return self.env.reset()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.env.reset)
+
+    def close(self):
+        self.env.close()
+
+    def _check_usable(self):
+        if self.broken:
+            raise RuntimeError(f"Unity env (worker id {self.env.worker_id}) was interrupted during a step, close it")
+
+    async def _step_and_collect(self, action_dict: MultiAgentDict, collect):
+        # Same as BetterUnity3DEnv._step_and_collect, but awaits the Unity step
+        self._check_usable()
+        env = self.env
+        profiler = env.profiler
+        start = time.perf_counter_ns() if profiler is not None else 0
+        all_agents = env._set_actions(action_dict)
+        actions_set = time.perf_counter_ns() if profiler is not None else 0
+        try:
+            await self._unity_step()
+        except BaseException:
+            self.broken = True
+            raise
+        stepped = time.perf_counter_ns() if profiler is not None else 0
+        env._get_steps_ns = 0
+        results = collect()
+        if profiler is not None:
+            env._record_step_profile(start, actions_set, stepped, time.perf_counter_ns())
+        return all_agents, results
+
+    async def _unity_step(self):
+        unity_env = self.env.unity_env
+        loop = asyncio.get_running_loop()
+        connection = getattr(getattr(getattr(unity_env, "_communicator", None), "unity_to_external", None),
+                             "parent_conn", None)
+        if connection is None or unity_env._is_first_message or not unity_env._loaded:
+            # Editor connections, older ML-Agents versions and the first (reset) message
+            await asyncio.wait_for(loop.run_in_executor(self.executor, unity_env.step), self.timeout)
+            return
+
+        from mlagents_envs.communicator_objects.unity_message_pb2 import UnityMessageProto
+        from mlagents_envs.exception import UnityCommunicatorMightStillBeAliveException, UnityTimeOutException
+
+        reply = loop.create_future()
+        try:
+            loop.add_reader(connection.fileno(), lambda: reply.done() or reply.set_result(None))
+        except NotImplementedError:
+            await asyncio.wait_for(loop.run_in_executor(self.executor, unity_env.step), self.timeout)
+            return
+
+        try:
+            # Same as UnityEnvironment.step and RpcCommunicator.exchange, without the blocking wait
+            for behavior_name, spec in unity_env._env_specs.items():
+                if behavior_name not in unity_env._env_actions:
+                    num_agents = len(unity_env._env_state[behavior_name][0]) if behavior_name in unity_env._env_state else 0
+                    unity_env._env_actions[behavior_name] = spec.action_spec.empty_action(num_agents)
+            message = UnityMessageProto()
+            message.header.status = 200
+            message.unity_input.CopyFrom(unity_env._generate_step_input(unity_env._env_actions))
+            connection.send(message)
+            # Check every second whether Unity exited, like RpcCommunicator.poll_for_timeout
+            deadline = None if self.timeout is None else loop.time() + self.timeout
+            while True:
+                wait = 1.0 if deadline is None else min(1.0, deadline - loop.time())
+                if wait <= 0:
+                    raise UnityTimeOutException(
+                        f"Unity env (worker id {self.env.worker_id}) did not respond within {self.timeout} s"
+                    )
+                done, _ = await asyncio.wait([reply], timeout=wait)
+                if done:
+                    break
+                unity_env._poll_process()  # Raises if Unity exited
+        finally:
+            loop.remove_reader(connection.fileno())
+
+        output = connection.recv()
+        if output.header.status != 200:
+            raise UnityCommunicatorMightStillBeAliveException("Communicator has exited.")
+        outputs = output.unity_output
+        unity_env._update_behavior_specs(outputs)
+        unity_env._update_state(outputs.rl_output)
+        unity_env._env_actions.clear()
+
+
+async def step_all(envs: List[AsyncUnity3DEnv], actions: Optional[list] = None,
+                   max_in_flight: Optional[int] = None, batched: bool = False) -> list:
+    """Steps all envs concurrently from one event loop.
+    Args:
+        envs: The environments.
+        actions: One action dict per env (empty actions if None).
+        max_in_flight: Maximum number of envs stepping at the same time (no limit if None).
+        batched: Use step_batched instead of step.
+    Returns:
+        list: The step results of each env. If the step of an env failed
+            (e.g. timed out), its exception is returned instead.
+    """
+    actions = actions if actions is not None else [{} for _ in envs]
+    semaphore = asyncio.Semaphore(max_in_flight or len(envs) or 1)
+
+    async def run(env, action_dict):
+        async with semaphore:
+            return await (env.step_batched(action_dict) if batched else env.step(action_dict))
+
+    return await asyncio.gather(*(run(env, action_dict) for env, action_dict in zip(envs, actions)),
+                                return_exceptions=True)
@@ -0,0 +1,269 @@
+"""Multi-listener scaling benchmark.
+
+Measures the throughput of a Unity build with different numbers of listeners
+(Unity instances), audio sources and decision periods, and optionally
+compares the results to a stored baseline.
+
+Usage (from AAAA-perf/):
+    python -m ray_utils.benchmark --build ../builds/aaaa/audio.x86_64 \\
+        --listeners 1,2,4,8,16,32,40 --audio-sources 1,10,30 --output outputs/bench.json
+    python -m ray_utils.benchmark --build ... --baseline baselines/linux.json --tolerance 0.1
+    python -m ray_utils.benchmark --mock --listeners 1,8,40  # Python overhead only (see mock_unity.py)
+
+The exit code is 1, if the throughput of any configuration is lower than the baseline.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+from .env_pool import UnityEnvPool
+from .mock_unity import mock_unity
+from .profiling import merged_stats
+from .telemetry import TelemetryCollector
+
+# Two-sided 95 % quantiles of the t-distribution for 1..30 degrees of freedom
+_T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+# Columns that identify a configuration in the results and the baseline
+CONFIG_KEYS = ["audio_sources", "decision_period", "listeners"]
+
+
+def mean_ci(values) -> tuple:
+    """Returns the mean and the half width of its 95 % confidence interval."""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return float(values.mean()) if len(values) else float("nan"), float("nan")
+    dof = len(values) - 1
+    t = _T_95[dof - 1] if dof <= len(_T_95) else 1.96
+    return float(values.mean()), float(t * values.std(ddof=1) / math.sqrt(len(values)))
+
+
+def parse_list(text: str) -> List[int]:
+    """Parses "1,2,4" or "1-40" or "1-40:5" (range with step) or combinations like "1,2,4-40:4"."""
+    values = []
+    for part in text.split(","):
+        if "-" in part:
+            bounds, _, step = part.partition(":")
+            start, end = bounds.split("-")
+            values.extend(range(int(start), int(end) + 1, int(step or 1)))
+        else:
+            values.append(int(part))
+    return sorted(set(values))
+
+
+def run_trial(envs, steps: int, executor: ThreadPoolExecutor) -> tuple:
+    """Steps every env `steps` times concurrently. All envs start at the same time (barrier).
+    Returns:
+        tuple: (wall time of the whole trial, list of the run times of each env, monotonic start and end)
+    """
+    barrier = threading.Barrier(len(envs) + 1)
+
+    def run(env):
+        barrier.wait()
+        start, start_monotonic = time.perf_counter(), time.monotonic()
+        for _ in range(steps):
+            env.step({})
+        return start, start_monotonic, time.perf_counter()
+
+    futures = [executor.submit(run, env) for env in envs]
+    barrier.wait()  # Released when every env is ready to step
+    runs = [future.result() for future in futures]
+    # The trial starts with the first env that steps: the main thread may only return from
+    # the barrier after the envs are already stepping
+    wall_time = max(end for _, _, end in runs) - min(start for start, _, _ in runs)
+    env_times = [end - start for start, _, end in runs]
+    start_monotonic = min(start_monotonic for _, start_monotonic, _ in runs)
+    return wall_time, env_times, start_monotonic, time.monotonic()
+
+
+def _resource_usage(collector: TelemetryCollector, intervals: list) -> dict:
+    # Mean resource usage during the trials
+    system, processes = collector.system_frame(), collector.process_frame()
+
+    def during_trials(df):
+        if df.empty:
+            return df
+        mask = np.zeros(len(df), dtype=bool)
+        for start, end in intervals:
+            mask |= (df["monotonic"] >= start).to_numpy() & (df["monotonic"] <= end).to_numpy()
+        return df[mask]
+    system, processes = during_trials(system), during_trials(processes)
+    usage = {
+        "cpu_percent": float(system["CPU Percent"].mean()) if len(system) else float("nan"),
+        "memory_percent": float(system["Memory Percent"].mean()) if len(system) else float("nan"),
+    }
+    if len(processes):
+        per_instance = processes.groupby("worker_id").agg(cpu=("cpu_percent", "mean"), rss=("rss", "mean"))
+        usage["instance_cpu_percent"] = float(per_instance["cpu"].mean())
+        usage["instance_rss_mb"] = float(per_instance["rss"].mean() / 2 ** 20)
+    return usage
+
+
+def benchmark_config(pool, collector, listeners, audio_sources, decision_period, agent, target_speed,
+                     warmup, trials, steps) -> dict:
+    envs = pool.lease(listeners, audio_sources=audio_sources, decision_period=decision_period,
+                      agent=agent, target_speed=target_speed)
+    try:
+        collector.watch({env.worker_id: env.pid for env in envs if env.pid is not None})
+        with ThreadPoolExecutor(max_workers=listeners) as executor:
+            # Warmup, not measured
+            for env in envs:
+                env.reset()
+            if warmup > 0:
+                run_trial(envs, warmup, executor)
+            for env in envs:
+                env.enable_profiling()
+
+            steps_per_sec, fps, intervals, env_step_times = [], [], [], []
+            for _ in range(trials):
+                wall_time, env_times, start, end = run_trial(envs, steps, executor)
+                steps_per_sec.append(listeners * steps / wall_time)
+                # Each step advances the simulation by decision_period frames
+                fps.append(np.mean([steps * decision_period / env_time for env_time in env_times]))
+                env_step_times.extend(env_time / steps for env_time in env_times)
+                intervals.append((start, end))
+        latency = merged_stats([env.profiler for env in envs]).set_index("stage")
+    finally:
+        for env in envs:
+            env.disable_profiling()
+        pool.release(envs)
+
+    steps_per_sec_mean, steps_per_sec_ci = mean_ci(steps_per_sec)
+    fps_mean, fps_ci = mean_ci(fps)
+    result = {
+        "audio_sources": audio_sources,
+        "decision_period": decision_period,
+        "listeners": listeners,
+        "trials": trials,
+        "steps": steps,
+        "steps_per_sec": steps_per_sec_mean,
+        "steps_per_sec_ci95": steps_per_sec_ci,
+        "fps": fps_mean,
+        "fps_ci95": fps_ci,
+        "env_step_ms_mean": float(np.mean(env_step_times) * 1000),
+        "env_step_ms_max": float(np.max(env_step_times) * 1000),
+    }
+    # Latency percentiles of single steps over all envs (see profiling.py)
+    for stage in ["total", "unity_step", "set_actions", "post_process"]:
+        for stat in ["p50_ms", "p99_ms"]:
+            result[f"{stage}_{stat}"] = float(latency.loc[stage, stat])
+    result.update(_resource_usage(collector, intervals))
+    return result
+
+
+def compare_to_baseline(results: list, baseline: list, tolerance: float) -> list:
+    """Returns the configurations whose throughput is more than `tolerance` (fraction) below the baseline."""
+    baseline_by_config = {tuple(row[key] for key in CONFIG_KEYS): row for row in baseline}
+    regressions = []
+    for row in results:
+        reference = baseline_by_config.get(tuple(row[key] for key in CONFIG_KEYS))
+        if reference is None:
+            continue
+        change = row["steps_per_sec"] / reference["steps_per_sec"] - 1
+        status = "REGRESSION" if change < -tolerance else "ok"
+        print(f"audio_sources={row['audio_sources']} decision_period={row['decision_period']} "
+              f"listeners={row['listeners']}: {row['steps_per_sec']:.1f} steps/s "
+              f"(baseline {reference['steps_per_sec']:.1f}, {change:+.1%}) {status}")
+        if status != "ok":
+            regressions.append(dict(row, baseline_steps_per_sec=reference["steps_per_sec"], change=change))
+    return regressions
+
+
+def _build_info(build_path: Optional[str]) -> dict:
+    if build_path is None:
+        return {"path": "mock"}
+    stat = os.stat(build_path)
+    return {"path": os.path.abspath(build_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Multi-listener scaling benchmark of a Unity build")
+    parser.add_argument("--build", default=None, help="Path to the Unity build")
+    parser.add_argument("--mock", action="store_true",
+                        help="Use MockUnityEnvironment instead of a build, to measure the Python layers only")
+    parser.add_argument("--mock-frame-latency", type=float, default=0.0,
+                        help="Seconds per simulated frame of the mock")
+    parser.add_argument("--mock-audio-source-latency", type=float, default=0.0,
+                        help="Additional seconds per simulated frame and audio source of the mock")
+    parser.add_argument("--listeners", default="1,2,4,8,16,32,40",
+                        help="Numbers of listeners (Unity instances), e.g. 1,2,4 or 1-40 or 1-40:4")
+    parser.add_argument("--audio-sources", default="1,10,30", help="Numbers of audio sources")
+    parser.add_argument("--decision-periods", default="10", help="Decision periods")
+    parser.add_argument("--agent", default="hanningAO", help="Agent type (-agent of the build)")
+    parser.add_argument("--target-speed", type=float, default=0.0, help="Target speed (-targetSpeed of the build)")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured steps per env before the trials")
+    parser.add_argument("--trials", type=int, default=5, help="Measured trials per configuration")
+    parser.add_argument("--steps", type=int, default=20, help="Steps per env in one trial")
+    parser.add_argument("--telemetry-interval", type=float, default=0.5, help="Seconds between resource samples")
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    parser.add_argument("--baseline", default=None, help="Compare the throughput to this result file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed relative throughput drop compared to the baseline")
+    parser.add_argument("--save-baseline", default=None, help="Also write the results to this baseline file")
+    parser.add_argument("--log-folder", default=None, help="Folder for the Unity logs")
+    args = parser.parse_args(argv)
+    if (args.build is None) == (not args.mock):
+        parser.error("Either --build or --mock is required")
+
+    listener_counts = parse_list(args.listeners)
+    env_kwargs = {}
+    if args.mock:
+        env_kwargs["unity_env_factory"] = mock_unity(frame_latency=args.mock_frame_latency,
+                                                     audio_source_latency=args.mock_audio_source_latency)
+    pool = UnityEnvPool(args.build or "mock", no_graphics=True, log_folder=args.log_folder, **env_kwargs)
+    collector = TelemetryCollector(interval=args.telemetry_interval, capacity=1 << 16)
+    collector.start()
+    results = []
+    try:
+        for audio_sources in parse_list(args.audio_sources):
+            for decision_period in parse_list(args.decision_periods):
+                for listeners in listener_counts:
+                    result = benchmark_config(pool, collector, listeners, audio_sources, decision_period,
+                                              args.agent, args.target_speed, args.warmup, args.trials, args.steps)
+                    print(f"audio_sources={audio_sources} decision_period={decision_period} listeners={listeners}: "
+                          f"{result['steps_per_sec']:.1f} ± {result['steps_per_sec_ci95']:.1f} steps/s, "
+                          f"{result['fps']:.1f} fps, step p99 {result['total_p99_ms']:.1f} ms")
+                    results.append(result)
+    finally:
+        collector.stop()
+        pool.close()
+
+    report = {
+        "build": _build_info(args.build),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "args": vars(args),
+        "results": results,
+    }
+    for path in [args.output, args.save_baseline]:
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(report, f, indent=1)
+            print(f"Saved results to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} configuration(s) are slower than the baseline {args.baseline}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+from collections import namedtuple
+from typing import List
+
+from .unity_env import BetterUnity3DEnv, launch_many
+
+# Settings of a Unity instance that can be changed without relaunching it
+EnvConfig = namedtuple("EnvConfig", ["audio_sources", "decision_period", "agent", "target_speed"])
+
+
+class UnityEnvPool:
+    """A pool of already started Unity instances that are reused between benchmark runs.
+
+    `lease` hands out instances with the requested configuration. Idle instances
+    with the same configuration are reused as is, other idle instances are
+    reconfigured in place (see BetterUnity3DEnv.configure) and only the remaining
+    ones are launched. Instances go back to the pool with `release`.
+
+    Example:
+        pool = UnityEnvPool(unity_build_path, no_graphics=True)
+        for audio_sources in [1, 10, 30]:
+            envs = pool.lease(40, audio_sources=audio_sources)
+            ...
+            pool.release(envs)
+        pool.close()
+    """
+
+    def __init__(self, file_name: str, reconfigure: bool = True, seed: int = 0, **env_kwargs):
+        """
+        Args:
+            file_name: Path to the Unity build.
+            reconfigure: Whether idle instances can be reconfigured in place. Builds
+                without the ExperimentSetup parameter callbacks do not acknowledge
+                the change, in that case the instance is relaunched instead.
+            seed: Seed of the first launched instance, every new instance gets the next one.
+            env_kwargs: Other arguments for BetterUnity3DEnv (except args).
+        """
+        self.file_name = file_name
+        self.reconfigure = reconfigure
+        self.env_kwargs = env_kwargs
+        self._next_seed = seed
+        self._idle = []  # Idle instances, the most recently released last
+        self._configs = {}  # env -> EnvConfig for all instances of the pool
+
+    @staticmethod
+    def _to_args(config: EnvConfig) -> list:
+        return [
+            "-audioSources", f"{config.audio_sources}",
+            "-decisionPeriod", f"{config.decision_period}",
+            "-agent", config.agent,
+            "-targetSpeed", f"{config.target_speed}",
+        ]
+
+    def lease(
+            self,
+            n: int,
+            audio_sources: int = 1,
+            decision_period: int = 10,
+            agent: str = "hanningAO",
+            target_speed: float = 0.0,
+    ) -> List[BetterUnity3DEnv]:
+        """Hands out n instances with the given configuration (see the build args)."""
+        config = EnvConfig(audio_sources, decision_period, agent, target_speed)
+        envs = []
+        # Idle instances that already use this configuration
+        for env in [env for env in self._idle if self._configs[env] == config][:n]:
+            self._idle.remove(env)
+            env.reset()
+            envs.append(env)
+        # Reconfigure other idle instances in place
+        while len(envs) < n and self._idle and self.reconfigure:
+            env = self._idle.pop()
+            if env.configure(**config._asdict()):
+                self._configs[env] = config
+                envs.append(env)
+            else:
+                print("Unity instance did not acknowledge the new configuration, relaunching it instead")
+                self._close_env(env)
+        # Launch the rest
+        missing = n - len(envs)
+        if missing > 0:
+            new_envs, _ = launch_many(
+                missing,
+                seed=self._next_seed,
+                file_name=self.file_name,
+                args=self._to_args(config),
+                **self.env_kwargs,
+            )
+            self._next_seed += missing
+            for env in new_envs:
+                self._configs[env] = config
+            envs.extend(new_envs)
+        return envs
+
+    def release(self, envs: List[BetterUnity3DEnv]):
+        """Returns leased instances to the pool."""
+        for env in envs:
+            if env in self._configs and env not in self._idle:
+                self._idle.append(env)
+
+    def pids(self) -> dict:
+        """Returns worker id -> process id of all running instances of the pool (see telemetry.py)."""
+        return {env.worker_id: env.pid for env in self._configs if env.pid is not None}
+
+    def _close_env(self, env):
+        self._configs.pop(env, None)
+        try:
+            env.close()
+        except Exception as e:
+            print(f"Could not close env: {e}")
+
+    def close(self):
+        """Closes all instances of the pool, including leased ones."""
+        for env in list(self._configs):
+            self._close_env(env)
+        self._idle = []
@@ -0,0 +1,394 @@
+"""Stand-ins for the Unity build, to measure the Python layers without the simulator.
+
+MockUnityEnvironment implements the part of mlagents_envs.environment.UnityEnvironment that
+BetterUnity3DEnv uses (behavior_specs, get_steps, set_actions, step, reset, close, API_VERSION),
+with numpy observations and an artificial step latency instead of a Unity process:
+
+    env = BetterUnity3DEnv(file_name="mock", unity_env_factory=mock_unity(num_agents=4, frame_latency=0.001))
+
+The environment parameters of the build (-audioSources, -decisionPeriod, -agent, also through
+BetterUnity3DEnv.configure) are parsed and acknowledged like ExperimentSetup.cs does, so UnityEnvPool and
+the benchmark CLI (--mock) work unchanged. A step takes decision_period * (frame_latency + audio_sources *
+audio_source_latency) seconds.
+
+Run as a script, this module is a fake build for auto_eval.py: it parses the same args as the player and
+writes benchmark csv files with the columns of the real ones (logs/<Agent>_<name>_<scene>.csv), but the
+agent just walks towards the target. `python -m ray_utils.mock_unity --write-build builds/mock/audio.x86_64`
+creates an executable that runs it, which can be passed to auto_eval.py --build_path. The fake build does not
+implement the gRPC protocol, so it can not be used with auto_eval.py --serve or BetterUnity3DEnv.
+"""
+import functools
+import math
+import os
+import stat
+import struct
+import sys
+import time
+import uuid
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Behavior names of the agent prefabs, by -agent (see BetterUnity3DEnv.AGENT_TYPES)
+BEHAVIOR_NAMES = {"hanning": "HanningAgent", "random": "RandomAgent", "rect": "RectAgent",
+                  "hanningao": "HanningAgentAO", "rectao": "RectAgentAO"}
+# Same as ExperimentSetup.AgentType (csv names and the "agent" parameter)
+AGENT_TYPE_NAMES = ["Hanning", "Random", "Rect", "HanningAO", "RectAO"]
+# Scenes of the build, in build order (ProjectSettings/EditorBuildSettings.asset)
+SCENES = ["Medium", "Simple", "Complex"]
+
+# Side channel ids of EnvironmentParametersChannel and StatsSideChannel
+_PARAMETERS_CHANNEL_ID = uuid.UUID("534c891e-810f-11ea-a9d0-822485860400")
+_STATS_CHANNEL_ID = uuid.UUID("a1d8f7b7-cec8-50f9-b78b-d3e165a78520")
+_MOST_RECENT = 1  # StatsAggregationMethod.MOST_RECENT
+
+
+def _parse_build_args(args: Sequence[str]) -> dict:
+    # Same arguments as ExperimentSetup.ParseArgs (case insensitive), unknown ones are ignored
+    values = {"agent": "hanning", "decisionperiod": 1, "audiosources": 1, "targetspeed": 0.0, "name": "unnamed",
+              "seed": -1, "model": None, "benchmark": False, "smoketest": False, "mockframelatency": 0.0}
+    args = list(args)
+    for i, arg in enumerate(args):
+        key = arg.lower().lstrip("-")
+        if key in ("benchmark", "smoketest"):
+            values[key] = True
+        elif key in values and i + 1 < len(args):
+            default = values[key]
+            values[key] = type(default)(args[i + 1]) if default is not None else args[i + 1]
+    if values["agent"].lower() not in BEHAVIOR_NAMES:
+        raise ValueError(f"Invalid agent type {values['agent']}")
+    values["agent"] = values["agent"].lower()
+    return values
+
+
+class MockUnityEnvironment:
+    """Replaces UnityEnvironment (see the module docstring). One behavior with `num_agents` agents that
+    request a decision every step. Observations are random, the rewards are 0, and every agent is
+    interrupted after `episode_length` steps."""
+
+    API_VERSION = "1.5.0"
+
+    def __init__(
+            self,
+            file_name: Optional[str] = None,
+            worker_id: int = 0,
+            base_port: Optional[int] = None,
+            seed: int = 0,
+            no_graphics: bool = False,
+            timeout_wait: int = 60,
+            side_channels: Optional[list] = None,
+            additional_args: Optional[List[str]] = None,
+            log_folder: Optional[str] = None,
+            num_agents: int = 1,
+            observation_shapes: Sequence[Tuple[int, ...]] = ((32, 32, 4),),
+            action_size: int = 3,
+            behavior_name: Optional[str] = None,
+            frame_latency: float = 0.0,
+            audio_source_latency: float = 0.0,
+            episode_length: Optional[int] = 1000,
+            startup_latency: float = 0.0,
+    ):
+        """
+        Args:
+            file_name, worker_id, base_port, no_graphics, timeout_wait, log_folder: Ignored,
+                same arguments as UnityEnvironment.
+            seed: Seed of the observations.
+            side_channels: Side channels, the environment parameters are acknowledged through the StatsSideChannel.
+            additional_args: Args of the build, -agent, -decisionPeriod and -audioSources are used.
+            num_agents: Number of agents.
+            observation_shapes: Shape of each observation of an agent.
+            action_size: Number of continuous actions.
+            behavior_name: Name of the behavior (without "?team=0"). Default: The agent prefab of -agent.
+            frame_latency: Seconds per simulated frame.
+            audio_source_latency: Additional seconds per simulated frame and audio source.
+            episode_length: Steps after which the agents are interrupted (never if None).
+            startup_latency: Seconds the constructor takes, like starting the build.
+        """
+        from mlagents_envs.side_channel.side_channel_manager import SideChannelManager
+
+        build_args = _parse_build_args(additional_args or [])
+        self.worker_id = worker_id
+        self.num_agents = num_agents
+        self.observation_shapes = [tuple(shape) for shape in observation_shapes]
+        self.action_size = action_size
+        self.frame_latency = frame_latency
+        self.audio_source_latency = audio_source_latency
+        self.episode_length = episode_length
+        self._fixed_behavior_name = behavior_name
+        # Values of the environment parameters, same names as in ExperimentSetup.cs
+        self.parameters = {
+            "agent": float(list(BEHAVIOR_NAMES).index(build_args["agent"])),
+            "decisionPeriod": float(build_args["decisionperiod"]),
+            "audioSources": float(build_args["audiosources"]),
+            "targetSpeed": build_args["targetspeed"],
+        }
+        self._side_channel_manager = SideChannelManager(side_channels)
+        rng = np.random.default_rng(seed)
+        # Observations are copies of these, like the arrays decoded from the messages of Unity
+        self._obs_templates = [rng.uniform(-1, 1, (num_agents,) + shape).astype(np.float32)
+                               for shape in self.observation_shapes]
+        self._agent_id = np.arange(num_agents, dtype=np.int32)
+        self._env_specs = {}
+        self._env_state = {}
+        self._env_actions = {}
+        self._episode_steps = 0
+        self.total_steps = 0
+        # Attributes of UnityEnvironment that are checked by AsyncUnity3DEnv and BetterUnity3DEnv.pid
+        self._communicator = None
+        self._process = None
+        self._is_first_message = True
+        self._loaded = True
+        if startup_latency > 0:
+            time.sleep(startup_latency)
+
+    @property
+    def behavior_specs(self):
+        from mlagents_envs.base_env import BehaviorMapping
+
+        return BehaviorMapping(self._env_specs)
+
+    def _update_behavior_specs(self):
+        from mlagents_envs.base_env import ActionSpec, BehaviorSpec, DimensionProperty, ObservationSpec, ObservationType
+
+        name = self._fixed_behavior_name or BEHAVIOR_NAMES[list(BEHAVIOR_NAMES)[int(self.parameters["agent"])]]
+        observation_specs = [
+            ObservationSpec(shape, (DimensionProperty.UNSPECIFIED,) * len(shape), ObservationType.DEFAULT,
+                            f"AudioSensor_{i}")
+            for i, shape in enumerate(self.observation_shapes)
+        ]
+        self._env_specs = {f"{name}?team=0": BehaviorSpec(observation_specs, ActionSpec(self.action_size, ()))}
+        self._env_state = {key: value for key, value in self._env_state.items() if key in self._env_specs}
+
+    def _assert_behavior_exists(self, behavior_name: str):
+        from mlagents_envs.exception import UnityActionException
+
+        if behavior_name not in self._env_specs:
+            raise UnityActionException(
+                f"The group {behavior_name} does not correspond to an existing agent group in the environment"
+            )
+
+    def get_steps(self, behavior_name: str):
+        self._assert_behavior_exists(behavior_name)
+        return self._env_state[behavior_name]
+
+    def set_actions(self, behavior_name: str, action):
+        self._assert_behavior_exists(behavior_name)
+        if behavior_name not in self._env_state:
+            return
+        action_spec = self._env_specs[behavior_name].action_spec
+        num_agents = len(self._env_state[behavior_name][0])
+        self._env_actions[behavior_name] = action_spec._validate_action(action, num_agents, behavior_name)
+
+    def set_action_for_agent(self, behavior_name: str, agent_id: int, action):
+        self._assert_behavior_exists(behavior_name)
+        if behavior_name not in self._env_state:
+            return
+        action_spec = self._env_specs[behavior_name].action_spec
+        action = action_spec._validate_action(action, 1, behavior_name)
+        if behavior_name not in self._env_actions:
+            self._env_actions[behavior_name] = action_spec.empty_action(len(self._env_state[behavior_name][0]))
+        index = int(np.flatnonzero(self._env_state[behavior_name][0].agent_id == agent_id)[0])
+        self._env_actions[behavior_name].continuous[index] = action.continuous[0, :]
+
+    def reset(self):
+        self._check_loaded()
+        self._exchange_side_channels()
+        # Like Unity, the behaviors are only known after the first message
+        self._update_behavior_specs()
+        self._simulate()
+        self._episode_steps = 0
+        self._update_state(ended=False)
+        self._is_first_message = False
+        self._env_actions.clear()
+
+    def step(self):
+        if self._is_first_message:
+            return self.reset()
+        self._check_loaded()
+        self._exchange_side_channels()
+        self._simulate()
+        self._episode_steps += 1
+        self.total_steps += 1
+        ended = self.episode_length is not None and self._episode_steps >= self.episode_length
+        self._update_state(ended)
+        if ended:
+            self._episode_steps = 0
+        self._env_actions.clear()
+
+    def _simulate(self):
+        # Unity simulates decision_period frames between two decisions
+        latency = self.parameters["decisionPeriod"] * (
+            self.frame_latency + self.parameters["audioSources"] * self.audio_source_latency)
+        if latency > 0:
+            time.sleep(latency)
+
+    def _update_state(self, ended: bool):
+        from mlagents_envs.base_env import DecisionSteps, TerminalSteps
+
+        n = self.num_agents
+        obs = [template.copy() for template in self._obs_templates]
+        zeros = np.zeros(n, dtype=np.float32)
+        decision = DecisionSteps(obs, zeros, self._agent_id, None, np.zeros(n, dtype=np.int32), zeros)
+        if ended:
+            # The agents start their next episode in the same step (max step reached)
+            terminal = TerminalSteps([values.copy() for values in obs], zeros, np.ones(n, dtype=bool),
+                                     self._agent_id, np.zeros(n, dtype=np.int32), zeros)
+        else:
+            terminal = TerminalSteps.empty(next(iter(self._env_specs.values())))
+        self._env_state = {name: (decision, terminal) for name in self._env_specs}
+
+    def _exchange_side_channels(self):
+        # Applies the environment parameters sent by Python and acknowledges them like ExperimentSetup.cs
+        from mlagents_envs.side_channel import IncomingMessage, OutgoingMessage
+
+        data = self._side_channel_manager.generate_side_channel_messages()
+        reply = bytearray()
+        offset = 0
+        while offset < len(data):
+            channel_id = uuid.UUID(bytes_le=bytes(data[offset:offset + 16]))
+            length, = struct.unpack_from("<i", data, offset + 16)
+            message = IncomingMessage(bytes(data[offset + 20:offset + 20 + length]))
+            offset += 20 + length
+            if channel_id != _PARAMETERS_CHANNEL_ID:
+                continue
+            key = message.read_string()
+            if message.read_int32() != 0:  # Only float parameters are used by the build
+                continue
+            value = message.read_float32()
+            if key not in self.parameters:
+                continue
+            self.parameters[key] = value
+            ack = OutgoingMessage()
+            ack.write_string(f"Config/{key}")
+            ack.write_float32(value)
+            ack.write_int32(_MOST_RECENT)
+            reply += _STATS_CHANNEL_ID.bytes_le + struct.pack("<i", len(ack.buffer)) + ack.buffer
+            if key == "agent":
+                self._update_behavior_specs()
+        if reply:
+            self._side_channel_manager.process_side_channel_message(bytes(reply))
+
+    def _check_loaded(self):
+        from mlagents_envs.exception import UnityEnvironmentException
+
+        if not self._loaded:
+            raise UnityEnvironmentException("No Unity environment is loaded.")
+
+    def _poll_process(self):
+        pass
+
+    def close(self):
+        self._check_loaded()
+        self._loaded = False
+
+
+def mock_unity(**config) -> functools.partial:
+    """Returns a unity_env_factory for BetterUnity3DEnv that creates MockUnityEnvironments
+    with `config` (see MockUnityEnvironment). Can be pickled, e.g. for BetterUnity3DVecEnv."""
+    return functools.partial(MockUnityEnvironment, **config)
+
+
+def _benchmark_rows(scene: str, episodes: int, max_steps: int, seed_offset: int, decision_period: int,
+                    frame_latency: float):
+    # Rows of the csv of one scene, same columns as the IMeasurables of the build.
+    # The agent walks straight towards the target, with some noise.
+    for episode in range(episodes):
+        rng = np.random.default_rng([episode + seed_offset, SCENES.index(scene)])
+        agent = rng.uniform(-50, 50, 2)
+        target = rng.uniform(-50, 50, 2)
+        detour = rng.uniform(1.0, 1.5)  # Path length on the nav mesh / straight distance
+        reward = 0.0
+        for frame in range(1, max_steps + 2):
+            if frame_latency > 0:
+                time.sleep(frame_latency)
+            direction = target - agent
+            distance = float(np.linalg.norm(direction))
+            angle_to_target = math.atan2(direction[1], direction[0]) / math.pi
+            action_angle = float(np.clip(angle_to_target + rng.normal(0, 0.05), -1, 1))
+            step = 0.5 * np.array([math.cos(action_angle * math.pi), math.sin(action_angle * math.pi)])
+            agent = agent + step
+            reward += 0.001
+            yield [
+                episode, frame, f"{frame * 0.02:g}", int(frame >= max_steps), scene, max_steps,
+                f"{agent[0]:g}", "0", f"{agent[1]:g}", frame % decision_period, f"{angle_to_target:g}",
+                f"{action_angle:g}", "1", f"{reward:g}", f"{min(distance / 1000, 1):g}", "True", "True",
+                decision_period,
+                f"{distance * detour:g}", 2,
+                f"{target[0]:g}", "0", f"{target[1]:g}",
+                "footstep", 0, "1", f"{frame * 0.02 % 1:g}",
+                2048, frame % 2048,
+            ]
+            if distance < 1:
+                break
+
+
+CSV_COLUMNS = [
+    "Episode", "Frame", "Timestamp", "OutOfTime", "SceneName", "MaxSteps",
+    "AgentPositionX", "AgentPositionY", "AgentPositionZ", "StepsSinceAction", "AngleToTarget",
+    "ActionAngle", "ActionMagnitude", "RewardSum", "DistanceToTargetNormalized", "ActionLos", "TargetLos",
+    "DecisionPeriod",
+    "PathLength", "PathCorners",
+    "TargetPositionX", "TargetPositionY", "TargetPositionZ",
+    "ClipName", "ClipIndex", "ClipDuration", "ClipPosition",
+    "BufferLength", "BufferPosition",
+]
+
+
+def run_fake_build(argv: List[str], logs_dir: str = "logs") -> int:
+    """Runs the benchmark of a fake build with the args of the player (see the module docstring).
+    Returns:
+        int: Exit code.
+    """
+    try:
+        args = _parse_build_args(argv)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+    if not args["benchmark"]:
+        print("Mock build: only -benchmark is supported")
+        return 0
+    if args["model"] is None:
+        print("Mock build: -benchmark without -model needs a Python trainer, which the mock build does not support")
+        return 1
+    if not os.path.isfile(args["model"]):
+        print(f"ERROR: model {args['model']} not found")
+        return 1
+    episodes, max_steps = (5, 10) if args["smoketest"] else (20, 1000)
+    seed_offset = args["seed"] if args["seed"] >= 0 else 100
+    agent = AGENT_TYPE_NAMES[list(BEHAVIOR_NAMES).index(args["agent"])]
+    os.makedirs(logs_dir, exist_ok=True)
+    for scene in SCENES:
+        path = os.path.join(logs_dir, f"{agent}_{args['name']}_{scene}.csv")
+        if os.path.exists(path):
+            print(f"CSV file {path} already exists. Moving to next scene.")
+            continue
+        print(f"Logging to path: {path}")
+        with open(path, "w") as f:
+            f.write(";".join(CSV_COLUMNS) + ";\n")
+            for row in _benchmark_rows(scene, episodes, max_steps, seed_offset, args["decisionperiod"],
+                                       args["mockframelatency"]):
+                f.write(";".join(map(str, row)) + ";\n")
+    print("No more scenes to load. Exiting application.")
+    return 0
+
+
+def write_fake_build(path: str) -> str:
+    """Writes an executable (shell script) to `path` that runs the fake build with this Python interpreter.
+    Returns:
+        str: The path.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n")
+        f.write("# Fake Unity build, see ray_utils/mock_unity.py\n")
+        f.write(f'PYTHONPATH="{package_dir}${{PYTHONPATH:+:$PYTHONPATH}}" exec "{sys.executable}" -m ray_utils.mock_unity "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--write-build":
+        print(f"Wrote fake build to {write_fake_build(sys.argv[2])}")
+        sys.exit(0)
+    sys.exit(run_fake_build(sys.argv[1:]))
@@ -0,0 +1,117 @@
+"""Batched ONNX Runtime inference for ML-Agents models.
+
+Instead of every Unity instance running its own copy of the model at batch
+size 1 (-model), the observations of all instances that use the same model are
+stacked and evaluated with one forward pass per step:
+
+    policy = get_policy("results/hanning_ao-1/model.onnx")
+    batches = {env: env.get_step_batches() for env in envs}
+    actions = policy.act_many(batches)  # env -> {behavior name: actions}
+    for env in envs:
+        env.step_batched(actions[env])
+
+Only models exported by ML-Agents 2.x (inputs obs_0, obs_1, ..., outputs
+continuous_actions / discrete_actions) without memory are supported.
+"""
+import os
+import re
+from typing import Dict, Optional
+
+import numpy as np
+
+# (path, mtime) -> OnnxPolicy, see get_policy
+_POLICIES = {}
+
+
+class OnnxPolicy:
+    """An ML-Agents ONNX model in an ONNX Runtime CPU session."""
+
+    def __init__(self, path: str, deterministic: bool = False, intra_op_threads: Optional[int] = None):
+        """
+        Args:
+            path: Path to the .onnx file.
+            deterministic: Use the deterministic action outputs (if the model has them)
+                instead of sampling the actions. The player samples them by default.
+            intra_op_threads: Number of threads of one forward pass (default of ONNX Runtime if None).
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if intra_op_threads is not None:
+            options.intra_op_num_threads = intra_op_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        inputs = {node.name: node for node in self.session.get_inputs()}
+        outputs = {node.name for node in self.session.get_outputs()}
+        if "recurrent_in" in inputs:
+            raise ValueError(f"{path}: models with memory are not supported")
+        obs_inputs = sorted((int(match.group(1)), name) for name in inputs
+                            for match in [re.fullmatch(r"obs_(\d+)", name)] if match)
+        if not obs_inputs:
+            raise ValueError(f"{path}: no obs_<i> inputs, only models exported by ML-Agents 2.x are supported")
+        self.obs_inputs = [name for _, name in obs_inputs]
+        self.mask_input = inputs.get("action_masks")
+
+        self.action_outputs = {}  # "continuous"|"discrete" -> output name
+        for kind in ["continuous", "discrete"]:
+            name = f"{kind}_actions"
+            if deterministic and f"deterministic_{name}" in outputs:
+                name = f"deterministic_{name}"
+            if name in outputs:
+                self.action_outputs[kind] = name
+
+    def __call__(self, obs: list) -> Dict[str, np.ndarray]:
+        """Runs one forward pass.
+        Args:
+            obs: One array per observation of the behavior, with one row per agent.
+        Returns:
+            dict: "continuous" and/or "discrete" -> actions, one row per agent.
+        """
+        feed = {name: np.asarray(values, dtype=np.float32) for name, values in zip(self.obs_inputs, obs)}
+        if self.mask_input is not None:
+            # All discrete actions are allowed
+            feed[self.mask_input.name] = np.ones((len(obs[0]), self.mask_input.shape[1]), dtype=np.float32)
+        names = list(self.action_outputs.values())
+        return dict(zip(self.action_outputs, self.session.run(names, feed)))
+
+    def act_many(self, step_batches: dict, kind: str = None) -> dict:
+        """Computes the actions of the agents of many envs with one forward pass.
+        Args:
+            step_batches: key (e.g. the env) -> output of BetterUnity3DEnv.get_step_batches / step_batched.
+            kind: "continuous" or "discrete", the action type passed to the envs
+                (default: continuous, if the model has continuous actions).
+        Returns:
+            dict: key -> {behavior name: actions}, the action dict for BetterUnity3DEnv.step_batched.
+                Keys without requesting agents get an empty dict.
+        """
+        kind = kind or ("continuous" if "continuous" in self.action_outputs else "discrete")
+        rows = []  # (key, behavior name, decision batch)
+        for key, batches in step_batches.items():
+            for behavior_name, (decision, _) in batches.items():
+                if len(decision.agent_id):
+                    rows.append((key, behavior_name, decision))
+        actions = {key: {} for key in step_batches}
+        if not rows:
+            return actions
+        obs = [np.concatenate([decision.obs[i] for _, _, decision in rows]) for i in range(len(self.obs_inputs))]
+        output = self(obs)[kind]
+        start = 0
+        for key, behavior_name, decision in rows:
+            end = start + len(decision.agent_id)
+            actions[key][behavior_name] = output[start:end]
+            start = end
+        return actions
+
+
+def get_policy(path: str, deterministic: bool = False, intra_op_threads: Optional[int] = None) -> OnnxPolicy:
+    """Returns the cached OnnxPolicy of the model at `path`, so that every model is only loaded once.
+    The model is loaded again, if the file changed."""
+    path = os.path.abspath(path)
+    key = (path, os.stat(path).st_mtime_ns, deterministic, intra_op_threads)
+    policy = _POLICIES.get(key)
+    if policy is None:
+        # Drop older versions of the same file
+        for old_key in [old_key for old_key in _POLICIES if old_key[0] == path]:
+            del _POLICIES[old_key]
+        policy = _POLICIES[key] = OnnxPolicy(path, deterministic, intra_op_threads)
+    return policy
@@ -0,0 +1,168 @@
+import json
+from typing import Dict
+
+import pandas as pd
+
+# Each power of two range of values is split into this many linear buckets (2**5 = 32),
+# so a recorded value is off by at most 1/32 (~3 %) from the real value.
+_SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+# Values below this are recorded exactly
+_LINEAR_LIMIT = _SUB_BUCKETS * 2
+# Enough buckets for any 64 bit value
+_NUM_BUCKETS = (64 - _SUB_BUCKET_BITS + 1) * _SUB_BUCKETS
+
+
+def _bucket_index(value: int) -> int:
+    if value < _LINEAR_LIMIT:
+        return value
+    shift = value.bit_length() - _SUB_BUCKET_BITS - 1
+    return shift * _SUB_BUCKETS + (value >> shift)
+
+
+def _bucket_value(index: int) -> int:
+    # Middle of the value range of a bucket
+    if index < _LINEAR_LIMIT:
+        return index
+    shift = index // _SUB_BUCKETS - 1
+    return ((index - shift * _SUB_BUCKETS) << shift) + (1 << shift) // 2
+
+
+class LatencyHistogram:
+    """HDR-style histogram of latencies in nanoseconds.
+
+    Values are counted in log-linear buckets with a fixed relative precision,
+    so recording is O(1) and the memory use does not grow with the number of values.
+    """
+
+    def __init__(self):
+        self.counts = [0] * _NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value_ns: int):
+        value_ns = max(int(value_ns), 0)
+        self.counts[_bucket_index(value_ns)] += 1
+        self.count += 1
+        self.total += value_ns
+        if self.min is None or value_ns < self.min:
+            self.min = value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+
+    def percentile(self, percent: float) -> float:
+        """Returns the value (ns) below which the given percentage of the recorded values are."""
+        if self.count == 0:
+            return float("nan")
+        target = max(1, int(round(percent / 100 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                # The exact extremes are known
+                return float(min(max(_bucket_value(index), self.min), self.max))
+        return float(self.max)
+
+    def merge(self, other: "LatencyHistogram"):
+        """Adds the values of another histogram (e.g. from another env) to this one."""
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def summary(self) -> dict:
+        """Returns count, mean, p50, p90, p99 and max (in milliseconds)."""
+        to_ms = 1e-6
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * to_ms if self.count else float("nan"),
+            "p50_ms": self.percentile(50) * to_ms,
+            "p90_ms": self.percentile(90) * to_ms,
+            "p99_ms": self.percentile(99) * to_ms,
+            "max_ms": self.max * to_ms if self.count else float("nan"),
+        }
+
+    def to_dict(self) -> dict:
+        # Only the non-empty buckets
+        return {"buckets": {index: count for index, count in enumerate(self.counts) if count},
+                "count": self.count, "total": self.total, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        histogram = cls()
+        for index, count in data["buckets"].items():
+            histogram.counts[int(index)] = count
+        histogram.count, histogram.total = data["count"], data["total"]
+        histogram.min, histogram.max = data["min"], data["max"]
+        return histogram
+
+
+class StepProfiler:
+    """Latency histograms of the stages of BetterUnity3DEnv.step / step_batched.
+
+    Stages:
+        set_actions: Converting and sending the actions to ML-Agents (Python).
+        unity_step: The step RPC, i.e. waiting for the simulator.
+        get_steps: Reading the DecisionSteps and TerminalSteps from ML-Agents.
+        post_process: Building the results (obs/reward dicts or StepBatches) (Python).
+        total: The whole step.
+    """
+
+    STAGES = ["set_actions", "unity_step", "get_steps", "post_process", "total"]
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in self.STAGES}
+
+    def record(self, stage: str, value_ns: int):
+        self.histograms[stage].record(value_ns)
+
+    def reset(self):
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+
+    def merge(self, other: "StepProfiler"):
+        for stage, histogram in other.histograms.items():
+            self.histograms[stage].merge(histogram)
+
+    def stats(self) -> dict:
+        """Returns stage -> summary (see LatencyHistogram.summary)."""
+        return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def to_frame(self) -> pd.DataFrame:
+        """Returns the summaries as a DataFrame with one row per stage."""
+        return pd.DataFrame([dict(stage=stage, **summary) for stage, summary in self.stats().items()])
+
+    def to_dict(self) -> dict:
+        return {stage: histogram.to_dict() for stage, histogram in self.histograms.items()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StepProfiler":
+        profiler = cls()
+        for stage, histogram in data.items():
+            profiler.histograms[stage] = LatencyHistogram.from_dict(histogram)
+        return profiler
+
+    def save(self, path: str):
+        """Saves the full histograms as JSON (see load), so they can be merged later."""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str) -> "StepProfiler":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def merged_stats(profilers) -> pd.DataFrame:
+    """Merges the histograms of many envs (profilers or their to_dict()) and returns the summary per stage."""
+    merged = StepProfiler()
+    for profiler in profilers:
+        if isinstance(profiler, dict):
+            profiler = StepProfiler.from_dict(profiler)
+        merged.merge(profiler)
+    return merged.to_frame()
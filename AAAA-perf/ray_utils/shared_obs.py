@@ -0,0 +1,213 @@
+"""Shared-memory transport for large observations (audio spectrograms).
+
+With `-sharedObs <path>`, the Unity build writes the audio sensor observations
+into a memory-mapped file (SharedObservationMemory.cs) instead of sending them
+through gRPC. gRPC only carries a small reference per agent: the observation
+named `<sensor>_Shared` has three values (row, slot, tag) that locate the
+observation of the agent in the file. `SharedObservationBuffer.view` maps
+these references to numpy views of the file, without copying.
+
+File layout (little endian):
+    header: magic b"AOBS", version, num_slots, max_agents, ndim, shape[4] (uint32), padded to 64 bytes
+    tags:   int64[num_slots, max_agents], sequence number of the step each row was written in
+    obs:    float32[num_slots, max_agents, *shape], starting at the next multiple of 64 bytes
+
+Each step is written to slot `sequence % num_slots`, so the views of a step
+stay valid for the next `num_slots - 1` sequences. Unity starts a new sequence
+every step, and another one when an agent ends its episode after the
+observations of the step were sent (the terminal observation is sent with the
+next step), so a step with such episode ends shortens the validity by one step.
+
+MockObservationProducer writes to the same layout from Python, for testing
+without a Unity build:
+    producer = MockObservationProducer(path, num_agents=40, shape=(32, 32, 4))
+    buffer = SharedObservationBuffer.open(path)
+    obs = buffer.view(producer.step())  # (40, 32, 32, 4) view
+"""
+import mmap
+import os
+import struct
+import tempfile
+import time
+import uuid
+from typing import Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"AOBS"
+VERSION = 1
+HEADER = struct.Struct("<4sIIII4I")
+HEADER_SIZE = 64
+# Observations with this name suffix are references into the shared memory
+SHARED_SUFFIX = "_Shared"
+# The tag (sequence number modulo this) has to be exactly representable as float32
+TAG_MODULO = 1 << 24
+
+
+def _align(offset: int, alignment: int = 64) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def default_path() -> str:
+    """Returns a new file path in /dev/shm (RAM) if available, else in the temp folder."""
+    folder = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(folder, f"aaaa_obs_{os.getpid()}_{uuid.uuid4().hex[:8]}.bin")
+
+
+def file_size(num_slots: int, max_agents: int, shape: Tuple[int, ...]) -> int:
+    return _align(HEADER_SIZE + 8 * num_slots * max_agents) + 4 * num_slots * max_agents * int(np.prod(shape))
+
+
+class SharedObservationBuffer:
+    """Numpy views of a shared observation file (see the module docstring)."""
+
+    def __init__(self, path: str, file, mapping: mmap.mmap):
+        self.path = path
+        self._file = file
+        self._mmap = mapping
+        magic, version, self.num_slots, self.max_agents, ndim, *shape = HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a shared observation file (version {VERSION})")
+        self.shape = tuple(shape[:ndim])
+        tags_size = 8 * self.num_slots * self.max_agents
+        self.tags = np.frombuffer(mapping, np.int64, self.num_slots * self.max_agents, HEADER_SIZE).reshape(
+            self.num_slots, self.max_agents)
+        self.obs = np.frombuffer(mapping, np.float32, offset=_align(HEADER_SIZE + tags_size)).reshape(
+            (self.num_slots, self.max_agents) + self.shape)
+
+    @classmethod
+    def create(cls, path: str, num_slots: int, max_agents: int, shape: Tuple[int, ...]) -> "SharedObservationBuffer":
+        """Creates the file (done by Unity, or by MockObservationProducer)."""
+        size = file_size(num_slots, max_agents, shape)
+        with open(path, "wb") as f:
+            f.truncate(size)
+        f = open(path, "r+b")
+        mapping = mmap.mmap(f.fileno(), size)
+        dims = list(shape) + [0] * (4 - len(shape))
+        mapping[:HEADER.size] = HEADER.pack(MAGIC, VERSION, num_slots, max_agents, len(shape), *dims)
+        buffer = cls(path, f, mapping)
+        buffer.tags[:] = -1
+        return buffer
+
+    @classmethod
+    def open(cls, path: str, timeout: float = 30) -> "SharedObservationBuffer":
+        """Maps an existing file. Waits up to `timeout` seconds for the writer to create it."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                f = open(path, "r+b")
+                if os.fstat(f.fileno()).st_size >= HEADER_SIZE and f.read(4) == MAGIC:
+                    break
+                f.close()
+            except FileNotFoundError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Shared observation file {path} was not created within {timeout} s")
+            time.sleep(0.05)
+        return cls(path, f, mmap.mmap(f.fileno(), 0))
+
+    def view(self, refs: np.ndarray) -> np.ndarray:
+        """Returns the observations referenced by the (row, slot, tag) rows of `refs`.
+        Returns:
+            np.ndarray: (len(refs), *shape) array. A view into the file (no copy),
+                if the rows are consecutive and in one slot (usual case), else a copy.
+        """
+        if len(refs) == 0:
+            return self.obs[0, :0]
+        rows = refs[:, 0].astype(np.intp)
+        slots = refs[:, 1].astype(np.intp)
+        if (self.tags[slots, rows] % TAG_MODULO != refs[:, 2]).any():
+            raise RuntimeError(f"Shared observations in {self.path} were overwritten before they were read")
+        slot = slots[0]
+        if (slots != slot).any():
+            # Terminal observations that were written after their step was sent are in the slot of the next sequence
+            return self.obs[slots, rows]
+        if rows[-1] - rows[0] == len(rows) - 1 and (len(rows) == 1 or (np.diff(rows) == 1).all()):
+            return self.obs[slot, rows[0]:rows[-1] + 1]
+        return self.obs[slot, rows]
+
+    def write(self, row: int, sequence: int, values: np.ndarray) -> np.ndarray:
+        """Writes the observation of one agent (producer side).
+        Returns:
+            np.ndarray: The (row, slot, tag) reference that is sent instead of the observation.
+        """
+        slot = sequence % self.num_slots
+        self.obs[slot, row] = values
+        self.tags[slot, row] = sequence
+        return np.array([row, slot, sequence % TAG_MODULO], dtype=np.float32)
+
+    def close(self, unlink: bool = False):
+        # The views have to be released before the mapping can be closed
+        self.tags = self.obs = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # Still referenced by views returned from `view`, closed when they are garbage collected
+        self._file.close()
+        if unlink:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class MockObservationProducer:
+    """Stands in for the Unity side: writes random spectrograms for `num_agents`
+    agents to a new shared observation file at every `step`."""
+
+    def __init__(self, path: str, num_agents: int, shape: Tuple[int, ...], num_slots: int = 4, seed: int = 0):
+        self.buffer = SharedObservationBuffer.create(path, num_slots, num_agents, shape)
+        self.num_agents = num_agents
+        self.sequence = 0
+        self._rng = np.random.default_rng(seed)
+
+    def step(self) -> np.ndarray:
+        """Writes the observations of the next step.
+        Returns:
+            np.ndarray: (num_agents, 3) references, i.e. the observation that gRPC carries.
+        """
+        slot = self.sequence % self.buffer.num_slots
+        self._rng.random(out=self.buffer.obs[slot, :self.num_agents], dtype=np.float32)
+        self.buffer.tags[slot, :self.num_agents] = self.sequence
+        refs = np.empty((self.num_agents, 3), dtype=np.float32)
+        refs[:, 0] = np.arange(self.num_agents)
+        refs[:, 1] = slot
+        refs[:, 2] = self.sequence % TAG_MODULO
+        self.sequence += 1
+        return refs
+
+    def close(self):
+        self.buffer.close(unlink=True)
+
+
+def benchmark(num_agents: int = 40, shape: Tuple[int, ...] = (32, 32, 4), steps: int = 1000,
+              path: Optional[str] = None) -> dict:
+    """Compares the per-step Python cost of reading the observations through the
+    shared memory with deserializing them from a protobuf-like byte string."""
+    path = path or default_path()
+    producer = MockObservationProducer(path, num_agents, shape)
+    buffer = SharedObservationBuffer.open(path)
+    shared = copied = 0
+    try:
+        # Only the consumer side is timed
+        payload = [producer.buffer.obs[0, i].tobytes() for i in range(num_agents)]
+        for _ in range(steps):
+            refs = producer.step()
+            start = time.perf_counter()
+            obs = buffer.view(refs)
+            per_agent = list(obs)  # Per-agent rows as in BetterUnity3DEnv._get_step_results
+            shared += time.perf_counter() - start
+
+            start = time.perf_counter()
+            obs = np.stack([np.frombuffer(data, np.float32).reshape(shape) for data in payload])
+            per_agent = list(obs)
+            copied += time.perf_counter() - start
+    finally:
+        del obs, per_agent
+        buffer.close()
+        producer.close()
+    return {"shared_ms": shared / steps * 1000, "copy_ms": copied / steps * 1000}
+
+
+if __name__ == "__main__":
+    print(benchmark())
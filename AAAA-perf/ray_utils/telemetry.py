@@ -0,0 +1,291 @@
+import glob
+import os
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import psutil
+
+# Columns of the system samples. The names match the old PsutilCollector of measure.ipynb,
+# so plot.ipynb works with both.
+SYSTEM_COLUMNS = [
+    "timestamp", "monotonic", "CPU Percent", "Memory Percent",
+    "Disk Read Bytes", "Disk Write Bytes", "Network Bytes Sent", "Network Bytes Received",
+]
+GPU_COLUMNS = ["GPU Percent", "GPU Memory Percent"]
+# Columns of the per-process samples, one row per watched process and sample
+PROCESS_COLUMNS = ["timestamp", "monotonic", "worker_id", "pid", "cpu_percent", "rss", "num_threads"]
+
+
+class RingBuffer:
+    """A preallocated table of float64 rows. When full, the oldest rows are overwritten.
+
+    Rows that were not yet drained and get overwritten are counted in `dropped`.
+    """
+
+    def __init__(self, columns: List[str], capacity: int):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.data = np.full((capacity, len(self.columns)), np.nan)
+        self.dropped = 0
+        self._written = 0  # Total number of appended rows
+        self._drained = 0  # Total number of drained rows
+
+    def append(self, row):
+        self.data[self._written % self.capacity] = row
+        self._written += 1
+
+    def _rows(self, start: int) -> np.ndarray:
+        # Rows with total index >= start that are still in the buffer, oldest first
+        start = max(start, self._written - self.capacity)
+        indices = np.arange(start, self._written) % self.capacity
+        return self.data[indices]
+
+    def drain(self) -> np.ndarray:
+        """Returns the rows appended since the previous drain."""
+        oldest = self._written - self.capacity
+        if self._drained < oldest:
+            self.dropped += oldest - self._drained
+        rows = self._rows(self._drained)
+        self._drained = self._written
+        return rows
+
+    def pending(self) -> np.ndarray:
+        """Returns the rows appended since the previous drain without draining them."""
+        return self._rows(self._drained)
+
+    def snapshot(self) -> np.ndarray:
+        """Returns all rows still in the buffer without draining them."""
+        return self._rows(0)
+
+
+def _gpu_available() -> bool:
+    try:
+        import GPUtil
+        return len(GPUtil.getGPUs()) > 0
+    except Exception:
+        return False
+
+
+class TelemetryCollector:
+    """Samples system and per-process resource usage in a background thread.
+
+    Each sample records the system CPU, memory, disk and network usage (and GPU,
+    if available), plus the CPU, RSS and thread count of every watched Unity
+    process. Samples go to preallocated ring buffers with monotonic timestamps
+    and, if `output_dir` is set, are flushed to Feather files incrementally.
+
+    Example:
+        collector = TelemetryCollector(interval=0.5, output_dir="outputs/exp_1/telemetry_30")
+        collector.start()
+        envs = env_pool.lease(40, audio_sources=30)
+        collector.watch(env_pool.pids())
+        ...
+        collector.stop()
+        system_df, process_df = collector.system_frame(), collector.process_frame()
+    """
+
+    def __init__(
+            self,
+            interval: float = 1.0,
+            capacity: int = 4096,
+            process_capacity: Optional[int] = None,
+            output_dir: Optional[str] = None,
+            flush_interval: float = 10.0,
+            gpu: Optional[bool] = None,
+            per_cpu: bool = True,
+    ):
+        """
+        Args:
+            interval: Seconds between samples. Samples are scheduled on a fixed
+                grid, so the time spent sampling does not add to the period.
+            capacity: Number of system samples kept in memory.
+            process_capacity: Number of process rows kept in memory
+                (default: capacity * 64, one row per process and sample).
+            output_dir: Folder for the Feather files (None to keep the samples only in memory).
+                Files of a previous collector in the folder are removed.
+            flush_interval: Seconds between writing the new samples to output_dir.
+            gpu: Whether to record GPU usage through GPUtil. None to record it, if a GPU is found.
+            per_cpu: Whether to record the usage of each CPU as columns cpu_<i>.
+        """
+        self.interval = interval
+        self.output_dir = output_dir
+        self.flush_interval = flush_interval
+        self.gpu = _gpu_available() if gpu is None else gpu
+        self.per_cpu = per_cpu
+        columns = list(SYSTEM_COLUMNS)
+        if self.gpu:
+            columns += GPU_COLUMNS
+        if per_cpu:
+            columns += [f"cpu_{cpu}" for cpu in range(psutil.cpu_count())]
+        self.system = RingBuffer(columns, capacity)
+        self.processes = RingBuffer(PROCESS_COLUMNS, process_capacity or capacity * 64)
+        self._watched = {}  # pid -> (worker_id, psutil.Process)
+        self._lock = threading.Lock()
+        # Held while samples are moved from the buffers to the files, so that readers see them in exactly one place.
+        # Separate from _lock, so that sampling does not wait for the disk.
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._num_flushes = 0
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            # The files of a previous run in the same folder would be partly overwritten and partly
+            # mixed into the results, since the file numbers start at 1 again
+            old_files = self._files("system") + self._files("process")
+            if old_files:
+                print(f"Removing {len(old_files)} telemetry files of a previous run in {output_dir}")
+                for path in old_files:
+                    os.remove(path)
+
+    def watch(self, pids: dict):
+        """Sets the processes to sample.
+        Args:
+            pids: worker id -> process id, e.g. from UnityEnvPool.pids() or
+                BetterUnity3DVecEnv.pids(). Processes that are not in pids are no longer sampled.
+        """
+        with self._lock:
+            watched = {}
+            for worker_id, pid in pids.items():
+                if pid in self._watched:
+                    watched[pid] = (worker_id, self._watched[pid][1])
+                    continue
+                try:
+                    process = psutil.Process(pid)
+                    process.cpu_percent(None)  # The first call only initializes the measurement
+                except psutil.NoSuchProcess:
+                    continue
+                watched[pid] = (worker_id, process)
+            self._watched = watched
+
+    def start(self):
+        psutil.cpu_percent(interval=None)
+        if self.per_cpu:
+            psutil.cpu_percent(interval=None, percpu=True)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.output_dir is not None:
+            self.flush()
+        if self.system.dropped or self.processes.dropped:
+            print(f"Telemetry ring buffers overflowed, dropped {self.system.dropped} system and "
+                  f"{self.processes.dropped} process samples. Use a larger capacity or set output_dir.")
+
+    def _run(self):
+        next_sample = time.monotonic()
+        last_flush = next_sample
+        while not self._stop_event.is_set():
+            self.sample()
+            now = time.monotonic()
+            if self.output_dir is not None and now - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = now
+            # Fixed grid, skip the missed samples if sampling took longer than the interval
+            next_sample += self.interval
+            if next_sample < now:
+                next_sample = now + self.interval
+            self._stop_event.wait(next_sample - now)
+
+    def sample(self):
+        """Takes one sample (called by the background thread)."""
+        timestamp, monotonic = time.time(), time.monotonic()
+        disk = psutil.disk_io_counters()
+        network = psutil.net_io_counters()
+        row = [
+            timestamp, monotonic, psutil.cpu_percent(interval=None), psutil.virtual_memory().percent,
+            disk.read_bytes if disk else np.nan, disk.write_bytes if disk else np.nan,
+            network.bytes_sent, network.bytes_recv,
+        ]
+        if self.gpu:
+            row += self._sample_gpu()
+        if self.per_cpu:
+            row += psutil.cpu_percent(interval=None, percpu=True)
+
+        with self._lock:
+            self.system.append(row)
+            exited = []
+            for pid, (worker_id, process) in self._watched.items():
+                try:
+                    with process.oneshot():
+                        self.processes.append([
+                            timestamp, monotonic, worker_id, pid,
+                            process.cpu_percent(None), process.memory_info().rss, process.num_threads(),
+                        ])
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    exited.append(pid)
+            for pid in exited:
+                del self._watched[pid]
+
+    def _sample_gpu(self) -> list:
+        try:
+            import GPUtil
+            gpu = GPUtil.getGPUs()[0]
+            return [gpu.load * 100, gpu.memoryUtil * 100]
+        except Exception as e:
+            print(f"Could not read GPU usage, disabling it: {e}")
+            self.gpu = False
+            return [np.nan, np.nan]
+
+    def flush(self):
+        """Writes the samples taken since the previous flush to output_dir."""
+        with self._flush_lock:
+            with self._lock:
+                system_rows = self.system.drain()
+                process_rows = self.processes.drain()
+            if len(system_rows) == 0 and len(process_rows) == 0:
+                return
+            self._num_flushes += 1
+            for name, buffer, rows in [("system", self.system, system_rows), ("process", self.processes, process_rows)]:
+                path = os.path.join(self.output_dir, f"{name}_{self._num_flushes:05d}.feather")
+                self._to_frame(buffer, rows).to_feather(path)
+
+    @staticmethod
+    def _to_frame(buffer: RingBuffer, rows: np.ndarray):
+        df = pd.DataFrame(rows, columns=buffer.columns)
+        for column in ["worker_id", "pid", "rss", "num_threads"]:
+            if column in df:
+                df[column] = df[column].astype(np.int64)
+        return df
+
+    def _files(self, name: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(glob.escape(self.output_dir), f"{name}_*.feather")))
+
+    def _frame(self, name: str, buffer: RingBuffer):
+        if self.output_dir is None:
+            with self._lock:
+                return self._to_frame(buffer, buffer.snapshot())
+        # Flushed files and the samples since the last flush
+        with self._flush_lock:
+            with self._lock:
+                pending = self._to_frame(buffer, buffer.pending())
+            flushed = [pd.read_feather(path) for path in self._files(name)]
+        return pd.concat(flushed + [pending], ignore_index=True)
+
+    def system_frame(self):
+        """Returns the system samples as a DataFrame (one row per sample)."""
+        return self._frame("system", self.system)
+
+    def process_frame(self):
+        """Returns the process samples as a DataFrame (one row per process and sample)."""
+        return self._frame("process", self.processes)
+
+
+def load_telemetry(output_dir: str):
+    """Loads the Feather files written by a TelemetryCollector.
+    Returns:
+        tuple: (system samples, process samples) as DataFrames.
+    """
+    frames = []
+    for name in ["system", "process"]:
+        files = sorted(glob.glob(os.path.join(glob.escape(output_dir), f"{name}_*.feather")))
+        frames.append(pd.concat([pd.read_feather(path) for path in files], ignore_index=True)
+                      if files else pd.DataFrame())
+    return tuple(frames)
@@ -0,0 +1,335 @@
+"""Recording of the transitions seen through BetterUnity3DEnv, and fast replay without Unity.
+
+TrajectoryRecorder wraps an env and writes one row per transition of an agent:
+    episode, step, agent: Episode id, step within the episode, index of the agent key (see TrajectoryReader.agents).
+    obs_<i>: Observation i the action was computed from.
+    action, reward: The action and the reward received for it.
+    terminated, truncated: Whether the episode ended with this transition (truncated: ended by the episode horizon
+        of the env, a reset or an interruption in Unity).
+
+The episodes follow the env: an agent starts a new episode after reaching episode_horizon, and reset() starts a
+new episode for all agents. The last row of an agent is only written once the next one is known, so that it can
+still be marked as truncated by a reset.
+
+The rows are written in shards of `chunk_size` rows (shard_<n>.npz), compressed by default. Uncompressed
+shards are memory-mapped by the reader, so replay runs at disk speed. index.json lists the shards, the agent
+keys and the episodes (rows, return, first and last shard).
+
+Example:
+    env = TrajectoryRecorder(BetterUnity3DEnv(file_name=path), "outputs/trajectories/run_1")
+    obs, infos = env.reset()
+    for _ in range(1000):
+        obs, rewards, terminateds, truncateds, infos = env.step(policy(obs))
+    env.close()
+
+    reader = TrajectoryReader("outputs/trajectories/run_1")
+    for batch in reader.iter_batches(4096, columns=["obs_0", "action", "reward"]):
+        ...
+    first_episode = reader.episode(0)
+"""
+import json
+import os
+import zipfile
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+INDEX_FILE = "index.json"
+FORMAT_VERSION = 1
+
+
+class TrajectoryRecorder:
+    """Wraps a BetterUnity3DEnv and records its transitions (see the module docstring).
+    Other attributes are passed through to the env."""
+
+    def __init__(self, env, path: str, chunk_size: int = 10000, compress: bool = True):
+        """
+        Args:
+            env: The BetterUnity3DEnv to record.
+            path: Output folder (created if needed, existing recordings are overwritten).
+            chunk_size: Rows per shard.
+            compress: Whether to compress the shards (zlib). Uncompressed shards are larger,
+                but can be memory-mapped when reading.
+        """
+        self.env = env
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compress = compress
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.startswith("shard_") or name == INDEX_FILE:
+                os.remove(os.path.join(path, name))
+
+        self._columns: Dict[str, list] = {}  # Rows of the current shard
+        self._num_rows = 0  # Rows in the current shard
+        self._shards = []  # {"file", "rows"}
+        self._agents = {}  # agent key -> index
+        self._episodes = []  # [agent, rows, return, terminated, first shard, last shard]
+        self._open_episodes = {}  # agent key -> (episode id, steps so far)
+        self._pending = {}  # agent key -> (episode id, step, obs, action), waiting for the reward
+        self._last_rows = {}  # agent key -> last row of its open episode, written when the next row is known
+        self._decision = {}  # Decision steps of the previous step
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def reset(self, *args, **kwargs):
+        result = self.env.reset(*args, **kwargs)
+        # The env starts a new episode for all agents. Transitions without a reward do not continue.
+        self._pending.clear()
+        for key in list(self._open_episodes):
+            row = self._last_rows.pop(key, None)
+            if row is not None:
+                row["truncated"] = True
+                self._write_row(row)
+            self._end_episode(key, terminated=False)
+        self._observe(self.env.get_step_batches())
+        return result
+
+    def step(self, action_dict):
+        result = self.env.step(action_dict)
+        truncateds = result[3]
+        batches = self.env.get_step_batches()
+        masks = {behavior_name: np.array([truncateds.get(key, False) for key in decision.keys], dtype=bool)
+                 for behavior_name, (decision, _) in batches.items()}
+        self._start_transitions()
+        self._observe(batches, masks)
+        return result
+
+    def step_batched(self, action_dict):
+        # Same as env.step_batched, with the agents that reached the episode horizon
+        _, (batches, masks, truncated) = self.env._step_and_collect(action_dict, self.env._collect_step_masks)
+        self._start_transitions()
+        self._observe(batches, masks)
+        return batches, truncated
+
+    def _start_transitions(self):
+        # The agents of the previous decision steps got the actions that are still in the action buffers of the env
+        for behavior_name, decision in self._decision.items():
+            actions = self.env._action_buffers.get(behavior_name)
+            if actions is None or len(actions) != len(decision.keys):
+                actions = np.zeros((len(decision.keys), 0), dtype=np.float32)
+            for row, key in enumerate(decision.keys):
+                episode, step = self._open_episodes.get(key, (None, 0))
+                if episode is None:
+                    episode = len(self._episodes)
+                    self._episodes.append([self._agent_index(key), 0, 0.0, False, None, None])
+                self._open_episodes[key] = (episode, step + 1)
+                self._pending[key] = (episode, step, [np.array(obs[row]) for obs in decision.obs],
+                                      np.array(actions[row], dtype=np.float32))
+
+    def _observe(self, batches, truncated=None):
+        # Completes the pending transitions with the rewards of this step
+        # truncated: behavior name -> mask of the decision steps that reached the episode horizon
+        for behavior_name, (decision, terminal) in batches.items():
+            for row, key in enumerate(terminal.keys):
+                interrupted = bool(terminal.interrupted[row]) if terminal.interrupted is not None else False
+                self._complete(key, terminal.reward[row] + terminal.group_reward[row], not interrupted, interrupted)
+                if key in self._open_episodes:
+                    self._end_episode(key, terminated=not interrupted)
+            mask = truncated.get(behavior_name) if truncated is not None else None
+            for row, key in enumerate(decision.keys):
+                horizon = mask is not None and bool(mask[row])
+                self._complete(key, decision.reward[row] + decision.group_reward[row], False, horizon)
+                if horizon and key in self._open_episodes:
+                    self._end_episode(key, terminated=False)
+        self._decision = {name: decision for name, (decision, _) in batches.items() if len(decision.keys)}
+
+    def _complete(self, key, reward, terminated, truncated):
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            if (terminated or truncated) and key in self._last_rows:
+                # The episode ended without a new transition, its last row is the final one
+                last_row = self._last_rows.pop(key)
+                last_row["terminated"], last_row["truncated"] = terminated, truncated
+                self._write_row(last_row)
+            return
+        if key in self._last_rows:
+            self._write_row(self._last_rows.pop(key))
+        episode, step, obs, action = pending
+        row = {"episode": episode, "step": step, "agent": self._agents[key], "action": action,
+               "reward": reward, "terminated": terminated, "truncated": truncated}
+        for i, values in enumerate(obs):
+            row[f"obs_{i}"] = values
+        if terminated or truncated:
+            self._write_row(row)
+        else:
+            self._last_rows[key] = row
+
+    def _write_row(self, row):
+        for column, value in row.items():
+            self._columns.setdefault(column, []).append(value)
+        self._num_rows += 1
+        info = self._episodes[row["episode"]]
+        info[1] += 1
+        info[2] += float(row["reward"])
+        shard = len(self._shards)
+        info[4] = shard if info[4] is None else info[4]
+        info[5] = shard
+        if self._num_rows >= self.chunk_size:
+            self.flush()
+
+    def _agent_index(self, key) -> int:
+        return self._agents.setdefault(key, len(self._agents))
+
+    def _end_episode(self, key, terminated):
+        episode, _ = self._open_episodes.pop(key)
+        self._episodes[episode][3] = terminated
+
+    def flush(self):
+        """Writes the rows of the current shard and the index."""
+        if self._num_rows:
+            name = f"shard_{len(self._shards):05d}.npz"
+            arrays = {column: np.stack(values) if column.startswith("obs_") or column == "action"
+                      else np.asarray(values) for column, values in self._columns.items()}
+            arrays["reward"] = arrays["reward"].astype(np.float32)
+            arrays["step"] = arrays["step"].astype(np.int32)
+            arrays["agent"] = arrays["agent"].astype(np.int32)
+            tmp_path = os.path.join(self.path, name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                (np.savez_compressed if self.compress else np.savez)(f, **arrays)
+            os.replace(tmp_path, os.path.join(self.path, name))
+            self._shards.append({"file": name, "rows": self._num_rows})
+            self._columns = {}
+            self._num_rows = 0
+        self._write_index()
+
+    def _write_index(self):
+        index = {
+            "version": FORMAT_VERSION,
+            "compressed": self.compress,
+            "shards": self._shards,
+            "agents": list(self._agents),
+            "episodes": {
+                "columns": ["agent", "rows", "return", "terminated", "first_shard", "last_shard"],
+                "data": self._episodes,
+            },
+        }
+        tmp_path = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.path, INDEX_FILE))
+
+    def close(self):
+        """Writes the remaining rows and closes the env. Transitions without a reward yet are dropped."""
+        if not self._closed:
+            self._closed = True
+            for row in self._last_rows.values():
+                self._write_row(row)
+            self._last_rows.clear()
+            self.flush()
+        self.env.close()
+
+
+def _load_npz(path: str, mmap: bool) -> Dict[str, np.ndarray]:
+    # Uncompressed members of an npz file are stored as plain .npy files inside the zip, so they can be memory-mapped
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            # Local file header: 30 bytes, file name and extra field
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype="<u2")
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            if dtype.hasobject:
+                raise ValueError(f"{path}: column {name} can not be memory-mapped")
+            arrays[name] = np.memmap(f.name, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                     order="F" if fortran_order else "C")
+    return arrays
+
+
+class TrajectoryReader:
+    """Reads the recordings of a TrajectoryRecorder (see the module docstring)."""
+
+    def __init__(self, path: str, cache_shards: int = 4):
+        """
+        Args:
+            path: Folder of the recording.
+            cache_shards: Number of shards kept in memory (compressed shards are decompressed on load).
+        """
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            index = json.load(f)
+        if index["version"] != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported trajectory format version {index['version']}")
+        self.compressed = index["compressed"]
+        self.shards = index["shards"]
+        self.agents: List[str] = index["agents"]
+        self.episodes = pd.DataFrame(index["episodes"]["data"], columns=index["episodes"]["columns"])
+        self.episodes.index.name = "episode"
+        self.num_rows = sum(shard["rows"] for shard in self.shards)
+        self._cache_size = cache_shards
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return self.num_rows
+
+    def shard(self, index: int) -> Dict[str, np.ndarray]:
+        """Returns the columns of one shard (memory-mapped, if the shards are uncompressed)."""
+        arrays = self._cache.get(index)
+        if arrays is None:
+            arrays = _load_npz(os.path.join(self.path, self.shards[index]["file"]), mmap=not self.compressed)
+            self._cache[index] = arrays
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(index)
+        return arrays
+
+    def iter_batches(self, batch_size: int, columns: Optional[List[str]] = None) -> Iterator[Dict[str, np.ndarray]]:
+        """Yields all rows in recording order, in batches of `batch_size` rows (the last one can be smaller).
+        Batches within a shard are slices of it (no copies)."""
+        remainder = None
+        for index in range(len(self.shards)):
+            arrays = self.shard(index)
+            arrays = {column: arrays[column] for column in (columns or arrays)}
+            rows = self.shards[index]["rows"]
+            start = 0
+            if remainder is not None:
+                # Fill up the batch that started in the previous shard
+                start = batch_size - len(next(iter(remainder.values())))
+                batch = {column: np.concatenate([remainder[column], values[:start]])
+                         for column, values in arrays.items()}
+                remainder = None
+                if len(next(iter(batch.values()))) < batch_size:
+                    remainder = batch
+                    continue
+                yield batch
+            while start + batch_size <= rows:
+                yield {column: values[start:start + batch_size] for column, values in arrays.items()}
+                start += batch_size
+            if start < rows:
+                remainder = {column: np.array(values[start:]) for column, values in arrays.items()}
+        if remainder is not None:
+            yield remainder
+
+    def episode(self, episode: int, columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """Returns the rows of one episode, ordered by step."""
+        info = self.episodes.loc[episode]
+        if info["rows"] == 0:
+            raise KeyError(f"Episode {episode} has no recorded transitions")
+        parts = []
+        for index in range(int(info["first_shard"]), int(info["last_shard"]) + 1):
+            arrays = self.shard(index)
+            mask = np.asarray(arrays["episode"]) == episode
+            parts.append({column: arrays[column][mask] for column in (columns or arrays)})
+        return {column: np.concatenate([part[column] for part in parts]) for column in parts[0]}
+
+    def to_frame(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Returns the scalar columns (all except observations and actions by default) of all rows as a DataFrame."""
+        columns = columns or ["episode", "step", "agent", "reward", "terminated", "truncated"]
+        df = pd.concat([pd.DataFrame({column: self.shard(index)[column] for column in columns})
+                        for index in range(len(self.shards))], ignore_index=True)
+        if "agent" in df:
+            df["agent"] = pd.Categorical.from_codes(df["agent"], categories=self.agents)
+        return df
@@ -1,18 +1,34 @@
 from gymnasium.spaces import Box, MultiDiscrete, Tuple as TupleSpace
+import itertools
 import logging
 import numpy as np
-import random
+import os
 import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Optional, Tuple
 
 from mlagents_envs.side_channel.engine_configuration_channel import EngineConfigurationChannel
+from mlagents_envs.side_channel.environment_parameters_channel import EnvironmentParametersChannel
+from mlagents_envs.side_channel.stats_side_channel import StatsSideChannel
 from ray.rllib.env.multi_agent_env import MultiAgentEnv
 from ray.rllib.policy.policy import PolicySpec
 from ray.rllib.utils.annotations import PublicAPI
 from ray.rllib.utils.typing import MultiAgentDict, PolicyID, AgentID, MultiEnvDict
 
+from .profiling import StepProfiler
+from .shared_obs import SHARED_SUFFIX, SharedObservationBuffer, default_path
+from .worker_ids import WorkerIdAllocator, get_default_allocator
+
 logger = logging.getLogger(__name__)
 
+# Batched view of one DecisionSteps or TerminalSteps object of a behavior.
+# obs, reward and group_reward are the arrays returned by ML-Agents (no copies),
+# keys[i] is the agent key (as used in the dict API) of row i.
+# interrupted is only set for terminal steps (episode ended by a max step limit instead of a terminal state).
+StepBatch = namedtuple("StepBatch", ["agent_id", "keys", "obs", "reward", "group_reward", "interrupted"],
+                       defaults=[None])
+
 
 @PublicAPI
 class BetterUnity3DEnv(MultiAgentEnv):
@@ -32,8 +48,8 @@ class BetterUnity3DEnv(MultiAgentEnv):
     _BASE_PORT_EDITOR = 5004
     # Default base port when connecting to a compiled environment
     _BASE_PORT_ENVIRONMENT = 49905
-    # The worker_id for each environment instance
-    _WORKER_ID = 0
+    # Agent types in the order of ExperimentSetup.AgentType in the Unity project
+    AGENT_TYPES = ["hanning", "random", "rect", "hanningao", "rectao"]
 
     def __init__(
             self,
@@ -48,6 +64,12 @@ class BetterUnity3DEnv(MultiAgentEnv):
             observation_high: float = 1,  # Should be 1, but some unity examples give too high values crashing RLlib
             args: Optional[list] = None,
             log_folder: Optional[str] = None,
+            worker_id: Optional[int] = None,
+            worker_id_allocator: Optional[WorkerIdAllocator] = None,
+            profile: bool = False,
+            shared_obs: bool = False,
+            shared_obs_slots: int = 4,
+            unity_env_factory: Optional[Callable] = None,
     ):
         """Initializes a Unity3DEnv object.
         Args:
@@ -66,6 +88,22 @@ class BetterUnity3DEnv(MultiAgentEnv):
                 multi-agent episode that the game represents).
                 Note: The game itself may contain its own episode length
                 limits, which are always obeyed (on top of this value here).
+            worker_id: Fixed worker id (port offset) to use. If None, the
+                lowest free id is leased from `worker_id_allocator`.
+            worker_id_allocator: Allocator for leasing worker ids. Defaults to
+                the allocator shared by all envs on this machine.
+            profile: Whether to record latency histograms of the step stages
+                (see `enable_profiling` and `get_latency_stats`).
+            shared_obs: Whether Unity should write the audio observations to shared
+                memory instead of sending them through gRPC (see shared_obs.py).
+                The observations of `step_batched` and `get_step_batches` are then
+                numpy views of the shared memory, `step` and `reset` return copies.
+                Needs a build with SharedObservationMemory.cs.
+            shared_obs_slots: Number of steps kept in the shared memory, i.e. the
+                views returned by `step_batched` stay valid for this many steps - 1.
+            unity_env_factory: Creates the UnityEnvironment, called with the same
+                arguments. Default: UnityEnvironment. See mock_unity.py for running
+                without a build.
         """
 
         super().__init__()
@@ -80,57 +118,170 @@ class BetterUnity3DEnv(MultiAgentEnv):
         import mlagents_envs
         from mlagents_envs.environment import UnityEnvironment
 
+        unity_env_factory = unity_env_factory or UnityEnvironment
+
+        # Unity creates the file at this path with the first observations
+        self._shared_obs_path = default_path() if shared_obs else None
+        self.shared_obs: Optional[SharedObservationBuffer] = None
+        self._shared_obs_index = {}  # behavior_name -> indices of the shared observations
+        if shared_obs:
+            args = list(args or []) + ["-sharedObs", self._shared_obs_path, "-sharedObsSlots", str(shared_obs_slots)]
+
         # Try connecting to the Unity3D game instance. If a port is blocked
-        port_ = None
-        while True:
-            # Sleep for random time to allow for concurrent startup of many
-            # environments (num_workers >> 1). Otherwise, would lead to port
-            # conflicts sometimes.
-            # time.sleep(random.random() * 0.5)
-            port_ = port or (
-                self._BASE_PORT_ENVIRONMENT if file_name else self._BASE_PORT_EDITOR
-            )
-            # cache the worker_id and
-            # increase it for the next environment
-            # worker_id_ = BetterUnity3DEnv._WORKER_ID if file_name else 0
-            worker_id_ = random.randint(0, 9999)  # Use random port and retry if conflict happens
-            BetterUnity3DEnv._WORKER_ID += 1
-            seed = worker_id_  # TODO: Seed is hardcoded here, argument for parent function is ignored!
-            print(f"Seed: {seed}")
-            try:
-                channel = EngineConfigurationChannel()
-                self.unity_env = UnityEnvironment(
-                    file_name=file_name,
-                    worker_id=worker_id_,
-                    base_port=port_,
-                    seed=seed,
-                    no_graphics=no_graphics,
-                    timeout_wait=timeout_wait,
-                    side_channels=[channel],
-                    additional_args=args,
-                    log_folder=log_folder,
-                )
-                channel.set_configuration_parameters(time_scale=timescale)
-                print("Created UnityEnvironment for port {}".format(port_ + worker_id_))
-            except mlagents_envs.exception.UnityWorkerInUseException:
-                pass
-            else:
-                break
+        # (e.g. by a process that does not use the allocator), lease the next
+        # free worker id and try again.
+        port_ = port or (
+            self._BASE_PORT_ENVIRONMENT if file_name else self._BASE_PORT_EDITOR
+        )
+        # The editor always uses worker id 0
+        self._worker_id_allocator = None
+        if worker_id is None and file_name:
+            self._worker_id_allocator = worker_id_allocator or get_default_allocator()
+        blocked_worker_ids = []
+        worker_id_ = None
+        try:
+            while True:
+                if self._worker_id_allocator is not None:
+                    start_id = blocked_worker_ids[-1] + 1 if blocked_worker_ids else 0
+                    worker_id_ = self._worker_id_allocator.acquire(start_id)
+                else:
+                    worker_id_ = worker_id or 0
+                print(f"Seed: {seed}")
+                try:
+                    channel = EngineConfigurationChannel()
+                    self.parameters_channel = EnvironmentParametersChannel()
+                    self.stats_channel = StatsSideChannel()
+                    self.unity_env = unity_env_factory(
+                        file_name=file_name,
+                        worker_id=worker_id_,
+                        base_port=port_,
+                        seed=seed,
+                        no_graphics=no_graphics,
+                        timeout_wait=timeout_wait,
+                        side_channels=[channel, self.parameters_channel, self.stats_channel],
+                        additional_args=args,
+                        log_folder=log_folder,
+                    )
+                    channel.set_configuration_parameters(time_scale=timescale)
+                    print("Created UnityEnvironment for port {}".format(port_ + worker_id_))
+                except mlagents_envs.exception.UnityWorkerInUseException:
+                    if self._worker_id_allocator is None:
+                        raise
+                    # Keep the blocked id leased for now, so it is not handed out again right away
+                    blocked_worker_ids.append(worker_id_)
+                else:
+                    break
+        except BaseException:
+            if self._worker_id_allocator is not None and worker_id_ is not None:
+                self._worker_id_allocator.release(worker_id_)
+            raise
+        finally:
+            for blocked_worker_id in blocked_worker_ids:
+                self._worker_id_allocator.release(blocked_worker_id)
+        self.worker_id = worker_id_
 
         # ML-Agents API version.
         self.api_version = self.unity_env.API_VERSION.split(".")
         self.api_version = [int(s) for s in self.api_version]
+        # New ML-Agents API: Set all agents actions at the same time
+        # via an ActionTuple. Since API v1.4.0.
+        self._use_action_tuple = self.api_version[0] > 1 or (
+                self.api_version[0] == 1 and self.api_version[1] >= 4
+        )
 
         # Reset entire env every this number of step calls.
         self.episode_horizon = episode_horizon
         self.soft_horizon = soft_horizon
         # Keep track of how many times we have called `step` so far.
         self.episode_timesteps = 0
+        self._total_steps = 0  # Steps since the start, never reset
+        # behavior_name -> (agent ids, step (_total_steps) at which the current episode of the agent started,
+        # number of agents in the latest decision steps). These agents come first, in the same order.
+        self._episode_starts = {}
+        # True while the state of Unity is the start of the episodes (no step since its reset), so reset() can reuse it
+        self._unity_state_fresh = False
+        # (behavior_name, "decision"|"terminal") -> (agent ids, agent keys, agent key -> row)
+        self._agent_key_cache = {}
+        # behavior_name -> action array reused across steps (one row per agent)
+        self._action_buffers = {}
+        # Latency histograms of the step stages, None when profiling is disabled
+        self.profiler = StepProfiler() if profile else None
+        self._get_steps_ns = 0  # Time spent in get_steps during the current step
+
+        self.observation_high = observation_high
+        # The first message to Unity resets it, the agents are known from the resulting decision steps.
+        # The first reset() reuses them instead of resetting Unity again.
+        self.unity_env.reset()
+        self._unity_state_fresh = True
+        self._discover_agents()
+
+        print("x")
+        # self._action_space_in_preferred_format = False
+        # self._obs_space_in_preferred_format = False
+
+    def configure(
+            self,
+            audio_sources: Optional[int] = None,
+            decision_period: Optional[int] = None,
+            agent: Optional[str] = None,
+            target_speed: Optional[float] = None,
+    ) -> bool:
+        """Reconfigures the running Unity instance in place and resets it.
+        Same as the -audioSources, -decisionPeriod, -agent and -targetSpeed args,
+        None keeps the current value. Requires a build where ExperimentSetup
+        registers the parameter callbacks, older builds ignore the values.
+        Returns:
+            bool: True, if Unity acknowledged all given values.
+        """
+        params = {}
+        if audio_sources is not None:
+            params["audioSources"] = float(audio_sources)
+        if decision_period is not None:
+            params["decisionPeriod"] = float(decision_period)
+        if agent is not None:
+            params["agent"] = float(self.AGENT_TYPES.index(agent.lower()))
+        if target_speed is not None:
+            params["targetSpeed"] = float(target_speed)
+        for key, value in params.items():
+            self.parameters_channel.set_float_parameter(key, value)
+        self.stats_channel.get_and_reset_stats()  # Drop stats from before the change
+
+        # Parameters are sent with the next message to Unity
+        self.unity_env.reset()
+        self._unity_state_fresh = True
+        stats = self.stats_channel.get_and_reset_stats()
+        if not self._is_acknowledged(params, stats):
+            # Acknowledgement might only arrive with the next step
+            self.unity_env.step()
+            self._unity_state_fresh = False
+            stats.update(self.stats_channel.get_and_reset_stats())
+        acknowledged = self._is_acknowledged(params, stats)
+
+        # Agents might have changed
+        self._agent_key_cache = {}
+        self._action_buffers = {}
+        self._discover_agents()
+        self.episode_timesteps = 0
+        return acknowledged
+
+    def _discover_agents(self):
+        """Sets up the agents and spaces from the current decision steps (without stepping Unity)
+        and starts their episodes."""
+        batches = self.get_step_batches()
+        self._agent_ids = [key for decision, _ in batches.values() for key in decision.keys]
+        self._setup_spaces()
+        self._start_episodes(batches)
+
+    @staticmethod
+    def _is_acknowledged(params, stats) -> bool:
+        for key, value in params.items():
+            values = stats.get(f"Config/{key}")
+            if not values or abs(values[-1][0] - value) > 1e-4:
+                return False
+        return True
 
-        # First step is always empty, so lets run it already in here to not mess up Ray Rllib
-        obs, rewards, terminated, truncated, info = self.step({})
-        self._agent_ids = list(obs.keys())
-        # self._agent_ids = list(self.unity_env.behavior_specs.keys())
+    def _setup_spaces(self):
+        """Creates the action and observation spaces of the agents in `self._agent_ids`."""
         self.action_spaces = {}
         self.observation_spaces = {}
         for agent in self._agent_ids:
@@ -142,10 +293,11 @@ class BetterUnity3DEnv(MultiAgentEnv):
             converted_name = converted_name[0] + postfix
             behavior_spec = self.unity_env.behavior_specs[converted_name]
             action_spec = behavior_spec.action_spec
-            observation_spec = behavior_spec.observation_specs
+            observation_spec = [self._resolve_shared_spec(converted_name, index, obs)
+                                for index, obs in enumerate(behavior_spec.observation_specs)]
             # self.action_space[agent] =
             # high = np.inf  # TODO: Would be nice to have 1, but some unity examples have -inf to inf
-            high = observation_high
+            high = self.observation_high
             if action_spec.continuous_size > 0:
                 size = action_spec.continuous_size
                 self.action_spaces[agent] = Box(
@@ -169,10 +321,6 @@ class BetterUnity3DEnv(MultiAgentEnv):
             self.action_space = self.action_spaces[agent]
             self.observation_space = self.observation_spaces[agent]
 
-        print("x")
-        # self._action_space_in_preferred_format = False
-        # self._obs_space_in_preferred_format = False
-
     def observation_space_sample(self, agent_ids: list = None) -> MultiEnvDict:
         samples = {}
         if agent_ids == None:
@@ -216,6 +364,8 @@ class BetterUnity3DEnv(MultiAgentEnv):
                 keys=agent identifier consisting of
                 [MLagents behavior name, e.g. "Goalie?team=1"] + "_" +
                 [Agent index, a unique MLAgent-assigned index per single agent]
+                Alternatively keys=MLagents behavior name and values=array of
+                actions with one row per agent (in DecisionSteps order).
         Returns:
             tuple:
                 - obs: Multi-agent observation dict.
@@ -224,78 +374,330 @@ class BetterUnity3DEnv(MultiAgentEnv):
                 - rewards: Rewards dict matching `obs`.
                 - dones: Done dict with only an __all__ multi-agent entry in
                     it. __all__=True, if episode is done for all agents.
+                - truncateds: Agents that reached the episode horizon are True,
+                    __all__=True, if all agents reached it.
                 - infos: An (empty) info dict.
         """
+        _, results = self._step_and_collect(action_dict, self._collect_step_results)
+        return results
+
+    def _collect_step_results(self):
+        # Results of `step`, with the agents that reached the episode horizon truncated
+        batches = self.get_step_batches()
+        truncated, all_truncated = self._advance_episodes(batches)
+        obs, rewards, terminateds, truncateds, infos = self._get_step_results(batches)
+        for behavior_name, mask in truncated.items():
+            if mask.any():
+                truncateds.update(dict.fromkeys(itertools.compress(batches[behavior_name][0].keys, mask), True))
+                truncateds["__all__"] = all_truncated
+        return obs, rewards, terminateds, truncateds, infos
+
+    def _collect_step_batches(self):
+        # Results of `step_batched`
+        batches, _, all_truncated = self._collect_step_masks()
+        return batches, all_truncated
+
+    def _collect_step_masks(self):
+        # Results of `step_batched` with the truncation mask of the decision steps of each behavior
+        batches = self.get_step_batches()
+        truncated, all_truncated = self._advance_episodes(batches)
+        return batches, truncated, all_truncated
+
+    def _set_actions(self, action_dict: MultiAgentDict) -> list:
+        """Sends the actions in `action_dict` to Unity3D (without stepping).
+        Actions can be given either per agent key, or batched per behavior name
+        as an array with one row per agent (in the order of the DecisionSteps).
+        Returns:
+            list: Keys of all agents that were requesting a decision.
+        """
         from mlagents_envs.base_env import ActionTuple
 
         # Set only the required actions (from the DecisionSteps) in Unity3D.
         all_agents = []
-        for behavior_name in self.unity_env.behavior_specs:
-            # New ML-Agents API: Set all agents actions at the same time
-            # via an ActionTuple. Since API v1.4.0.
-            if self.api_version[0] > 1 or (
-                    self.api_version[0] == 1 and self.api_version[1] >= 4
-            ):
-                actions = []
-                for agent_id in self.unity_env.get_steps(behavior_name)[0].agent_id:
-                    key = behavior_name + "_{}".format(agent_id)
-                    all_agents.append(key)
-                    # print(key)
-                    # print(action_dict)
-                    if key not in action_dict:
-                        # print("nokey")
-                        pass
-                    else:
-                        actions.append(action_dict[key])
-                if actions:
-                    if actions[0].dtype == np.float32:
-                        action_tuple = ActionTuple(continuous=np.array(actions))
-                    else:
-                        action_tuple = ActionTuple(discrete=np.array(actions))
-                    self.unity_env.set_actions(behavior_name, action_tuple)
+        for behavior_name, behavior_spec in self.unity_env.behavior_specs.items():
+            agent_ids = self.unity_env.get_steps(behavior_name)[0].agent_id
+            keys, rows = self._get_agent_index(behavior_name, agent_ids, "decision")
+            all_agents.extend(keys)
             # Old behavior: Do not use an ActionTuple and set each agent's
             # action individually.
-            else:
-                for agent_id in self.unity_env.get_steps(behavior_name)[
-                    0
-                ].agent_id_to_index.keys():
-                    key = behavior_name + "_{}".format(agent_id)
-                    all_agents.append(key)
+            if not self._use_action_tuple:
+                for key, agent_id in zip(keys, agent_ids):
                     self.unity_env.set_action_for_agent(
                         behavior_name, agent_id, action_dict[key]
                     )
-        # Do the step.
+                continue
+
+            action_spec = behavior_spec.action_spec
+            actions = self._get_action_buffer(behavior_name, action_spec, len(keys))
+            if behavior_name in action_dict:
+                # Batched actions, rows are already in DecisionSteps order
+                np.copyto(actions, action_dict[behavior_name], casting="unsafe")
+            else:
+                # Agents without an action get zeros, so that every row stays
+                # aligned with its agent.
+                actions.fill(0)
+                has_actions = False
+                for key, action in action_dict.items():
+                    row = rows.get(key)
+                    if row is not None:
+                        actions[row] = action
+                        has_actions = True
+                if not has_actions:
+                    continue
+            if action_spec.continuous_size > 0:
+                action_tuple = ActionTuple(continuous=actions)
+            else:
+                action_tuple = ActionTuple(discrete=actions)
+            self.unity_env.set_actions(behavior_name, action_tuple)
+        return all_agents
+
+    def _get_action_buffer(self, behavior_name, action_spec, num_agents) -> np.ndarray:
+        """Returns the action array of a behavior. The array is reused across
+        steps and only reallocated when the number of agents changes."""
+        actions = self._action_buffers.get(behavior_name)
+        if actions is None or actions.shape[0] != num_agents:
+            if action_spec.continuous_size > 0:
+                actions = np.zeros((num_agents, action_spec.continuous_size), dtype=np.float32)
+            else:
+                actions = np.zeros((num_agents, action_spec.discrete_size), dtype=np.int32)
+            self._action_buffers[behavior_name] = actions
+        return actions
+
+    def step_batched(self, action_dict: MultiAgentDict) -> Tuple[dict, bool]:
+        """Same as `step`, but returns the results batched per behavior.
+        Args:
+            action_dict: Multi-agent action dict (see `step`) or batched
+                actions {behavior name: array with one row per agent}.
+        Returns:
+            tuple:
+                - batches: See `get_step_batches`.
+                - truncated: True, if all agents reached the episode horizon
+                    (see `get_episode_lengths` for single agents).
+        """
+        _, results = self._step_and_collect(action_dict, self._collect_step_batches)
+        return results
+
+    def _step_and_collect(self, action_dict: MultiAgentDict, collect: Callable) -> tuple:
+        """Sets the actions, steps Unity3D and collects the results with `collect`.
+        Returns:
+            tuple: (keys of the agents that got actions, results of `collect`)
+        """
+        profiler = self.profiler
+        if profiler is None:
+            all_agents = self._set_actions(action_dict)
+            self.unity_env.step()
+            return all_agents, collect()
+
+        start = time.perf_counter_ns()
+        all_agents = self._set_actions(action_dict)
+        actions_set = time.perf_counter_ns()
         self.unity_env.step()
+        stepped = time.perf_counter_ns()
+        self._get_steps_ns = 0
+        results = collect()
+        self._record_step_profile(start, actions_set, stepped, time.perf_counter_ns())
+        return all_agents, results
 
-        obs, rewards, terminateds, truncateds, infos = self._get_step_results()
+    def _record_step_profile(self, start, actions_set, stepped, end):
+        # Timestamps (perf_counter_ns) taken by _step_and_collect
+        self.profiler.record("set_actions", actions_set - start)
+        self.profiler.record("unity_step", stepped - actions_set)
+        self.profiler.record("get_steps", self._get_steps_ns)
+        self.profiler.record("post_process", end - stepped - self._get_steps_ns)
+        self.profiler.record("total", end - start)
 
-        # Global horizon reached? -> Return __all__ truncated=True, so user
-        # can reset. Set all agents' individual `truncated` to True as well.
-        self.episode_timesteps += 1
-        if self.episode_timesteps >= self.episode_horizon:
-            return (
-                obs,
-                rewards,
-                terminateds,
-                dict({"__all__": True}, **{agent_id: True for agent_id in all_agents}),
-                infos,
-            )
+    def enable_profiling(self, profiler: Optional[StepProfiler] = None):
+        """Starts recording latency histograms of the step stages.
+        Args:
+            profiler: Profiler to record to, e.g. one shared by many envs.
+                A new one is created if None.
+        """
+        self.profiler = profiler or StepProfiler()
 
-        return obs, rewards, terminateds, truncateds, infos
+    def disable_profiling(self):
+        self.profiler = None
+
+    def get_latency_stats(self) -> dict:
+        """Returns stage -> {count, mean_ms, p50_ms, p90_ms, p99_ms, max_ms},
+        or an empty dict if profiling is disabled (see StepProfiler)."""
+        return self.profiler.stats() if self.profiler is not None else {}
 
     def reset(
             self, *, seed=None, options=None
     ) -> Tuple[MultiAgentDict, MultiAgentDict]:
-        """Resets the entire Unity3D scene (a single multi-agent episode)."""
+        """Starts a new episode for all agents. The Unity3D scene is only reset
+        without soft_horizon, and only if it was stepped since its last reset.
+        Otherwise the decision steps fetched by the last step are reused, so no
+        message is sent to Unity.
+        Returns:
+            tuple: obs (the agents of the current decision steps) and infos.
+        """
+        obs = {}
+        for behavior_name, (decision, _) in self.reset_batched().items():
+            obs.update(zip(decision.keys, self._agent_obs(behavior_name, decision.obs)))
+        return obs, {}
+
+    def reset_batched(self) -> dict:
+        """Same as `reset`, but returns the step batches (see `get_step_batches`)."""
         self.episode_timesteps = 0
-        if not self.soft_horizon:
+        if not self.soft_horizon and not self._unity_state_fresh:
             self.unity_env.reset()
-        obs, _, _, _, infos = self._get_step_results()
-        # print(obs)
-        return obs, infos
+            self._unity_state_fresh = True
+        batches = self.get_step_batches()
+        self._start_episodes(batches)
+        return batches
+
+    def get_episode_lengths(self) -> dict:
+        """Returns behavior name -> steps in the current episode of each agent
+        of the latest decision steps (same order). An agent is truncated when
+        this reaches `episode_horizon`, and starts again from 0."""
+        return {behavior_name: self._total_steps - starts[:num_agents]
+                for behavior_name, (_, starts, num_agents) in self._episode_starts.items()}
+
+    def _start_episodes(self, batches):
+        # All agents of the decision steps start a new episode now
+        self._episode_starts = {
+            behavior_name: (decision.agent_id.copy(), np.full(len(decision.agent_id), self._total_steps, dtype=np.int64),
+                            len(decision.agent_id))
+            for behavior_name, (decision, _) in batches.items()
+        }
+
+    def _advance_episodes(self, batches) -> Tuple[dict, bool]:
+        """Counts a step for the episodes of all agents.
+        Returns:
+            tuple:
+                - truncated: behavior name -> bool array, True for the agents of
+                    the decision steps that reached the episode horizon.
+                - all_truncated: True, if all of them reached it.
+        """
+        self.episode_timesteps += 1
+        self._total_steps += 1
+        self._unity_state_fresh = False
+        truncated = {}
+        num_agents = num_truncated = 0
+        for behavior_name, (decision, terminal) in batches.items():
+            mask = self._update_episode_starts(behavior_name, decision.agent_id, terminal.agent_id)
+            truncated[behavior_name] = mask
+            num_agents += len(mask)
+            num_truncated += np.count_nonzero(mask)
+        return truncated, num_agents > 0 and num_truncated == num_agents
 
-    def _get_step_results(self):
+    def _update_episode_starts(self, behavior_name, agent_id, terminal_agent_id) -> np.ndarray:
+        # Returns the truncation mask of the decision steps (agent_id), see _advance_episodes
+        total = self._total_steps
+        ids, starts, _ = self._episode_starts.get(behavior_name, (agent_id[:0], np.zeros(0, dtype=np.int64), 0))
+        if len(terminal_agent_id):
+            # Agents whose episode ended in Unity start a new one
+            alive = ~np.isin(ids, terminal_agent_id)
+            ids, starts = ids[alive], starts[alive]
+        num_agents = len(agent_id)
+        if not np.array_equal(ids[:num_agents], agent_id):
+            # Other agents than in the last step: Look up the known ones, new ones start their episode now.
+            # Agents without a decision in this step are kept after them.
+            agent_starts = np.full(num_agents, total, dtype=np.int64)
+            if len(ids):
+                order = np.argsort(ids, kind="stable")
+                pos = np.minimum(np.searchsorted(ids, agent_id, sorter=order), len(ids) - 1)
+                found = ids[order[pos]] == agent_id
+                agent_starts[found] = starts[order[pos[found]]]
+            waiting = ~np.isin(ids, agent_id)
+            ids = np.concatenate([agent_id, ids[waiting]])
+            starts = np.concatenate([agent_starts, starts[waiting]])
+        truncated = total - starts[:num_agents] >= self.episode_horizon
+        if truncated.any():
+            starts[:num_agents][truncated] = total
+        self._episode_starts[behavior_name] = (ids, starts, num_agents)
+        return truncated
+
+    def get_step_batches(self) -> dict:
+        """Collects the current decision and terminal steps of every behavior
+        without building per-agent dicts.
+        Returns:
+            dict: behavior name -> (decision StepBatch, terminal StepBatch).
+                The arrays are views into the ML-Agents step data, so they
+                should not be modified and are only valid until the next `step`.
+        """
+        batches = {}
+        for behavior_name in self.unity_env.behavior_specs:
+            if self.profiler is not None:
+                start = time.perf_counter_ns()
+                decision_steps, terminal_steps = self.unity_env.get_steps(behavior_name)
+                self._get_steps_ns += time.perf_counter_ns() - start
+            else:
+                decision_steps, terminal_steps = self.unity_env.get_steps(behavior_name)
+            batches[behavior_name] = (
+                self._to_step_batch(behavior_name, decision_steps, "decision"),
+                self._to_step_batch(behavior_name, terminal_steps, "terminal"),
+            )
+        return batches
+
+    def _to_step_batch(self, behavior_name, steps, cache_slot) -> StepBatch:
+        keys, _ = self._get_agent_index(behavior_name, steps.agent_id, cache_slot)
+        obs = steps.obs
+        if self._shared_obs_path is not None:
+            obs = self._resolve_shared_obs(behavior_name, obs)
+        return StepBatch(steps.agent_id, keys, obs, steps.reward, steps.group_reward,
+                         getattr(steps, "interrupted", None))
+
+    def _get_shared_obs_index(self, behavior_name) -> list:
+        index = self._shared_obs_index.get(behavior_name)
+        if index is None:
+            specs = self.unity_env.behavior_specs[behavior_name].observation_specs
+            index = [i for i, spec in enumerate(specs) if getattr(spec, "name", "").endswith(SHARED_SUFFIX)]
+            self._shared_obs_index[behavior_name] = index
+        return index
+
+    def _open_shared_obs(self) -> SharedObservationBuffer:
+        if self.shared_obs is None:
+            self.shared_obs = SharedObservationBuffer.open(self._shared_obs_path)
+        return self.shared_obs
+
+    def _resolve_shared_obs(self, behavior_name, obs) -> list:
+        # Replaces the (row, slot, tag) references sent by Unity with views of the shared memory
+        index = self._get_shared_obs_index(behavior_name)
+        if not index or (self.shared_obs is None and len(obs[index[0]]) == 0):
+            return obs
+        shared_obs = self._open_shared_obs()
+        obs = list(obs)
+        for i in index:
+            obs[i] = shared_obs.view(obs[i])
+        return obs
+
+    def _resolve_shared_spec(self, behavior_name, index, spec):
+        # Observation spec with the shape of the observations in the shared memory
+        if self._shared_obs_path is None or index not in self._get_shared_obs_index(behavior_name):
+            return spec
+        return spec._replace(shape=self._open_shared_obs().shape)
+
+    def _get_agent_index(self, behavior_name, agent_id, cache_slot) -> Tuple[list, dict]:
+        """Returns the agent keys and the agent key -> row mapping for the given
+        agent ids. Both are cached and only rebuilt when the set of agents changes."""
+        cached = self._agent_key_cache.get((behavior_name, cache_slot))
+        if cached is not None and np.array_equal(cached[0], agent_id):
+            return cached[1], cached[2]
+        keys = [behavior_name + "_{}".format(agent_id_) for agent_id_ in agent_id]
+        rows = {key: row for row, key in enumerate(keys)}
+        self._agent_key_cache[(behavior_name, cache_slot)] = (agent_id.copy(), keys, rows)
+        return keys, rows
+
+    @staticmethod
+    def _split_obs(obs):
+        # Iterates over per-agent observations (row views, no copies)
+        return obs[0] if len(obs) == 1 else zip(*obs)
+
+    def _agent_obs(self, behavior_name, obs):
+        # Per-agent observations of the dict API. RLlib keeps them until a rollout fragment is built, long after
+        # the shared memory slots were reused, so the shared observations are copied.
+        index = self._get_shared_obs_index(behavior_name) if self._shared_obs_path is not None else ()
+        if index:
+            obs = [np.array(o) if i in index else o for i, o in enumerate(obs)]
+        return self._split_obs(obs)
+
+    def _get_step_results(self, batches: Optional[dict] = None):
         """Collects those agents' obs/rewards that have to act in next `step`.
+        Thin adapter on top of `get_step_batches`.
+        Args:
+            batches: Output of `get_step_batches` (fetched if None).
         Returns:
             Tuple:
                 obs: Multi-agent observation dict.
@@ -308,49 +710,83 @@ class BetterUnity3DEnv(MultiAgentEnv):
         """
         obs = {}
         rewards = {}
-        terminateds = {"__all__": False}
         infos = {}
-        i = 0
-        for behavior_name in self.unity_env.behavior_specs:
-            decision_steps, terminal_steps = self.unity_env.get_steps(behavior_name)
-            # Important: Only update those sub-envs that are currently
-            # available within _env_state.
-            # Loop through all envs ("agents") and fill in, whatever
-            # information we have.
-            # print(decision_steps.agent_id_to_index.items())
-            for agent_id, idx in decision_steps.agent_id_to_index.items():
-                key = behavior_name + "_{}".format(agent_id)
-                terminateds[key] = False
-                os = tuple(o[idx] for o in decision_steps.obs)
-                os = os[0] if len(os) == 1 else os
-                obs[key] = os
-                rewards[key] = (
-                        decision_steps.reward[idx] + decision_steps.group_reward[idx]
-                )
-                # print(f"{key}, {rewards[key]}, {decision_steps.group_reward[idx]}")
-                # print(i)
-                i += 1
-            for agent_id, idx in terminal_steps.agent_id_to_index.items():
-                key = behavior_name + "_{}".format(agent_id)
-                terminateds[key] = True
+        if batches is None:
+            batches = self.get_step_batches()
+        for behavior_name, (decision, terminal) in batches.items():
+            obs.update(zip(decision.keys, self._agent_obs(behavior_name, decision.obs)))
+            rewards.update(zip(decision.keys, decision.reward + decision.group_reward))
+            if terminal.keys:
                 # Only overwrite rewards (last reward in episode), b/c obs
                 # here is the last obs (which doesn't matter anyways).
                 # Unless key does not exist in obs.
-                if key not in obs:
-                    os = tuple(o[idx] for o in terminal_steps.obs)
-                    obs[key] = os = os[0] if len(os) == 1 else os
-                rewards[key] = (
-                        terminal_steps.reward[idx] + terminal_steps.group_reward[idx]
-                )
-
+                for key, os in zip(terminal.keys, self._agent_obs(behavior_name, terminal.obs)):
+                    obs.setdefault(key, os)
+                rewards.update(zip(terminal.keys, terminal.reward + terminal.group_reward))
 
-        # Only use dones if all agents are done, then we should do a reset.
-        if False not in terminateds.values():
-            terminateds["__all__"] = True
-            # TODO: How to report that only one agent is done? RLlib seems to crash in this simple situation
+        # TODO: How to report that only one agent is done? RLlib seems to crash in this simple situation,
+        #  so per-agent terminateds are not reported at all.
         return obs, rewards, {"__all__": False}, {"__all__": False}, infos
-        # return obs, rewards, terminateds, {"__all__": False}, infos
+
+    @property
+    def pid(self) -> Optional[int]:
+        """Process id of the launched Unity instance (None when connected to the editor)."""
+        process = getattr(self.unity_env, "_process", None)
+        return process.pid if process is not None else None
 
     def close(self):
         print("Closing unity env")
-        self.unity_env.close()
+        try:
+            self.unity_env.close()
+        finally:
+            if self.shared_obs is not None:
+                self.shared_obs.close()
+                self.shared_obs = None
+            if self._shared_obs_path is not None and os.path.exists(self._shared_obs_path):
+                os.remove(self._shared_obs_path)
+            if self._worker_id_allocator is not None:
+                self._worker_id_allocator.release(self.worker_id)
+                self._worker_id_allocator = None
+
+
+def launch_many(
+        n: int, seed: int = 0, max_workers: Optional[int] = None, **env_kwargs
+) -> Tuple[list, list]:
+    """Starts n BetterUnity3DEnv instances in parallel, so that the fleet comes
+    up in roughly the startup time of a single instance.
+    Args:
+        n: Number of environments.
+        seed: Seed of the first environment, environment i uses `seed + i`.
+        max_workers: Maximum number of environments starting at the same time (default: n).
+        env_kwargs: Other arguments for BetterUnity3DEnv.
+    Returns:
+        tuple:
+            - envs: The started environments.
+            - startup_times: Startup latency of each environment in seconds.
+    """
+    def launch(i):
+        t1 = time.perf_counter()
+        env = BetterUnity3DEnv(seed=seed + i, **env_kwargs)
+        return env, time.perf_counter() - t1
+
+    envs = []
+    startup_times = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers or n) as executor:
+        futures = [executor.submit(launch, i) for i in range(n)]
+        for future in futures:
+            try:
+                env, startup_time = future.result()
+            except Exception as e:
+                errors.append(e)
+            else:
+                envs.append(env)
+                startup_times.append(startup_time)
+    if errors:
+        # Do not leave half of the fleet running
+        for env in envs:
+            env.close()
+        raise errors[0]
+    for i, startup_time in enumerate(startup_times):
+        print(f"Env {i} started in {startup_time:.2f} s")
+    return envs, startup_times
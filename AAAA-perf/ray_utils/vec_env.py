@@ -0,0 +1,246 @@
+import multiprocessing as mp
+import traceback
+from collections import namedtuple
+from typing import List, Optional, Union
+
+import numpy as np
+
+from .unity_env import BetterUnity3DEnv
+
+# Stacked step data of one behavior over all instances of the pool.
+# Row i belongs to agent agent_id[i] of instance env_index[i].
+# obs is a list with one array per observation of the behavior.
+# truncated (decision steps returned by step only): True for the agents that reached the episode horizon
+# in this step, their next step belongs to a new episode.
+VecBatch = namedtuple("VecBatch", ["env_index", "agent_id", "obs", "reward", "truncated"], defaults=[None])
+
+
+def _to_arrays(batch, truncated=None):
+    # Plain (picklable) arrays of a StepBatch, rewards combined like in the dict API
+    return batch.agent_id, list(batch.obs), batch.reward + batch.group_reward, truncated
+
+
+def _worker(remote, parent_remote, env_kwargs):
+    parent_remote.close()
+    env = None
+    try:
+        env = BetterUnity3DEnv(**env_kwargs)
+        remote.send(("ok", None))
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                _, (batches, masks, truncated) = env._step_and_collect(data, env._collect_step_masks)
+                terminal = {name: _to_arrays(t) for name, (_, t) in batches.items()}
+                if truncated:
+                    # Auto-reset: the returned decision steps belong to the next episode
+                    batches = env.reset_batched()
+                    masks = {name: np.ones(len(d.agent_id), dtype=bool) for name, (d, _) in batches.items()}
+                decision = {name: _to_arrays(d, masks[name]) for name, (d, _) in batches.items()}
+                remote.send(("ok", (decision, terminal, truncated)))
+            elif cmd == "reset":
+                decision = {name: _to_arrays(d) for name, (d, _) in env.reset_batched().items()}
+                remote.send(("ok", decision))
+            elif cmd == "getattr":
+                remote.send(("ok", getattr(env, data)))
+            elif cmd == "call":
+                name, args, kwargs = data
+                remote.send(("ok", getattr(env, name)(*args, **kwargs)))
+            elif cmd == "close":
+                break
+            else:
+                raise NotImplementedError(f"Unknown command {cmd}")
+    except Exception:
+        remote.send(("error", traceback.format_exc()))
+    finally:
+        if env is not None:
+            env.close()
+        remote.close()
+
+
+class BetterUnity3DVecEnv:
+    """A pool of BetterUnity3DEnv instances, each running in its own subprocess.
+    Stepping is split into `step_async` and `step_wait`, so that all instances
+    run their Unity step and the Python post-processing concurrently.
+    Instances that reach the episode horizon are reset automatically.
+
+    Results are stacked over all instances per behavior (see `VecBatch`).
+    """
+
+    def __init__(
+            self,
+            num_envs: int,
+            env_kwargs: Optional[Union[dict, List[dict]]] = None,
+            start_method: Optional[str] = None,
+    ):
+        """Starts the workers and waits until every Unity instance is up.
+        Args:
+            num_envs: Number of Unity instances.
+            env_kwargs: Keyword arguments for BetterUnity3DEnv. Either one dict
+                used for all instances, or a list with one dict per instance.
+            start_method: multiprocessing start method (default of the platform if None).
+        """
+        if env_kwargs is None or isinstance(env_kwargs, dict):
+            env_kwargs = [dict(env_kwargs or {}) for _ in range(num_envs)]
+        assert len(env_kwargs) == num_envs, "Need one env_kwargs per env"
+        self.num_envs = num_envs
+        self.waiting = False
+        self.closed = False
+        # Instances whose reply to the last command has not been received yet (every worker reports its startup)
+        self._owes_reply = [True] * num_envs
+        # behavior_name -> number of decision rows per instance, used for splitting batched actions
+        self._rows_per_env = {}
+
+        ctx = mp.get_context(start_method)
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(num_envs)])
+        self.processes = []
+        for work_remote, remote, kwargs in zip(self.work_remotes, self.remotes, env_kwargs):
+            process = ctx.Process(target=_worker, args=(work_remote, remote, kwargs), daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+        # All instances boot in parallel, wait for every one of them
+        try:
+            self._recv_all()
+        except Exception:
+            # Stop the instances that did start
+            self.close()
+            raise
+
+    def _send(self, index: int, cmd: str, data=None):
+        self.remotes[index].send((cmd, data))
+        self._owes_reply[index] = True
+
+    def _send_all(self, cmd: str, data=None):
+        for index in range(self.num_envs):
+            self._send(index, cmd, data)
+
+    def _recv_all(self) -> list:
+        # Receives the replies of all instances before raising the errors, so none is left in a pipe
+        results = []
+        for index, remote in enumerate(self.remotes):
+            try:
+                results.append(remote.recv())
+            except EOFError:
+                results.append(("error", f"Worker {index} exited"))
+            self._owes_reply[index] = False
+        errors = [data for status, data in results if status == "error"]
+        if errors:
+            raise RuntimeError("Unity worker failed:\n" + "\n".join(errors))
+        return [data for _, data in results]
+
+    def _split_actions(self, actions) -> list:
+        # {behavior: stacked array} -> one {behavior: array} per instance
+        per_env = [{} for _ in range(self.num_envs)]
+        for behavior_name, stacked in actions.items():
+            counts = self._rows_per_env[behavior_name]
+            for env_index, env_actions in enumerate(np.split(stacked, np.cumsum(counts)[:-1])):
+                per_env[env_index][behavior_name] = env_actions
+        return per_env
+
+    def _stack(self, results) -> dict:
+        stacked = {}
+        for behavior_name in results[0]:
+            parts = [result[behavior_name] for result in results]
+            counts = [len(agent_id) for agent_id, _, _, _ in parts]
+            num_obs = len(parts[0][1])
+            stacked[behavior_name] = VecBatch(
+                env_index=np.repeat(np.arange(len(parts)), counts),
+                agent_id=np.concatenate([agent_id for agent_id, _, _, _ in parts]),
+                obs=[np.concatenate([obs[i] for _, obs, _, _ in parts]) for i in range(num_obs)],
+                reward=np.concatenate([reward for _, _, reward, _ in parts]),
+                truncated=np.concatenate([truncated for _, _, _, truncated in parts])
+                if parts[0][3] is not None else None,
+            )
+        return stacked
+
+    def _update_rows(self, decision_results):
+        for behavior_name in decision_results[0]:
+            self._rows_per_env[behavior_name] = [
+                len(result[behavior_name][0]) for result in decision_results
+            ]
+
+    def reset(self) -> dict:
+        """Resets all instances.
+        Returns:
+            dict: behavior name -> VecBatch of the agents requesting a decision.
+        """
+        self._send_all("reset")
+        decision_results = self._recv_all()
+        self._update_rows(decision_results)
+        return self._stack(decision_results)
+
+    def step_async(self, actions: Union[dict, list, None] = None):
+        """Sends actions to all instances without waiting for the results.
+        Args:
+            actions: Either batched actions {behavior name: array} with rows in
+                the order of the last returned VecBatch, a list with one action
+                dict (see BetterUnity3DEnv.step) per instance, or None for no actions.
+        """
+        if actions is None:
+            actions = [{} for _ in range(self.num_envs)]
+        elif isinstance(actions, dict):
+            actions = self._split_actions(actions)
+        elif len(actions) != self.num_envs:
+            # Every instance has to get a step command, step_wait would wait forever otherwise
+            raise ValueError(f"Got {len(actions)} action dicts for {self.num_envs} instances")
+        self.waiting = True
+        for index, env_actions in enumerate(actions):
+            self._send(index, "step", env_actions)
+
+    def step_wait(self):
+        """Waits for the results of `step_async`.
+        Returns:
+            tuple:
+                - decision: behavior name -> VecBatch of the agents requesting a decision.
+                    For instances that were reset, these are the first steps of the new episode.
+                    VecBatch.truncated marks the agents that reached the episode horizon (all agents
+                    of the reset instances).
+                - terminal: behavior name -> VecBatch of the agents whose episode ended.
+                - truncated: Bool array, True for instances whose agents all reached the horizon
+                    and were reset.
+        """
+        try:
+            results = self._recv_all()
+        finally:
+            self.waiting = False
+        decision_results = [decision for decision, _, _ in results]
+        self._update_rows(decision_results)
+        decision = self._stack(decision_results)
+        terminal = self._stack([terminal for _, terminal, _ in results])
+        truncated = np.array([truncated for _, _, truncated in results], dtype=bool)
+        return decision, terminal, truncated
+
+    def step(self, actions: Union[dict, list, None] = None):
+        """Steps all instances concurrently, see `step_async` and `step_wait`."""
+        self.step_async(actions)
+        return self.step_wait()
+
+    def env_method(self, name: str, *args, **kwargs) -> list:
+        """Calls a method of the BetterUnity3DEnv of every instance and returns the results."""
+        self._send_all("call", (name, args, kwargs))
+        return self._recv_all()
+
+    def get_attr(self, name: str) -> list:
+        """Returns an attribute of the BetterUnity3DEnv of every instance."""
+        self._send_all("getattr", name)
+        return self._recv_all()
+
+    def pids(self) -> dict:
+        """Returns worker id -> process id of the Unity instances (see telemetry.py)."""
+        return {worker_id: pid for worker_id, pid in zip(self.get_attr("worker_id"), self.get_attr("pid"))
+                if pid is not None}
+
+    def close(self):
+        if self.closed:
+            return
+        # Workers that failed have already exited, their pipes are closed
+        for index, remote in enumerate(self.remotes):
+            try:
+                if self._owes_reply[index]:
+                    remote.recv()
+                remote.send(("close", None))
+            except (BrokenPipeError, EOFError, ConnectionResetError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.closed = True
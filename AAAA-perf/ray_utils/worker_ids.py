@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+from typing import Optional
+
+import psutil
+
+
+class WorkerIdAllocator:
+    """Leases Unity worker ids (port = base_port + worker_id) through lock files.
+
+    Each leased id has a lock file ``<lock_dir>/worker_<id>.lock`` containing the
+    pid of the leasing process. Ids are handed out lowest-first, so a fleet of N
+    environments always gets the same ports instead of retrying random ones.
+    Lock files of dead processes are treated as free, so a crashed run does not
+    leak ids.
+    """
+
+    def __init__(self, lock_dir: Optional[str] = None, max_worker_id: int = 9999):
+        """
+        Args:
+            lock_dir: Directory for the lock files. Should be local to the machine,
+                since the ports are. Defaults to a folder in the temp directory.
+            max_worker_id: Largest worker id that can be leased.
+        """
+        self.lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), "aaaa_unity_worker_ids")
+        self.max_worker_id = max_worker_id
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _lock_path(self, worker_id: int) -> str:
+        return os.path.join(self.lock_dir, f"worker_{worker_id}.lock")
+
+    def _read_pid(self, path: str) -> int:
+        # Returns the pid in a lock file, 0 if it cannot be read
+        try:
+            with open(path) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    def _is_stale(self, pid: int) -> bool:
+        # Only a lock with the pid of a dead process is stale. Lock files are written atomically (see acquire),
+        # but an empty or unreadable file is treated as in use, to never take an id that might be leased.
+        return pid > 0 and not psutil.pid_exists(pid)
+
+    def _reclaim(self, path: str, pid: int):
+        # Removes a stale lock file. The file is first renamed to a name of this process, so that a lock
+        # that another process created after the staleness check is not removed but put back.
+        reclaim_path = f"{path}.{os.getpid()}.{threading.get_ident()}.reclaim"
+        try:
+            os.rename(path, reclaim_path)
+        except FileNotFoundError:
+            return  # Reclaimed by another process
+        if self._read_pid(reclaim_path) != pid:
+            try:
+                os.link(reclaim_path, path)
+            except FileExistsError:
+                pass
+        os.remove(reclaim_path)
+
+    def acquire(self, start: int = 0) -> int:
+        """Leases the lowest free worker id that is >= start."""
+        # The pid is written to a temporary file that is then linked to the lock path, so a lock file
+        # always contains a pid. os.link fails, if the lock file exists. The temporary file is per call,
+        # since threads of the same process lease concurrently.
+        tmp_path = os.path.join(self.lock_dir, f"lease.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(os.getpid()))
+        try:
+            worker_id = start
+            while worker_id <= self.max_worker_id:
+                path = self._lock_path(worker_id)
+                try:
+                    os.link(tmp_path, path)
+                except FileExistsError:
+                    pid = self._read_pid(path)
+                    if self._is_stale(pid):
+                        self._reclaim(path, pid)
+                        continue  # Try the same id again
+                    worker_id += 1
+                    continue
+                return worker_id
+        finally:
+            os.remove(tmp_path)
+        raise RuntimeError(f"No free worker ids in range [{start}, {self.max_worker_id}] in {self.lock_dir}")
+
+    def release(self, worker_id: int):
+        """Returns a leased worker id."""
+        try:
+            os.remove(self._lock_path(worker_id))
+        except FileNotFoundError:
+            pass
+
+
+_default_allocator = None
+
+
+def get_default_allocator() -> WorkerIdAllocator:
+    """Returns the allocator shared by all environments of this machine."""
+    global _default_allocator
+    if _default_allocator is None:
+        _default_allocator = WorkerIdAllocator()
+    return _default_allocator
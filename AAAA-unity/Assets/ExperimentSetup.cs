@@ -37,9 +37,12 @@ public class ExperimentSetup : MonoBehaviour
     public string modelPath = string.Empty;  // Path to any onnx model that will be used to override the agent model
     public float targetSpeed = 0.0f; // Movement speed of the target. Set 0 to disable movement.
     public int numAudioSources = 1;  // If above 1, duplicates the target to create multiple audio sources for performance testing
+    public int benchmarkSeed = -1;  // Seed offset for the benchmark episodes, -1 keeps the default of the Benchmark
     
     
     private GameObject activeAgent;
+    private NavTarget target;
+    private readonly List<GameObject> extraAudioSources = new List<GameObject>();  // Copies of the target
     
     void Awake()
     {
@@ -47,6 +50,19 @@ public class ExperimentSetup : MonoBehaviour
         // Call the ParseArgs method to initialize configurations
         ParseArgs();
         // Instantiate the selected agent based on the agent type
+        CreateAgent();
+        
+        // Update NavMeshAgent speed for any NavTarget objects
+        target = FindObjectOfType<NavTarget>();
+        SetTargetSpeed(targetSpeed);
+        
+        SetAudioSources(numAudioSources);
+        
+        RegisterParameterCallbacks();
+    }
+    
+    void CreateAgent()
+    {
         Debug.Log($"Creating agent of type: {agent}");
         switch (agent)
         {
@@ -71,6 +87,56 @@ public class ExperimentSetup : MonoBehaviour
         activeAgent.GetComponent<NewAgent>().losScale = losRewardScale;
         
         // Change audio agent decision period
+        SetDecisionPeriod(decisionPeriod);
+        
+        // Make sure the agent is activated
+        activeAgent.SetActive(true); 
+        
+        // Switch model if we are not training
+        if (enableBenchmark && modelPath != string.Empty)
+        {
+            ChangeModel(modelPath);
+            
+            // Attempt to force agent to update its model
+            activeAgent.SetActive(false); 
+            activeAgent.SetActive(true); 
+        }
+    }
+    
+    void RegisterParameterCallbacks()
+    {
+        // Allows reconfiguring a running instance from python (EnvironmentParametersChannel),
+        // so that performance measurements can reuse already started instances.
+        // Applied values are sent back as stats ("Config/<name>") to acknowledge them.
+        var parameters = Academy.Instance.EnvironmentParameters;
+        parameters.RegisterCallback("agent", value => SetAgent((AgentType)Mathf.RoundToInt(value)));
+        parameters.RegisterCallback("decisionPeriod", value => SetDecisionPeriod(Mathf.RoundToInt(value)));
+        parameters.RegisterCallback("targetSpeed", SetTargetSpeed);
+        parameters.RegisterCallback("audioSources", value => SetAudioSources(Mathf.RoundToInt(value)));
+    }
+    
+    void AcknowledgeParameter(string name, float value)
+    {
+        Academy.Instance.StatsRecorder.Add($"Config/{name}", value, StatsAggregationMethod.MostRecent);
+    }
+    
+    void SetAgent(AgentType newAgent)
+    {
+        if (newAgent != agent || activeAgent == null)
+        {
+            if (activeAgent != null)
+            {
+                Destroy(activeAgent);
+            }
+            agent = newAgent;
+            CreateAgent();
+        }
+        AcknowledgeParameter("agent", (int)agent);
+    }
+    
+    void SetDecisionPeriod(int period)
+    {
+        decisionPeriod = period;
         NewAudioAgent audioAgent = activeAgent.GetComponent<NewAudioAgent>();
         if (audioAgent != null)
         {
@@ -78,39 +144,52 @@ public class ExperimentSetup : MonoBehaviour
             audioAgent.DecisionInterval = decisionPeriod;
             //audioAgent.ValidateIntervals();  // Prints errors if decision period is not within bounds
         }
-        
-        // Update NavMeshAgent speed for any NavTarget objects
-        NavTarget target = FindObjectOfType<NavTarget>();
+        AcknowledgeParameter("decisionPeriod", decisionPeriod);
+    }
+    
+    void SetTargetSpeed(float speed)
+    {
+        targetSpeed = speed;
         if (target != null)
         {
-            NavMeshAgent navAgent = target.GetComponent<NavMeshAgent>();
-            if (navAgent != null)
+            SetNavAgentSpeed(target.gameObject, targetSpeed);
+            foreach (var audioSource in extraAudioSources)
             {
-                navAgent.speed = targetSpeed;
-                Debug.Log($"Target speed set to: {targetSpeed}");
+                SetNavAgentSpeed(audioSource, targetSpeed);
             }
+            Debug.Log($"Target speed set to: {targetSpeed}");
         }
-        
-        // Make sure the agent is activated
-        activeAgent.SetActive(true); 
-        
-        // Switch model if we are not training
-        if (enableBenchmark && modelPath != string.Empty)
+        AcknowledgeParameter("targetSpeed", targetSpeed);
+    }
+    
+    static void SetNavAgentSpeed(GameObject obj, float speed)
+    {
+        NavMeshAgent navAgent = obj.GetComponent<NavMeshAgent>();
+        if (navAgent != null)
         {
-            ChangeModel(modelPath);
-            
-            // Attempt to force agent to update its model
-            activeAgent.SetActive(false); 
-            activeAgent.SetActive(true); 
+            navAgent.speed = speed;
         }
-
-        if (numAudioSources > 1)
+    }
+    
+    void SetAudioSources(int count)
+    {
+        // The target itself is the first audio source, others are copies of it
+        numAudioSources = Math.Max(count, 1);
+        if (target != null)
         {
-            for (int i = 1; i < numAudioSources; i++)
+            while (extraAudioSources.Count < numAudioSources - 1)
+            {
+                extraAudioSources.Add(Instantiate(target).gameObject);
+            }
+            while (extraAudioSources.Count > numAudioSources - 1)
             {
-                Instantiate(target);
+                int last = extraAudioSources.Count - 1;
+                Destroy(extraAudioSources[last]);
+                extraAudioSources.RemoveAt(last);
             }
+            Debug.Log($"Number of audio sources set to: {numAudioSources}");
         }
+        AcknowledgeParameter("audioSources", numAudioSources);
     }
     void Start()
     {
@@ -120,6 +199,10 @@ public class ExperimentSetup : MonoBehaviour
             var benchmark = FindObjectOfType<Benchmark>();
             var sceneName = UnityEngine.SceneManagement.SceneManager.GetActiveScene().name;
             benchmark.csvName = $"{agent}_{benchmarkName}_{sceneName}.csv";
+            if (benchmarkSeed >= 0)
+            {
+                benchmark.seedOffset = benchmarkSeed;
+            }
             if (enableSmoketest)
             {
                 benchmark.episodes = 5;
@@ -238,6 +321,9 @@ public class ExperimentSetup : MonoBehaviour
                     Debug.Log("-losReward (Float value to set the line-of-sight reward scale)");
                     Debug.Log("-targetSpeed (Float value to set the speed of NavMeshAgent)");
                     Debug.Log("-audioSources (Integer, if above 1 creates additional audio sources for performance testing)");
+                    Debug.Log("-seed (Integer, seed offset for the benchmark episodes)");
+                    Debug.Log("-sharedObs (Path, write the audio observations to this memory-mapped file instead of sending them through gRPC)");
+                    Debug.Log("-sharedObsSlots (Integer, number of steps kept in the -sharedObs file, default 4)");
                     Debug.Log("Example benchmark: ./build.x86_64 -agent hanning -model models/hanning-1.onnx -benchmark -name hanning_1 -decisionPeriod 10 -losReward 0.5 -targetSpeed 3.5");
                     Debug.Log("Example training: ./build.x86_64 -agent hanning");
                     Debug.Log("Example smoketest: ./build.x86_64 -agent hanning -benchmark -smoketest");
@@ -313,6 +399,15 @@ public class ExperimentSetup : MonoBehaviour
                         numAudioSources = numSources;
                     }
                     break;
+                case "-seed":
+                    Debug.Log("Executing -seed case");
+                    // Seed offset for the benchmark episodes, used for repeated benchmarks
+                    if (i + 1 < args.Length && int.TryParse(args[i + 1], out var seed))
+                    {
+                        Debug.Log($"Got benchmark seed: {seed}");
+                        benchmarkSeed = seed;
+                    }
+                    break;
                 case "-targetspeed":
                     Debug.Log("Executing -targetSpeed case");
                     // Specify the target speed for NavMeshAgent
@@ -362,6 +457,12 @@ public class ExperimentSetup : MonoBehaviour
             
             argsList.Add("-audioSources");
             argsList.Add(numAudioSources.ToString());
+            
+            if (benchmarkSeed >= 0)
+            {
+                argsList.Add("-seed");
+                argsList.Add(benchmarkSeed.ToString());
+            }
 
             // Add target speed argument
             argsList.Add("-targetSpeed");
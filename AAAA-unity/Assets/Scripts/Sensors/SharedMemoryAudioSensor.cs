@@ -0,0 +1,84 @@
+using Unity.MLAgents.Sensors;
+
+namespace MBaske.Sensors.Audio
+{
+    /// <summary>
+    /// Sensor that writes the observations of an <see cref="AudioSensor"/> to <see cref="SharedObservationMemory"/>
+    /// and only sends a reference to them (row, slot, tag) through gRPC.
+    /// </summary>
+    public class SharedMemoryAudioSensor : ISensor
+    {
+        private readonly AudioSensor m_AudioSensor;
+        private readonly ObservationSpec m_ObservationSpec;
+        private readonly int m_Row;
+        private readonly float[] m_Values;
+
+        /// <summary>
+        /// Initializes the sensor.
+        /// </summary>
+        /// <param name="audioSensor">The <see cref="AudioSensor"/> to read the observations from.</param>
+        public SharedMemoryAudioSensor(AudioSensor audioSensor)
+        {
+            m_AudioSensor = audioSensor;
+            // Python recognizes the references by the name suffix
+            m_ObservationSpec = ObservationSpec.Vector(3);
+            var shape = audioSensor.Shape;
+            m_Row = SharedObservationMemory.Register(new[] { shape.Height, shape.Width, shape.Channels });
+            m_Values = new float[shape.Height * shape.Width * shape.Channels];
+        }
+
+        /// <inheritdoc/>
+        public int Write(ObservationWriter writer)
+        {
+            // Same order as AudioSensor.Write: writer[y, x, channel]
+            var shape = m_AudioSensor.Shape;
+            int c = shape.Channels;
+            int n = shape.Width * shape.Height;
+            for (int channel = 0; channel < c; channel++)
+            {
+                for (int i = 0; i < n; i++)
+                {
+                    m_Values[i * c + channel] = m_AudioSensor.Buffer.GetSample(channel, i);
+                }
+            }
+            SharedObservationMemory.Write(m_Row, m_Values, writer);
+            return 3;
+        }
+
+        /// <inheritdoc/>
+        public string GetName()
+        {
+            return m_AudioSensor.GetName() + "_Shared";
+        }
+
+        /// <inheritdoc/>
+        public ObservationSpec GetObservationSpec()
+        {
+            return m_ObservationSpec;
+        }
+
+        /// <inheritdoc/>
+        public byte[] GetCompressedObservation()
+        {
+            return null;
+        }
+
+        /// <inheritdoc/>
+        public CompressionSpec GetCompressionSpec()
+        {
+            return CompressionSpec.Default();
+        }
+
+        /// <inheritdoc/>
+        public void Update()
+        {
+            m_AudioSensor.Update();
+        }
+
+        /// <inheritdoc/>
+        public void Reset()
+        {
+            m_AudioSensor.Reset();
+        }
+    }
+}
@@ -0,0 +1,175 @@
+using System;
+using System.IO;
+using System.IO.MemoryMappedFiles;
+using System.Text;
+using Unity.MLAgents;
+using Unity.MLAgents.Sensors;
+using UnityEngine;
+
+namespace MBaske.Sensors.Audio
+{
+    /// <summary>
+    /// Memory-mapped file that the audio observations are written to instead of sending them through gRPC.
+    /// Enabled with the -sharedObs &lt;path&gt; argument (and optionally -sharedObsSlots &lt;n&gt;), only when
+    /// connected to Python. The layout is described in AAAA-perf/ray_utils/shared_obs.py.
+    /// </summary>
+    public static class SharedObservationMemory
+    {
+        private const int c_HeaderSize = 64;
+        private const int c_Version = 1;
+        private const int c_TagModulo = 1 << 24;
+
+        private static bool s_ArgsParsed;
+        private static string s_Path;
+        private static int s_NumSlots = 4;
+
+        private static int s_NumRows;
+        private static int[] s_Shape;
+        private static int s_RowSize;
+        private static MemoryMappedFile s_File;
+        private static MemoryMappedViewAccessor s_Accessor;
+        private static long s_ObsOffset;
+
+        private static int s_LastAcademyStep = -1;
+        private static long s_Sequence = -1;
+        // Sequence that each row was last written in
+        private static long[] s_RowSequence;
+
+        /// <summary>
+        /// Whether the observations should be written to shared memory.
+        /// </summary>
+        public static bool Enabled
+        {
+            get
+            {
+                ParseArgs();
+                return s_Path != null && Academy.Instance.IsCommunicatorOn;
+            }
+        }
+
+        private static void ParseArgs()
+        {
+            if (s_ArgsParsed) return;
+            s_ArgsParsed = true;
+            #if UNITY_EDITOR
+            string[] args = (Environment.GetEnvironmentVariable("UNITY_CMD_ARGS") ?? string.Empty).Split(' ');
+            #else
+            string[] args = Environment.GetCommandLineArgs();
+            #endif
+            for (int i = 0; i < args.Length - 1; i++)
+            {
+                switch (args[i].ToLower())
+                {
+                    case "-sharedobs":
+                        s_Path = args[i + 1];
+                        break;
+                    case "-sharedobsslots":
+                        if (int.TryParse(args[i + 1], out var slots) && slots > 0)
+                        {
+                            s_NumSlots = slots;
+                        }
+                        break;
+                }
+            }
+        }
+
+        /// <summary>
+        /// Reserves a row for the observations of one sensor.
+        /// All sensors have to register before the first observation is written.
+        /// </summary>
+        /// <param name="shape">Observation shape (height, width, channels).</param>
+        /// <returns>The row of the sensor.</returns>
+        public static int Register(int[] shape)
+        {
+            if (s_Accessor != null)
+            {
+                throw new InvalidOperationException("Shared observation sensors have to be created before the first step.");
+            }
+            if (s_Shape == null)
+            {
+                s_Shape = shape;
+                s_RowSize = 1;
+                foreach (int dim in shape) s_RowSize *= dim;
+            }
+            else if (string.Join(",", s_Shape) != string.Join(",", shape))
+            {
+                throw new ArgumentException("All shared observation sensors need the same observation shape.");
+            }
+            return s_NumRows++;
+        }
+
+        private static void Create()
+        {
+            long tagsSize = 8L * s_NumSlots * s_NumRows;
+            s_ObsOffset = (c_HeaderSize + tagsSize + 63) / 64 * 64;
+            long size = s_ObsOffset + 4L * s_NumSlots * s_NumRows * s_RowSize;
+
+            // Python waits for the magic bytes, so they are written last
+            using (var stream = new FileStream(s_Path, FileMode.Create, FileAccess.ReadWrite, FileShare.ReadWrite))
+            {
+                stream.SetLength(size);
+            }
+            s_File = MemoryMappedFile.CreateFromFile(s_Path, FileMode.Open, null, size, MemoryMappedFileAccess.ReadWrite);
+            s_Accessor = s_File.CreateViewAccessor(0, size);
+            s_RowSequence = new long[s_NumRows];
+            for (int i = 0; i < s_NumRows; i++) s_RowSequence[i] = -1;
+            s_Accessor.Write(4, (uint)c_Version);
+            s_Accessor.Write(8, (uint)s_NumSlots);
+            s_Accessor.Write(12, (uint)s_NumRows);
+            s_Accessor.Write(16, (uint)s_Shape.Length);
+            for (int i = 0; i < s_Shape.Length; i++)
+            {
+                s_Accessor.Write(20 + 4 * i, (uint)s_Shape[i]);
+            }
+            for (long offset = c_HeaderSize; offset < c_HeaderSize + tagsSize; offset += 8)
+            {
+                s_Accessor.Write(offset, -1L);
+            }
+            s_Accessor.WriteArray(0, Encoding.ASCII.GetBytes("AOBS"), 0, 4);
+            s_Accessor.Flush();
+            Application.quitting += Dispose;
+            Debug.Log($"Writing {s_NumRows} audio observations of shape ({string.Join(", ", s_Shape)}) to {s_Path}");
+        }
+
+        /// <summary>
+        /// Writes the observation of one sensor to shared memory and the reference to it
+        /// (row, slot, tag) to the observation writer.
+        /// </summary>
+        /// <param name="row">Row returned by <see cref="Register"/>.</param>
+        /// <param name="values">Observation values in (height, width, channels) order.</param>
+        /// <param name="writer">Writer of the 3 reference values.</param>
+        public static void Write(int row, float[] values, ObservationWriter writer)
+        {
+            if (s_Accessor == null) Create();
+
+            // All sensors that write during the same academy step belong to the same step on the Python side.
+            // A row that is written again in the same step was written after the observations of the step were sent
+            // (EndEpisode() in FixedUpdate or in OnActionReceived). It is sent with the next step and gets a new
+            // sequence, so that it does not overwrite the observation that Python received with this step.
+            int academyStep = Academy.Instance.TotalStepCount;
+            if (academyStep != s_LastAcademyStep || s_RowSequence[row] == s_Sequence)
+            {
+                s_LastAcademyStep = academyStep;
+                s_Sequence++;
+            }
+            s_RowSequence[row] = s_Sequence;
+            int slot = (int)(s_Sequence % s_NumSlots);
+            long index = (long)slot * s_NumRows + row;
+            s_Accessor.WriteArray(s_ObsOffset + 4 * index * s_RowSize, values, 0, s_RowSize);
+            s_Accessor.Write(c_HeaderSize + 8 * index, s_Sequence);
+
+            writer[0] = row;
+            writer[1] = slot;
+            writer[2] = s_Sequence % c_TagModulo;
+        }
+
+        private static void Dispose()
+        {
+            // The file is deleted by Python
+            s_Accessor?.Dispose();
+            s_File?.Dispose();
+            s_Accessor = null;
+            s_File = null;
+        }
+    }
+}
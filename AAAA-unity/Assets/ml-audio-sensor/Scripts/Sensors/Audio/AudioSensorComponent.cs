@@ -288,6 +288,9 @@ namespace MBaske.Sensors.Audio
         // Sampling step count < buffer length.
         private int m_SamplingStepCount;
 
+        // Wrapper of Sensor when the observations go through shared memory.
+        private SharedMemoryAudioSensor m_SharedSensor;
+
 
         /// <inheritdoc/>
         public override ISensor[] CreateSensors()
@@ -297,6 +300,15 @@ namespace MBaske.Sensors.Audio
                 Sensor = new AudioSensor(m_Shape, m_CompressionType, SensorName);
                 Sensor.ResetEvent += OnSensorReset;
             }
+            if (SharedObservationMemory.Enabled)
+            {
+                // Observations go through shared memory, gRPC only carries a reference to them
+                if (m_SharedSensor == null)
+                {
+                    m_SharedSensor = new SharedMemoryAudioSensor(Sensor);
+                }
+                return new ISensor[] { m_SharedSensor };
+            }
             return new ISensor[] { Sensor };
         }
 
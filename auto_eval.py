@@ -1,7 +1,11 @@
 import os
 import argparse
-from concurrent.futures import ThreadPoolExecutor
+import itertools
 import re
+import sys
+
+from eval_cache import ResultsCache, output_csvs
+from eval_scheduler import EvalJob, EvalScheduler
 
 
 """
@@ -39,7 +43,56 @@ def find_onnx_files(results_dir):
     return onnx_files
 
 
-def evaluate_model(folder, file, decision_period, results_dir, executable_path, smoketest, dynamic):
+# Target speed of the "dynamic" benchmarks
+DYNAMIC_TARGET_SPEED = 5
+
+# Default sweep, see sweeps/default.yaml for the meaning of the values
+DEFAULT_SWEEP = {
+    "builds": {"default": "./builds/aaaa/audio.x86_64"},
+    "results_dir": "results",
+    "models": [],
+    "decision_periods": [1],  # During eval, both 1 and 10 give similar results
+    "target_speeds": [0],
+    "audio_sources": [1],
+    "los_rewards": [],
+    "repeats": 1,
+    "seed": None,
+    "smoketest": False,
+}
+
+
+def format_number(value):
+    # Shortest text that is parsed back to the same float (repr), without a trailing ".0".
+    # "{:g}" would round to 6 digits, so different sweep values could get the same output name.
+    text = repr(float(value))
+    return text[:-2] if text.endswith(".0") else text
+
+
+def create_output_name(name, decision_period, target_speed, audio_sources=1, los_reward=None, seed=None,
+                       build_name=None):
+    # Create some unique name for the output csv.
+    # Optional parts are only added if they are used, plotting/parse_name.py parses all of them.
+    parts = [name, f"d{decision_period}"]
+    if audio_sources != 1:
+        parts.append(f"a{audio_sources}")
+    if los_reward is not None:
+        parts.append(f"l{format_number(los_reward)}")
+    if seed is not None:
+        parts.append(f"s{seed}")
+    if build_name is not None:
+        parts.append(f"b{build_name.replace('_', '-')}")
+    if target_speed == 0:
+        parts.append("static")
+    elif target_speed == DYNAMIC_TARGET_SPEED:
+        parts.append("dynamic")
+    else:
+        parts.append(f"dynamic{format_number(target_speed)}")
+    return "_".join(parts)
+
+
+def evaluate_model(folder, file, decision_period, results_dir, executable_path, smoketest, target_speed=0,
+                   audio_sources=1, los_reward=None, seed=None, build_name=None):
+    # Creates the benchmark job for one model
     print(f"Evaluating {file} in {folder} with decision period {decision_period}...")
     # Figure out the full agent name from the inefficient naming convention
     name = folder
@@ -51,48 +104,134 @@ def evaluate_model(folder, file, decision_period, results_dir, executable_path,
     # Get full path to the model file
     relative_model_path = os.path.join(results_dir, folder, file)
     full_model_path = os.path.join(os.getcwd(), relative_model_path)
-    # Create some unique name for the output csv
-    output_name = f"{name}_d{decision_period}"
-    if dynamic:
-        target_speed = 5
-        output_name += "_dynamic"
-    else:
-        target_speed = 0
-        output_name += "_static"
+    output_name = create_output_name(name, decision_period, target_speed, audio_sources, los_reward, seed,
+                                     build_name)
     # Params for running the benchmark
     args = ["-benchmark"]
     if smoketest:
         args.append("-smoketest")
-    args.append(f"-agent {agent_name}")
-    args.append(f"-model {full_model_path}")
-    args.append(f"-name {output_name}")
-    args.append(f"-decisionPeriod {decision_period}")
-    # Add dynamic target speed parameter
-
-    args.append(f"-targetSpeed {target_speed}")
-
-    args_str = " ".join(args)
-    command = f"{executable_path} {args_str}"
-    print(command)
-    os.system(command)
-
-
-def eval_all(onnx_files, results_dir, executable_path, max_workers, smoketest, dynamic):
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        use_dynamic_target = [True, False] if dynamic else [False]
-        for folder, files in onnx_files.items():
-            for file in files:
-                for is_dynamic in use_dynamic_target:
-                    decision_periods = [1, 10]  # During eval, both 1 and 10 give similar results
-                    decision_periods = [1]
-                    for decision_period in decision_periods:
-                        futures.append(
-                            executor.submit(evaluate_model, folder, file, decision_period, results_dir, executable_path,
-                                            smoketest, dynamic=is_dynamic))
-        # Optionally, wait for all futures to complete
-        for future in futures:
-            future.result()
+    args += ["-agent", agent_name]
+    args += ["-model", full_model_path]
+    args += ["-name", output_name]
+    args += ["-decisionPeriod", f"{decision_period}"]
+    args += ["-targetSpeed", format_number(target_speed)]
+    # Optional sweep parameters, the defaults of the build are used otherwise
+    if audio_sources != 1:
+        args += ["-audioSources", f"{audio_sources}"]
+    if los_reward is not None:
+        args += ["-losReward", format_number(los_reward)]
+    if seed is not None:
+        args += ["-seed", f"{seed}"]
+
+    command = [executable_path] + args
+    print(" ".join(command))
+    return EvalJob(name=output_name, command=command)
+
+
+def load_sweep(path):
+    import yaml
+    with open(path) as f:
+        sweep = yaml.safe_load(f) or {}
+    unknown = set(sweep) - set(DEFAULT_SWEEP)
+    if unknown:
+        raise ValueError(f"Unknown keys in sweep {path}: {sorted(unknown)}")
+    return {**DEFAULT_SWEEP, **sweep}
+
+
+def expand_sweep(sweep, onnx_files):
+    # Creates a job for every combination of builds x models x decision periods x target speeds x audio sources
+    # x line-of-sight rewards x repeats
+    builds = sweep["builds"]
+    if isinstance(builds, str):
+        builds = {"default": builds}
+    # The build name is only needed in the output name, if there is more than one build
+    build_names = list(builds) if len(builds) > 1 else [None]
+    models = []
+    for folder, files in onnx_files.items():
+        if sweep["models"] and folder not in sweep["models"]:
+            continue
+        # The output names only contain the folder, so only one model per folder can be evaluated
+        files = sorted(files)
+        for file in files[1:]:
+            print(f"WARNING: Skipping {file} in {folder}, only {files[0]} is evaluated (one model per folder)")
+        models += [(folder, file) for file in files[:1]]
+    los_rewards = sweep["los_rewards"] or [None]
+    if sweep["repeats"] > 1 or sweep["seed"] is not None:
+        first_seed = 100 if sweep["seed"] is None else sweep["seed"]  # 100 is the default seed offset of the Benchmark
+        seeds = [first_seed + i for i in range(sweep["repeats"])]
+    else:
+        seeds = [None]
+
+    jobs = []
+    for build_name, (folder, file), decision_period, target_speed, audio_sources, los_reward, seed in \
+            itertools.product(build_names, models, sweep["decision_periods"], sweep["target_speeds"],
+                              sweep["audio_sources"], los_rewards, seeds):
+        executable_path = builds[build_name] if build_name is not None else next(iter(builds.values()))
+        jobs.append(evaluate_model(folder, file, decision_period, sweep["results_dir"], executable_path,
+                                   sweep["smoketest"], target_speed=target_speed, audio_sources=audio_sources,
+                                   los_reward=los_reward, seed=seed, build_name=build_name))
+    names = [job.name for job in jobs]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError(f"Sweep creates multiple jobs with the same output name: {duplicates}")
+    return jobs
+
+
+def skip_completed(jobs, cache, logs_dir, force=False):
+    # Returns the jobs that still have to be run and the cache key for each of them
+    todo = []
+    keys = {}
+    for job in jobs:
+        key = cache.job_key(job.command)
+        status = cache.status(key)
+        csvs = output_csvs(job.command, logs_dir)
+        if status == "done" and csvs and not force:
+            print(f"Skipping {job.name} (already evaluated)")
+            continue
+        # Unity skips scenes whose csv already exists. Remove the csv files, if they might be incomplete
+        # (interrupted or failed earlier) or if they were created with other arguments or another model.
+        owner = cache.owner(job.name)
+        if force or status is not None or (owner is not None and owner != key):
+            for path in csvs:
+                print(f"Removing outdated {path}")
+                os.remove(path)
+        cache.set_status(key, job.name, "pending")
+        keys[job.name] = key
+        todo.append(job)
+    cache.save()
+    return todo, keys
+
+
+def eval_all(onnx_files, sweep, scheduler, cache=None, logs_dir="logs", force=False, live=None):
+    # live: Optional plotting/live_metrics.LiveMetrics of logs_dir, the csv files of each job are finished
+    # in it as soon as the job exits
+    jobs = expand_sweep(sweep, onnx_files)
+    if cache is not None:
+        jobs, keys = skip_completed(jobs, cache, logs_dir, force)
+    commands = {job.name: job.command for job in jobs}
+    if live is not None:
+        # Drops the results of the removed csv files before the jobs write them again
+        live.poll()
+
+    def on_result(result):
+        if cache is not None:
+            # Save after every job, so an interrupted sweep can be resumed
+            cache.set_status(keys[result.name], result.name, "done" if result.returncode == 0 else "failed")
+            cache.save()
+        if live is not None:
+            live.finish(output_csvs(commands[result.name], logs_dir))
+
+    def on_retry(job):
+        # Unity skips scenes whose csv already exists, so the retry would keep the incomplete csv files
+        for path in output_csvs(job.command, logs_dir):
+            print(f"Removing incomplete {path}")
+            os.remove(path)
+    results = scheduler.run(jobs, on_result=on_result, on_retry=on_retry)
+    failed = [result for result in results if result.returncode != 0]
+    print(f"Evaluated {len(results) - len(failed)}/{len(results)} jobs successfully")
+    for result in failed:
+        print(f"  FAILED: {result.name} (exit code {result.returncode}, see {result.log_path})")
+    return results
 
 
 if __name__ == '__main__':
@@ -103,21 +242,81 @@ if __name__ == '__main__':
                         default="./builds/aaaa/audio.x86_64",
                         help="Path to the executable")
     parser.add_argument("--max_workers", required=False, type=int, default=os.cpu_count(),
-                        help="Maximum number of worker threads to use (Defaults to number of CPUs)")
+                        help="Maximum number of benchmarks running at the same time (Defaults to number of CPUs). "
+                             "New benchmarks are only started while there is CPU and memory headroom left.")
+    parser.add_argument("--timeout", required=False, type=float, default=None,
+                        help="Kill a benchmark after this many seconds (Default: no timeout)")
+    parser.add_argument("--retries", required=False, type=int, default=1,
+                        help="How many times a failed benchmark is retried")
+    parser.add_argument("--log_dir", required=False, default="logs/eval",
+                        help="Directory for the output logs of the benchmark processes")
+    parser.add_argument("--cpu_headroom", required=False, type=float, default=15.0,
+                        help="Percentage of CPU that should stay free when starting new benchmarks")
+    parser.add_argument("--memory_headroom", required=False, type=float, default=15.0,
+                        help="Percentage of memory that should stay free when starting new benchmarks")
+    parser.add_argument("--logs_dir", required=False, default="logs",
+                        help="Directory where Unity writes the benchmark csv files")
+    parser.add_argument("--manifest", required=False, default="logs/eval_manifest.json",
+                        help="Manifest of completed benchmarks. Benchmarks are skipped, if the model, build and "
+                             "arguments did not change since they were completed.")
+    parser.add_argument("--force", action='store_true', help="Run all benchmarks again, even if they are completed")
     parser.add_argument("--smoketest", action='store_true', help="Run a very short benchmark for debugging")
     parser.add_argument("--dynamic", action='store_true',
                         help="Run benchmark with dynamic target speed (targetspeed 5)")
+    parser.add_argument("--serve", action='store_true',
+                        help="Drive the benchmarks from Python and run the models with batched ONNX Runtime inference "
+                             "(one forward pass per model and step for all running benchmarks) instead of loading "
+                             "the model in every Unity process. Needs the requirements of AAAA-perf and onnxruntime.")
+    parser.add_argument("--time_scale", required=False, type=float, default=1,
+                        help="Unity time scale with --serve (Default: 1, same as without --serve)")
+    parser.add_argument("--live", required=False, type=float, default=None, metavar="SECONDS",
+                        help="Read the benchmark csv files every SECONDS while the benchmarks run and print the "
+                             "SPL, success rate and accuracy of each model (plotting/live_metrics.py). "
+                             "The final summary is saved to <logs_dir>/.live/summary.csv. Needs the requirements of plotting.")
+    parser.add_argument("--sweep", required=False, default=None,
+                        help="YAML file with a parameter sweep (see sweeps/default.yaml). "
+                             "Replaces --results_dir, --build_path, --smoketest and --dynamic.")
 
     args = parser.parse_args()
-    results_dir = args.results_dir
-    executable_path = args.build_path
     max_workers = args.max_workers
-    smoketest = args.smoketest
-    dynamic = args.dynamic
+    if args.sweep is not None:
+        sweep = load_sweep(args.sweep)
+    else:
+        sweep = dict(DEFAULT_SWEEP, results_dir=args.results_dir, builds={"default": args.build_path},
+                     smoketest=args.smoketest,
+                     target_speeds=[DYNAMIC_TARGET_SPEED, 0] if args.dynamic else [0])
+    results_dir = sweep["results_dir"]
 
     onnx_files = find_onnx_files(results_dir)
     for folder, files in onnx_files.items():
         print(f"Subfolder: {folder}")
         for file in files:
             print(f"  .onnx file: {file}")
-    eval_all(onnx_files, results_dir, executable_path, max_workers, smoketest, dynamic)
+    if args.serve:
+        from eval_server import EvalServer
+        scheduler = EvalServer(max_workers=max_workers, timeout=args.timeout, retries=args.retries,
+                               log_dir=args.log_dir, time_scale=args.time_scale)
+    else:
+        scheduler = EvalScheduler(max_workers=max_workers, timeout=args.timeout, retries=args.retries,
+                                  log_dir=args.log_dir, cpu_headroom=args.cpu_headroom,
+                                  memory_headroom=args.memory_headroom)
+    cache = ResultsCache(args.manifest)
+    live = None
+    if args.live is not None:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "plotting"))
+        from live_metrics import LiveMetrics
+        os.makedirs(args.logs_dir, exist_ok=True)
+        live = LiveMetrics(args.logs_dir)
+        live.start(args.live)
+    results = eval_all(onnx_files, sweep, scheduler, cache=cache, logs_dir=args.logs_dir, force=args.force,
+                       live=live)
+    if live is not None:
+        live.stop()
+        summary = live.summary()
+        if len(summary):
+            print(summary.to_string(index=False))
+            summary.to_csv(os.path.join(live.store_dir, "summary.csv"), index=False)
+        if live.unfinished():
+            print(f"Files of other benchmarks that are not finished: {live.unfinished()}")
+    if any(result.returncode != 0 for result in results):
+        exit(1)
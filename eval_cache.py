@@ -0,0 +1,87 @@
+import glob
+import hashlib
+import json
+import os
+import time
+
+
+"""
+Manifest of evaluation jobs, so that auto_eval.py only runs the benchmarks that are not done yet.
+
+A job is identified by the content hash of the model, the content hash of the build and the
+benchmark arguments. Changing (re-training) a model or rebuilding the Unity project therefore
+invalidates the affected results, while renaming or moving files does not.
+"""
+
+# -agent values and the matching AgentType names that Unity uses in the csv names
+UNITY_AGENT_NAMES = {"hanning": "Hanning", "random": "Random", "rect": "Rect",
+                     "hanningao": "HanningAO", "rectao": "RectAO"}
+
+
+def build_files(executable_path):
+    # The player executable is generic, the game logic is in the managed assemblies of the build
+    data_dir = os.path.splitext(executable_path)[0] + "_Data"
+    assembly = os.path.join(data_dir, "Managed", "Assembly-CSharp.dll")
+    return [executable_path] + ([assembly] if os.path.isfile(assembly) else [])
+
+
+def output_csvs(command, logs_dir="logs"):
+    # Benchmark csv files written by Unity for the job: logs/<AgentType>_<name>_<scene>.csv
+    agent = UNITY_AGENT_NAMES.get(command[command.index("-agent") + 1].lower(), "*")
+    name = command[command.index("-name") + 1]
+    return glob.glob(os.path.join(glob.escape(logs_dir), f"{agent}_{glob.escape(name)}_*.csv"))
+
+
+class ResultsCache:
+    def __init__(self, path="logs/eval_manifest.json"):
+        self.path = path
+        self.data = {"files": {}, "jobs": {}}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def save(self):
+        # Write to a temporary file first, so an interrupted run can not corrupt the manifest
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def file_hash(self, path):
+        # Hashes are reused as long as the size and modification time of the file stay the same
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        cached = self.data["files"].get(abs_path)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["sha256"]
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        self.data["files"][abs_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                        "sha256": sha.hexdigest()}
+        return sha.hexdigest()
+
+    def job_key(self, command):
+        # command: [executable, args...] as created by auto_eval.evaluate_model
+        executable, args = command[0], list(command[1:])
+        build_hash = [self.file_hash(path) for path in build_files(executable)]
+        if "-model" in args:
+            model_index = args.index("-model") + 1
+            args[model_index] = self.file_hash(args[model_index])
+        return hashlib.sha256(json.dumps([build_hash, args]).encode()).hexdigest()
+
+    def status(self, key):
+        job = self.data["jobs"].get(key)
+        return job["status"] if job else None
+
+    def owner(self, name):
+        # Key of the job that last wrote the outputs with the given name
+        return next((key for key, job in self.data["jobs"].items() if job["name"] == name), None)
+
+    def set_status(self, key, name, status):
+        # Only one job can own the outputs of a name
+        for other_key in [k for k, job in self.data["jobs"].items() if job["name"] == name and k != key]:
+            del self.data["jobs"][other_key]
+        self.data["jobs"][key] = {"name": name, "status": status, "time": time.time()}
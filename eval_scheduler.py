@@ -0,0 +1,123 @@
+import os
+import subprocess
+import time
+from collections import deque, namedtuple
+
+try:
+    import psutil
+except ImportError:  # Without psutil, only max_workers limits the concurrency
+    psutil = None
+
+
+"""
+Runs evaluation jobs (Unity benchmark processes) in parallel.
+
+Each job runs as its own subprocess with a timeout, its output is written to a log file and
+failed jobs are retried. New jobs are only started while the machine has CPU and memory
+headroom left, since every Unity benchmark is multi-threaded itself.
+"""
+
+# name: Unique name of the job (also used for the log file)
+# command: Command as a list of arguments
+EvalJob = namedtuple("EvalJob", ["name", "command"])
+# returncode is None, if the last attempt timed out
+JobResult = namedtuple("JobResult", ["name", "returncode", "attempts", "duration", "log_path"])
+
+
+class EvalScheduler:
+    def __init__(self, max_workers=None, timeout=None, retries=1, log_dir="logs/eval",
+                 cpu_headroom=15.0, memory_headroom=15.0, poll_interval=2.0):
+        """
+        max_workers: Upper limit for concurrent jobs (default: number of CPUs)
+        timeout: Seconds after which a job is killed (None for no timeout)
+        retries: How many times a failed or timed out job is started again
+        log_dir: Folder for the output logs of the jobs
+        cpu_headroom, memory_headroom: Percentage of CPU and memory that should stay free.
+            New jobs are not started while the usage is above 100 - headroom.
+        poll_interval: Seconds between checking the running jobs. At most one job is started per interval,
+            so that the load of the previous job is visible before starting the next one.
+        """
+        self.max_workers = max_workers or os.cpu_count()
+        self.timeout = timeout
+        self.retries = retries
+        self.log_dir = log_dir
+        self.cpu_headroom = cpu_headroom
+        self.memory_headroom = memory_headroom
+        self.poll_interval = poll_interval
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    def has_headroom(self):
+        if psutil is None:
+            return True
+        cpu_percent = psutil.cpu_percent(interval=None)  # Usage since the previous call, does not block
+        memory_percent = psutil.virtual_memory().percent
+        return cpu_percent < 100 - self.cpu_headroom and memory_percent < 100 - self.memory_headroom
+
+    def _start(self, job, attempt):
+        log_path = os.path.join(self.log_dir, f"{job.name}.log")
+        log_file = open(log_path, "a" if attempt > 1 else "w")
+        log_file.write(f"# Attempt {attempt}: {subprocess.list2cmdline(job.command)}\n")
+        log_file.flush()
+        process = subprocess.Popen(job.command, stdout=log_file, stderr=subprocess.STDOUT)
+        print(f"Started {job.name} (attempt {attempt})")
+        return process, log_file, log_path
+
+    def run(self, jobs, on_result=None, on_retry=None):
+        """Runs all jobs and returns a JobResult for each of them (in order of completion)
+        on_result: Optional function that is called with each JobResult as soon as the job is finished
+        on_retry: Optional function that is called with a failed job before it is started again,
+            e.g., to remove the incomplete output of the failed attempt"""
+        if psutil is not None:
+            psutil.cpu_percent(interval=None)  # The first call only initializes the measurement
+        pending = deque((job, 1) for job in jobs)
+        running = []  # (job, attempt, process, log_file, log_path, start_time)
+        results = []
+        try:
+            while pending or running:
+                # Check the running jobs
+                still_running = []
+                for job, attempt, process, log_file, log_path, start_time in running:
+                    returncode = process.poll()
+                    duration = time.time() - start_time
+                    if returncode is None:
+                        if self.timeout is None or duration < self.timeout:
+                            still_running.append((job, attempt, process, log_file, log_path, start_time))
+                            continue
+                        process.kill()
+                        process.wait()
+                        log_file.write(f"# Killed after timeout of {self.timeout} s\n")
+                    log_file.close()
+                    reason = "timed out" if returncode is None else f"exit code {returncode}"
+                    if returncode != 0 and attempt <= self.retries:
+                        print(f"{job.name} failed ({reason}), retrying")
+                        if on_retry is not None:
+                            on_retry(job)
+                        pending.append((job, attempt + 1))
+                        continue
+                    status = "done" if returncode == 0 else f"FAILED ({reason})"
+                    print(f"{job.name} {status} in {duration:.0f} s")
+                    result = JobResult(job.name, returncode, attempt, duration, log_path)
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+                running = still_running
+
+                # Start a new job, if there is room for it. Always keep at least one job running.
+                # A Unity process that was just started is still booting and barely shows in the CPU usage,
+                # so only one job is started per poll.
+                if pending and len(running) < self.max_workers and (not running or self.has_headroom()):
+                    job, attempt = pending.popleft()
+                    process, log_file, log_path = self._start(job, attempt)
+                    running.append((job, attempt, process, log_file, log_path, time.time()))
+
+                if running:
+                    time.sleep(self.poll_interval)
+        finally:
+            # Interrupted (Ctrl-C) or on_result failed: do not leave the benchmarks running
+            for job, attempt, process, log_file, log_path, start_time in running:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+                    log_file.write("# Killed, the scheduler was stopped\n")
+                log_file.close()
+        return results
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from eval_scheduler import JobResult
+
+# ray_utils (BetterUnity3DEnv) is in AAAA-perf
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "AAAA-perf"))
+
+
+"""
+Runs evaluation jobs with centralized, batched inference (auto_eval.py --serve).
+
+EvalScheduler starts every benchmark with -model, so every Unity process loads its own copy of the model
+and runs it at batch size 1. EvalServer starts the same benchmarks without -model and drives them from
+Python through BetterUnity3DEnv instead: in every step, the observations of all running benchmarks that
+evaluate the same model are stacked and evaluated with one ONNX Runtime forward pass (ray_utils/policy_serving.py),
+and the actions are scattered back. Each model is loaded once, however many benchmarks use it.
+
+Unity still runs the benchmark itself (episodes, csv files) and exits when it is done.
+"""
+
+
+def split_model_arg(command):
+    # Returns the command without "-model <path>" and the model path
+    command = list(command)
+    index = command.index("-model")
+    model_path = command[index + 1]
+    del command[index:index + 2]
+    return command, model_path
+
+
+class _RunningJob:
+    def __init__(self, job, attempt, start_time, env, policy, log_path):
+        self.job = job
+        self.attempt = attempt
+        self.start_time = start_time
+        self.env = env  # AsyncUnity3DEnv
+        self.policy = policy
+        self.log_path = log_path
+        self.batches = env.env.get_step_batches()
+        self.steps = 0
+
+
+class EvalServer:
+    def __init__(self, max_workers=None, timeout=None, retries=1, log_dir="logs/eval", step_timeout=120,
+                 time_scale=1, deterministic=False, intra_op_threads=None, launch_workers=4):
+        """
+        max_workers: Number of benchmarks (Unity processes) running at the same time (default: number of CPUs)
+        timeout: Seconds after which a job is stopped (None for no timeout)
+        retries: How many times a failed or timed out job is started again
+        log_dir: Folder for the Unity logs of the jobs (one subfolder per job)
+        step_timeout: Seconds to wait for one step of a benchmark before it is considered failed
+        time_scale: Time scale of Unity. 1 is the same as the benchmarks started by EvalScheduler.
+        deterministic: Use the deterministic actions of the models instead of sampling them (like the player does)
+        intra_op_threads: Threads of one forward pass (default of ONNX Runtime if None)
+        launch_workers: Number of Unity processes that are started or closed at the same time
+        """
+        self.max_workers = max_workers or os.cpu_count()
+        self.timeout = timeout
+        self.retries = retries
+        self.log_dir = log_dir
+        self.step_timeout = step_timeout
+        self.time_scale = time_scale
+        self.deterministic = deterministic
+        self.intra_op_threads = intra_op_threads
+        self.launch_workers = launch_workers
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    def run(self, jobs, on_result=None, on_retry=None):
+        """Runs all jobs and returns a JobResult for each of them (in order of completion), same as EvalScheduler.run
+        on_result: Optional function that is called with each JobResult as soon as the job is finished
+        on_retry: Optional function that is called with a failed job before it is started again"""
+        return asyncio.run(self._run(jobs, on_result, on_retry))
+
+    def _launch(self, job, executable_args):
+        from ray_utils.unity_env import BetterUnity3DEnv
+
+        log_folder = os.path.join(self.log_dir, job.name)
+        env = BetterUnity3DEnv(file_name=executable_args[0], args=executable_args[1:], no_graphics=True,
+                               timescale=self.time_scale, log_folder=log_folder, episode_horizon=sys.maxsize)
+        return env, log_folder
+
+    @staticmethod
+    def _close(running, kill):
+        # Returns the exit code of Unity (None, if it was still running)
+        process = getattr(running.env.env.unity_env, "_process", None)
+        returncode = None
+        if process is not None and not kill:
+            try:
+                returncode = process.wait(timeout=10)
+            except Exception:
+                pass
+        try:
+            running.env.close()
+        except Exception as e:
+            print(f"Error while closing {running.job.name}: {e}")
+        return returncode
+
+    async def _run(self, jobs, on_result, on_retry):
+        from ray_utils.async_env import AsyncUnity3DEnv
+        from ray_utils.policy_serving import get_policy
+
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(self.launch_workers)
+        pending = deque((job, 1) for job in jobs)
+        launching = {}  # future -> (job, attempt, start time, policy, future of the executor)
+        running = []
+        closing = {}  # future -> (running job, reason)
+        results = []
+        forward_passes = 0
+        served_steps = 0
+        served_rows = 0  # Agent decisions evaluated by the forward passes
+
+        def finish(job, attempt, start_time, returncode, reason, log_path):
+            duration = time.time() - start_time
+            if returncode != 0 and attempt <= self.retries:
+                print(f"{job.name} failed ({reason}), retrying")
+                if on_retry is not None:
+                    on_retry(job)
+                pending.append((job, attempt + 1))
+                return
+            status = "done" if returncode == 0 else f"FAILED ({reason})"
+            print(f"{job.name} {status} in {duration:.0f} s")
+            result = JobResult(job.name, returncode, attempt, duration, log_path)
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+        try:
+            while pending or launching or running or closing:
+                # Start new benchmarks, if there is room for them
+                while pending and len(running) + len(launching) < self.max_workers:
+                    job, attempt = pending.popleft()
+                    executable_args, model_path = split_model_arg(job.command)
+                    policy = get_policy(model_path, self.deterministic, self.intra_op_threads)
+                    launch_future = executor.submit(self._launch, job, executable_args)
+                    future = asyncio.wrap_future(launch_future, loop=loop)
+                    launching[future] = (job, attempt, time.time(), policy, launch_future)
+                    print(f"Started {job.name} (attempt {attempt})")
+                for future in [future for future in launching if future.done()]:
+                    job, attempt, start_time, policy, _ = launching.pop(future)
+                    try:
+                        env, log_path = future.result()
+                    except Exception as e:
+                        finish(job, attempt, start_time, None, f"could not start: {e}", os.path.join(self.log_dir, job.name))
+                        continue
+                    running.append(_RunningJob(job, attempt, start_time, AsyncUnity3DEnv(env, self.step_timeout, executor),
+                                               policy, log_path))
+                for future in [future for future in closing if future.done()]:
+                    served, reason = closing.pop(future)
+                    returncode = future.result()
+                    finish(served.job, served.attempt, served.start_time, returncode,
+                           reason if returncode is None else f"exit code {returncode}", served.log_path)
+
+                if not running:
+                    await asyncio.sleep(0.1)
+                    continue
+
+                # One forward pass per model for all benchmarks that evaluate it
+                by_policy = {}
+                for served in running:
+                    by_policy.setdefault(served.policy, {})[served] = served.batches
+                actions = {}
+                for policy, batches in by_policy.items():
+                    actions.update(policy.act_many(batches))
+                    forward_passes += 1
+                    served_rows += sum(len(decision.agent_id) for env_batches in batches.values()
+                                       for decision, _ in env_batches.values())
+
+                # Step all benchmarks concurrently
+                outputs = await asyncio.gather(*(served.env.step_batched(actions[served]) for served in running),
+                                               return_exceptions=True)
+                still_running = []
+                for served, output in zip(running, outputs):
+                    timed_out = self.timeout is not None and time.time() - served.start_time > self.timeout
+                    if isinstance(output, BaseException) or timed_out:
+                        # Unity exits at the end of the benchmark, so an error is expected once it is done
+                        reason = f"timed out after {self.timeout} s" if timed_out else f"{type(output).__name__}: {output}"
+                        closing[loop.run_in_executor(executor, self._close, served, timed_out)] = (served, reason)
+                        continue
+                    served.batches = output[0]
+                    served.steps += 1
+                    served_steps += 1
+                    still_running.append(served)
+                running = still_running
+        finally:
+            for served in running:
+                self._close(served, kill=True)
+            executor.shutdown(wait=True, cancel_futures=True)
+            # Benchmarks that were still starting (after Ctrl-C or an error) are closed once they are up
+            for job, _, _, _, launch_future in launching.values():
+                if launch_future.cancelled() or launch_future.exception() is not None:
+                    continue
+                env, _ = launch_future.result()
+                try:
+                    env.close()
+                except Exception as e:
+                    print(f"Error while closing {job.name}: {e}")
+        if forward_passes:
+            print(f"Served {served_steps} steps ({served_rows} agent decisions) with {forward_passes} forward passes "
+                  f"(mean batch size {served_rows / forward_passes:.1f} agents)")
+        return results
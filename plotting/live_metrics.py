@@ -0,0 +1,299 @@
+import io
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from load_logs import METADATA_COLUMNS, read_csv
+from metrics import COLUMNS, DISTANCE_THRESHOLD, MAX_STEPS, episode_metrics, summarize
+from parse_name import FilenameError, parse_filename
+
+"""
+Episode metrics of the benchmark csv files while the benchmarks are still running.
+
+Follows the csv files in the logs folder like "tail -f": every poll() only reads the bytes appended since the
+previous poll. Rows are collected until their episode is complete (a row of the next episode arrives or the
+file is finished), then the metrics of the episode are computed with metrics.episode_metrics.
+A file is finished when the benchmark that writes it exits (auto_eval.py --live calls finish()), or with finish_all().
+
+The episode metrics and the read position of each file are kept in <logs>/.live/, so a restarted ingester
+continues where it stopped. Once all files are finished, episodes() and summary() give the same tables as
+metrics.compute_metrics and metrics.summarize.
+
+Example:
+    from live_metrics import LiveMetrics
+    live = LiveMetrics("../logs")
+    live.poll()
+    print(live.summary(by=["Model"]))  # Completed episodes only
+
+or ``python live_metrics.py ../logs --interval 30`` to print the summary while the benchmarks run.
+"""
+
+STATE_VERSION = 1
+EPISODE_COLUMNS = ["Episode", "ShortestPath", "Travelled", "Steps", "Success", "SPL", "Accuracy"]
+
+
+class LiveMetrics:
+    def __init__(self, base_path="../logs", store_dir=None, where=None, max_steps=MAX_STEPS,
+                 threshold=DISTANCE_THRESHOLD):
+        """
+        base_path: Folder with the benchmark csv files
+        store_dir: Folder of the stored state (default: .live in base_path)
+        where: Optional filter for the files, gets the metadata (parse_name.FilenameParts) of a file
+        max_steps, threshold: See metrics.episode_metrics
+        """
+        self.base_path = base_path
+        self.store_dir = store_dir or os.path.join(base_path, ".live")
+        self.where = where
+        self.max_steps = max_steps
+        self.threshold = threshold
+        # File name -> offset (bytes read), inode, header line, lines of the unfinished episode and finished
+        self.files = {}
+        # File name -> DataFrame of the completed episodes (EPISODE_COLUMNS)
+        self.episode_frames = {}
+        self._ignored = set()
+        self._lock = threading.RLock()
+        self._changed = False
+        self._watcher = None
+        self._stop = threading.Event()
+        self._load()
+
+    def _state_path(self):
+        return os.path.join(self.store_dir, "state.json")
+
+    def _episodes_path(self):
+        return os.path.join(self.store_dir, "episodes.parquet")
+
+    def _load(self):
+        if not os.path.isfile(self._state_path()):
+            return
+        try:
+            with open(self._state_path()) as f:
+                state = json.load(f)
+            if (state["version"], state["max_steps"], state["threshold"]) != \
+                    (STATE_VERSION, self.max_steps, self.threshold):
+                print(f"Stored state in {self.store_dir} uses other settings, starting over")
+                return
+            files = state["files"]
+            episodes = pd.read_parquet(self._episodes_path()) if files else pd.DataFrame(columns=["File"])
+        except Exception as e:
+            print(f"Could not load {self.store_dir}, starting over: {e}")
+            return
+        self.files = files
+        for name, df in episodes.groupby("File", sort=False, observed=True):
+            self.episode_frames[name] = df[EPISODE_COLUMNS].reset_index(drop=True)
+
+    def save(self):
+        # Writes the state and the episodes to the store, temporary files first like load_logs.load_csv
+        with self._lock:
+            if not self._changed:
+                return
+            os.makedirs(self.store_dir, exist_ok=True)
+            frames = [df.assign(File=name) for name, df in self.episode_frames.items() if len(df)]
+            episodes = pd.concat(frames, ignore_index=True) if frames else \
+                pd.DataFrame(columns=EPISODE_COLUMNS + ["File"])
+            episodes.to_parquet(self._episodes_path() + ".tmp", index=False)
+            state = {"version": STATE_VERSION, "max_steps": self.max_steps, "threshold": self.threshold,
+                     "files": self.files}
+            with open(self._state_path() + ".tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(self._episodes_path() + ".tmp", self._episodes_path())
+            os.replace(self._state_path() + ".tmp", self._state_path())
+            self._changed = False
+
+    def _use_file(self, name):
+        if name in self._ignored:
+            return False
+        try:
+            metadata = parse_filename(name)
+        except FilenameError:
+            metadata = None
+        if metadata is None or (self.where is not None and not self.where(metadata)):
+            self._ignored.add(name)
+            return False
+        return True
+
+    def _forget(self, name):
+        self.files.pop(name, None)
+        self.episode_frames.pop(name, None)
+        self._changed = True
+
+    def _read(self, name, final=False):
+        # Reads the new complete lines of a file. Returns the new lines or None, if the file was removed.
+        path = os.path.join(self.base_path, name)
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                state = self.files.get(name)
+                if state is not None and (stat.st_ino != state["inode"] or stat.st_size < state["offset"]):
+                    # Removed and written again (auto_eval.py removes incomplete csv files before rerunning them)
+                    print(f"{name} was replaced, reading it again")
+                    self._forget(name)
+                    state = None
+                if state is None:
+                    state = {"offset": 0, "inode": stat.st_ino, "header": None, "pending": [], "finished": False}
+                    self.files[name] = state
+                    self.episode_frames[name] = pd.DataFrame(columns=EPISODE_COLUMNS)
+                    self._changed = True
+                if stat.st_size == state["offset"]:
+                    return []
+                f.seek(state["offset"])
+                data = f.read(stat.st_size - state["offset"])
+        except FileNotFoundError:
+            return None
+        # The last line may still be written, it is only used once the file is finished
+        end = len(data) if final else data.rfind(b"\n") + 1
+        state["offset"] += end
+        self._changed = True
+        lines = data[:end].decode("utf-8", errors="replace").splitlines(keepends=True)
+        lines = [line if line.endswith("\n") else line + "\n" for line in lines if line.strip()]
+        if state["header"] is None and lines:
+            state["header"] = lines.pop(0)
+        return lines
+
+    def _ingest(self, name, final=False):
+        # Computes the metrics of the episodes that were completed by the new lines. Returns their number.
+        lines = self._read(name, final)
+        if lines is None:
+            if name in self.files:
+                print(f"{name} was removed")
+                self._forget(name)
+            return 0
+        state = self.files[name]
+        if state["finished"] and not lines:
+            return 0
+        state["finished"] = final
+        self._changed = True
+        lines = state["pending"] + lines
+        if not lines:
+            return 0
+        df = read_csv(io.StringIO(state["header"] + "".join(lines)))
+        episode = df["Episode"].to_numpy()
+        # Rows of the last episode in the file might not be complete yet
+        complete = len(episode)
+        if not final:
+            while complete > 0 and episode[complete - 1] == episode[-1]:
+                complete -= 1
+        state["pending"] = lines[complete:]
+        if complete == 0:
+            return 0
+        episodes = episode_metrics(df.iloc[:complete][COLUMNS], self.max_steps, self.threshold)
+        previous = self.episode_frames[name]
+        self.episode_frames[name] = pd.concat([previous, episodes], ignore_index=True) if len(previous) else episodes
+        return len(episodes)
+
+    def poll(self):
+        """Reads the new rows of all csv files in base_path
+        Returns the number of episodes that were completed since the previous poll"""
+        with self._lock:
+            names = set(name for name in os.listdir(self.base_path) if name.endswith(".csv"))
+            completed = 0
+            for name in sorted(names | set(self.files)):
+                if name in self.files or self._use_file(name):
+                    completed += self._ingest(name)
+            return completed
+
+    def finish(self, file_paths):
+        """Marks files as finished (their benchmark has exited), so that their last episode is completed too
+        Returns the number of completed episodes"""
+        with self._lock:
+            completed = 0
+            for path in file_paths:
+                name = os.path.basename(path)
+                if name in self.files or self._use_file(name):
+                    completed += self._ingest(name, final=True)
+            return completed
+
+    def finish_all(self):
+        # Marks all csv files as finished, e.g., after all benchmarks have exited
+        with self._lock:
+            self.poll()
+            return self.finish(list(self.files))
+
+    def episodes(self):
+        """Returns the completed episodes as one DataFrame with the filename metadata as columns,
+        the same format as metrics.compute_metrics"""
+        with self._lock:
+            frames = []
+            for name, df in sorted(self.episode_frames.items()):
+                if not len(df):
+                    continue
+                metadata = parse_filename(name)
+                df = df.copy()
+                for field, col in METADATA_COLUMNS.items():
+                    df[col] = getattr(metadata, field)
+                df["File"] = name
+                frames.append(df)
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True)
+        df["Steps"] = df["Steps"].astype(int)
+        df["Success"] = df["Success"].astype(bool)
+        return df
+
+    def summary(self, by=("Model",)):
+        # Averages of the completed episodes, see metrics.summarize
+        episodes = self.episodes()
+        return summarize(episodes, by) if len(episodes) else pd.DataFrame()
+
+    def unfinished(self):
+        # Names of the files whose benchmark has not been marked as finished
+        with self._lock:
+            return sorted(name for name, state in self.files.items() if not state["finished"])
+
+    def watch(self, interval=30.0, by=("Model",)):
+        """Polls the csv files every interval seconds and prints the summary whenever episodes were completed.
+        Runs until interrupted or until stop() is called."""
+        while True:
+            completed = self.poll()
+            self.save()
+            if completed:
+                summary = self.summary(by)
+                print(f"{time.strftime('%H:%M:%S')} {len(self.files)} files, "
+                      f"{len(self.unfinished())} unfinished:\n{summary.to_string(index=False)}")
+            if self._stop.wait(interval):
+                return
+
+    def start(self, interval=30.0, by=("Model",)):
+        # Runs watch in a background thread
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self.watch, args=(interval, by), daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        # Stops the background thread, reads the csv files a last time and saves the state
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+        self.poll()
+        self.save()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Prints the metrics of the benchmark csv files while they are written")
+    parser.add_argument("base_path", nargs="?", default="../logs", help="Folder with the benchmark csv files")
+    parser.add_argument("--interval", type=float, default=30, help="Seconds between reading the csv files")
+    parser.add_argument("--by", nargs="+", default=["Model"], help="Columns to group the summary by")
+    parser.add_argument("--finish", action="store_true",
+                        help="All benchmarks have exited: read the files once, print the final summary and exit")
+    parser.add_argument("--output", default=None, help="Save the final summary as csv (with --finish)")
+    args = parser.parse_args()
+
+    live = LiveMetrics(args.base_path)
+    if args.finish:
+        live.finish_all()
+        live.save()
+        summary = live.summary(args.by)
+        print(summary.to_string(index=False))
+        if args.output:
+            summary.to_csv(args.output, index=False)
+    else:
+        try:
+            live.watch(args.interval, args.by)
+        except KeyboardInterrupt:
+            live.save()
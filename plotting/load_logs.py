@@ -0,0 +1,129 @@
+import glob
+import os
+
+import pandas as pd
+
+from parse_name import FilenameError, parse_filename
+
+"""
+Cached loading of the benchmark csv files.
+
+Unity writes the benchmark results as csv (";" separated, "," as decimal separator) with every value as text.
+Parsing them is slow, so each csv is converted once to a typed Parquet file in <logs>/.cache/ and the cached
+file is used as long as the size and modification time of the csv stay the same.
+The metadata of the filename (see parse_name.py) is added as columns.
+
+Example:
+    from load_logs import load_logs, iter_logs
+    df = load_logs("../logs", columns=["Episode", "PathLength"], where=lambda m: m.scene == "static_Complex")
+    for metadata, df in iter_logs("../logs"):
+        ...
+"""
+
+# Columns that are kept as text, everything else is numeric
+STRING_COLUMNS = ["ClipName", "SceneName"]
+# Filename metadata (parse_name.FilenameParts) -> column name
+METADATA_COLUMNS = {"agent": "Agent", "model": "Model", "model_id": "ModelId", "scene": "Scene",
+                    "decision_period": "DecisionPeriod", "target_speed": "TargetSpeed",
+                    "audio_sources": "AudioSources", "los_reward": "LosReward", "seed": "Seed", "build": "Build"}
+
+
+def read_csv(file_path):
+    # Reads a benchmark csv and converts the columns to proper types
+    df = pd.read_csv(file_path, sep=";", decimal=",", dtype=str)
+    for col in df.columns:
+        if col in STRING_COLUMNS:
+            df[col] = df[col].astype("category")
+        else:
+            # Booleans are written as True/False
+            values = df[col].replace({"True": "1", "False": "0"})
+            df[col] = pd.to_numeric(values.str.replace(",", ".", regex=False), errors="coerce")
+    return df
+
+
+def _cache_path(file_path, cache_dir):
+    stat = os.stat(file_path)
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, f"{name}.{stat.st_size}-{stat.st_mtime_ns}.parquet")
+
+
+def load_csv(file_path, columns=None, cache_dir=None):
+    """Loads one benchmark csv through the cache
+    columns: Only load these columns (None for all)
+    cache_dir: Folder of the cached files (default: .cache next to the csv)"""
+    cache_dir = cache_dir or os.path.join(os.path.dirname(file_path), ".cache")
+    cache_path = _cache_path(file_path, cache_dir)
+    if os.path.isfile(cache_path):
+        try:
+            return pd.read_parquet(cache_path, columns=columns)
+        except Exception as e:
+            print(f"Could not read {cache_path}, converting {file_path} again: {e}")
+    df = read_csv(file_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Remove outdated versions of the same csv
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    for old_path in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(name)}.*-*.parquet")):
+        os.remove(old_path)
+    # Write to a temporary file first, so that an interrupted conversion is not mistaken for a cached file
+    tmp_path = cache_path + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+    return df[columns] if columns is not None else df
+
+
+def find_logs(base_path="../logs", where=None):
+    """Returns (file path, metadata) of the benchmark csv files in base_path
+    where: Optional function that gets the metadata (parse_name.FilenameParts) of a file and returns
+        whether the file should be used. Files are filtered before loading them."""
+    files = []
+    for file_path in sorted(glob.glob(os.path.join(glob.escape(base_path), "*.csv"))):
+        try:
+            metadata = parse_filename(file_path)
+        except FilenameError:
+            print(f"Skipping {file_path}, not a benchmark csv")
+            continue
+        if where is None or where(metadata):
+            files.append((file_path, metadata))
+    return files
+
+
+def iter_logs(base_path="../logs", columns=None, where=None, cache_dir=None):
+    """Yields (metadata, DataFrame) for each benchmark csv, see find_logs and load_csv"""
+    for file_path, metadata in find_logs(base_path, where):
+        yield metadata, load_csv(file_path, columns, cache_dir)
+
+
+def load_logs(base_path="../logs", columns=None, where=None, cache_dir=None):
+    """Loads the benchmark csv files into one DataFrame, see find_logs and load_csv.
+    The filename metadata is added as columns (see METADATA_COLUMNS) and the name of the csv as File."""
+    dfs = []
+    for file_path, metadata in find_logs(base_path, where):
+        df = load_csv(file_path, columns, cache_dir)
+        for field, col in METADATA_COLUMNS.items():
+            df[col] = getattr(metadata, field)
+        df["File"] = os.path.basename(file_path)
+        dfs.append(df)
+    if not dfs:
+        return pd.DataFrame(columns=(columns or []) + list(METADATA_COLUMNS.values()) + ["File"])
+    df = pd.concat(dfs, ignore_index=True)
+    # Few unique values in many rows
+    for col in ["Agent", "Model", "ModelId", "Scene", "Build", "File"]:
+        df[col] = df[col].astype("category")
+    # Optional parts of the filename are None, if they are missing
+    for col in ["TargetSpeed", "LosReward"]:
+        df[col] = pd.to_numeric(df[col]).astype(float)
+    df["Seed"] = pd.to_numeric(df["Seed"]).astype("Int64")
+    return df
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Converts the benchmark csv files to the cache")
+    parser.add_argument("base_path", nargs="?", default="../logs", help="Folder with the benchmark csv files")
+    args = parser.parse_args()
+
+    start = time.time()
+    df = load_logs(args.base_path)
+    print(f"Loaded {len(df)} rows from {df['File'].nunique()} files in {time.time() - start:.1f} s")
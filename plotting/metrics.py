@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from load_logs import METADATA_COLUMNS, find_logs, load_csv
+
+"""
+Episode metrics of the benchmark csv files (SPL, steps, success and angle accuracy).
+
+Files are processed in parallel, each worker loads one file at a time (through the cache of load_logs.py)
+and only returns one row per episode, so the raw steps of all files are never in memory at once.
+
+Example:
+    from metrics import compute_metrics, summarize
+    episodes = compute_metrics("../logs")
+    summary = summarize(episodes)  # One row per file: SPL, SuccessRate, Steps, Accuracy
+"""
+
+MAX_STEPS = 1000
+# Added to the travelled distance, since the episode ends before reaching the center of the target
+DISTANCE_THRESHOLD = 10
+POSITION_COLUMNS = ["AgentPositionX", "AgentPositionY", "AgentPositionZ"]
+# Columns needed from the csv files
+COLUMNS = ["Episode", "PathLength", "ActionAngle", "AngleToTarget"] + POSITION_COLUMNS
+
+
+def angle_accuracy(action_angle, angle_to_target):
+    # Angles are normalized to [-1, 1], 1 for the correct direction and 0 for the opposite direction
+    difference = np.abs(action_angle - angle_to_target)
+    difference = np.where(difference > 1, 2 - difference, difference)  # Angles wrap around
+    return 1 - difference
+
+
+def episode_metrics(df, max_steps=MAX_STEPS, threshold=DISTANCE_THRESHOLD):
+    """Computes the metrics of each episode of one benchmark csv
+    Returns a DataFrame with the columns Episode, ShortestPath, Travelled, Steps, Success, SPL and Accuracy"""
+    episode = df["Episode"].to_numpy()
+    if len(episode) > 1 and np.any(episode[1:] < episode[:-1]):
+        # The rows of an episode are expected to be consecutive
+        order = np.argsort(episode, kind="stable")
+        df = df.iloc[order]
+        episode = episode[order]
+    starts = np.flatnonzero(np.r_[True, episode[1:] != episode[:-1]])
+
+    # Distance moved on each step, 0 for the first step of an episode
+    positions = df[POSITION_COLUMNS].to_numpy(dtype=float)
+    delta = np.zeros(len(positions))
+    delta[1:] = np.sqrt((np.diff(positions, axis=0) ** 2).sum(axis=1))
+    delta[starts] = 0
+    delta = np.nan_to_num(delta)
+
+    steps = np.diff(np.r_[starts, len(episode)])
+    travelled = np.add.reduceat(delta, starts)
+    shortest_path = df["PathLength"].to_numpy(dtype=float)[starts]
+    success = steps <= max_steps
+    spl = success * shortest_path / np.maximum(shortest_path, travelled + threshold)
+    accuracy = angle_accuracy(df["ActionAngle"].to_numpy(dtype=float), df["AngleToTarget"].to_numpy(dtype=float))
+    accuracy = np.add.reduceat(accuracy, starts) / steps
+
+    return pd.DataFrame({"Episode": episode[starts], "ShortestPath": shortest_path, "Travelled": travelled,
+                         "Steps": steps, "Success": success, "SPL": spl, "Accuracy": accuracy})
+
+
+def _file_metrics(args):
+    file_path, metadata, max_steps, threshold, cache_dir = args
+    episodes = episode_metrics(load_csv(file_path, COLUMNS, cache_dir), max_steps, threshold)
+    for field, col in METADATA_COLUMNS.items():
+        episodes[col] = getattr(metadata, field)
+    episodes["File"] = os.path.basename(file_path)
+    return episodes
+
+
+def compute_metrics(base_path="../logs", where=None, max_steps=MAX_STEPS, threshold=DISTANCE_THRESHOLD,
+                    processes=None, cache_dir=None):
+    """Computes the episode metrics of all benchmark csv files in base_path (see episode_metrics)
+    where: Optional filter for the files, see load_logs.find_logs
+    processes: Number of worker processes (default: number of CPUs, 1 to compute in this process)
+    Returns one DataFrame with a row per episode and file, with the filename metadata as columns."""
+    jobs = [(file_path, metadata, max_steps, threshold, cache_dir) for file_path, metadata in find_logs(base_path, where)]
+    if not jobs:
+        return pd.DataFrame()
+    if processes == 1 or len(jobs) == 1:
+        results = [_file_metrics(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_file_metrics, jobs))
+    return pd.concat(results, ignore_index=True)
+
+
+def summarize(episodes, by=("File",)):
+    """Averages the episode metrics over the given columns
+    Returns a tidy DataFrame with the columns of by, the filename metadata (if unique within a group),
+    Episodes, SPL, SuccessRate, Steps and Accuracy"""
+    by = list(by)
+    metadata = [col for col in list(METADATA_COLUMNS.values()) + ["File"] if col in episodes and col not in by]
+    grouped = episodes.groupby(by, sort=False, dropna=False)
+    summary = grouped.agg(Episodes=("Episode", "size"), SPL=("SPL", "mean"), SuccessRate=("Success", "mean"),
+                          Steps=("Steps", "mean"), Accuracy=("Accuracy", "mean"))
+    # Keep the metadata that is the same for the whole group
+    unique = grouped[metadata].nunique(dropna=False)
+    constant = [col for col in metadata if (unique[col] <= 1).all()]
+    summary = grouped[constant].first().join(summary)
+    return summary.reset_index()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Computes the metrics of the benchmark csv files")
+    parser.add_argument("base_path", nargs="?", default="../logs", help="Folder with the benchmark csv files")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--output", default=None, help="Save the summary as csv")
+    args = parser.parse_args()
+
+    summary = summarize(compute_metrics(args.base_path, processes=args.processes))
+    print(summary.to_string())
+    if args.output:
+        summary.to_csv(args.output, index=False)
@@ -1,72 +1,90 @@
 import re
 import os
+from functools import lru_cache
 
 from collections import namedtuple
 
-def parse_filename(file_path):
-    # Parses evaluation filenames to subcomponents
-    # e.g., "Hanning_hanning_1_d1_Complex.csv" or "agent_model_decision-period_scene.csv"
-    FilenameParts = namedtuple('FilenameParts', ['agent', 'model', 'model_id', 'scene', 'decision_period'])
-
-    # Extract the filename from the path and split it to components
-    filename = os.path.basename(file_path)
-    splitted = filename.replace(".csv", "").split("_")
-
-
-
-    # Get agent name (agent_model or agent_ao_model)
-    agent = splitted[0]
-    model_start_index = 1
-    if splitted[1] == "ao":
-        agent = f"{agent}_{splitted[1]}"
-        model_start_index = 2
-
-    # Get scene name (last word in the name)
-    scene = splitted[-1]
-    scene_start_index = -1
-    if splitted[-2] == "static" or splitted[-2] == "dynamic":
-        scene_start_index = -2
-        scene = "_".join(splitted[scene_start_index:])
-
-    # Get decision period (Before scene, starts with d)
-    decision_period = splitted[scene_start_index-1].replace("d", "")
-    decision_period = int(decision_period)
+# Parsed parts of an evaluation filename
+FilenameParts = namedtuple('FilenameParts', ['agent', 'model', 'model_id', 'scene', 'decision_period',
+                                             'target_speed', 'audio_sources', 'los_reward', 'seed', 'build'],
+                           defaults=[None, 1, None, None, None])
+
+# Evaluation filenames, e.g., "Hanning_hanning_1_d1_Complex.csv" or "agent_model_decision-period_scene.csv"
+# Sweeps of auto_eval.py add optional parts between the decision period and the scene:
+# "agent_model[_id]_d{decision period}[_a{audio sources}][_l{los reward}][_s{seed}][_b{build}][_static|_dynamic[speed]]_scene.csv"
+FILENAME_PATTERN = re.compile(r"""
+    (?P<agent>[^_]+(?:_ao)?)             # Agent name (agent or agent_ao)
+    _(?P<model>.+?)                      # Model name, may contain "_" and "-"
+    (?:[-_](?P<model_id>\d+))?           # Run id of the model (hanning_53 or hanning_ao-1)
+    _d(?P<decision_period>\d+)
+    (?:_a(?P<audio_sources>\d+))?
+    (?:_l(?P<los_reward>-?[\d.]+(?:e[-+]\d+)?))?  # Written with repr by auto_eval.py, e.g. 0.5 or 1e-05
+    (?:_s(?P<seed>\d+))?
+    (?:_b(?P<build>[^_]+))?
+    _(?P<scene>(?:(?P<motion>static|dynamic(?P<speed>[\d.]+(?:e[-+]\d+)?)?)_)?[^_.]+)  # Scene, prefixed by the target motion
+    (?:\.csv)?
+""", re.VERBOSE)
+# parse_many uses str.extract, which searches instead of matching the whole name
+_ANCHORED_PATTERN = re.compile(r"^(?:" + FILENAME_PATTERN.pattern + r")$", re.VERBOSE)
+
+
+class FilenameError(ValueError):
+    """Raised if a filename does not follow the naming convention of the evaluation files"""
+
+
+def _to_parts(groups):
+    # Converts the matched groups (dict) to FilenameParts
+    motion = groups["motion"]
+    target_speed = None
+    if motion is not None:
+        # static: 0, dynamic: 5, dynamic{speed}: any other speed
+        target_speed = 0.0 if motion == "static" else float(groups["speed"] or 5)
+    return FilenameParts(agent=groups["agent"], model=groups["model"], model_id=groups["model_id"],
+                         scene=groups["scene"], decision_period=int(groups["decision_period"]),
+                         target_speed=target_speed,
+                         audio_sources=int(groups["audio_sources"]) if groups["audio_sources"] else 1,
+                         los_reward=float(groups["los_reward"]) if groups["los_reward"] else None,
+                         seed=int(groups["seed"]) if groups["seed"] else None,
+                         build=groups["build"])
+
+
+@lru_cache(maxsize=65536)
+def _parse_basename(filename):
+    match = FILENAME_PATTERN.fullmatch(filename)
+    if match is None:
+        raise FilenameError(f"Filename does not follow the evaluation naming convention: {filename}")
+    return _to_parts(match.groupdict())
 
-    # Get model name
-    model_end_index = len(splitted) + (scene_start_index-1)  # Account for scene-name and decision-period
-    model_name = "_".join(splitted[model_start_index:model_end_index])
-    
-    # Get model id
-    model_parts = model_name.split("_")
-    model_id = None
-    if model_parts and model_parts[-1].isdigit():
-        model_id = model_parts.pop(-1)
-        model_name = "_".join(model_parts)
 
-    return FilenameParts(agent=agent, model=model_name, model_id=model_id, scene=scene, decision_period=decision_period)
-
-
-def parse_filename_regex(filename):
-    # Regular expression to match the patterns
-    pattern = r"(.+?)_(.+?)_(\d+|ao)_(d\d+)_([^.]+)\.csv"
-    match = re.match(pattern, filename)
-
-    if not match:
-        print(filename)
-        return "Filename format is incorrect"
-
-    agent, _, id_part, decision_interval, scene = match.groups()
-
-    if id_part == 'ao':
-        agent = f"{agent}_{id_part}"
-        id_part = match.group(3)
-
-    # Clean up attributes
-    decision_interval = decision_interval[1:]  # Remove 'd' from decision_interval
-    scene = scene.lower()  # Change scene to lowercase
+def parse_filename(file_path):
+    # Parses evaluation filenames to subcomponents (FilenameParts), raises FilenameError for other files
+    return _parse_basename(os.path.basename(file_path))
+
+
+def parse_many(file_paths, errors="raise"):
+    """Parses many filenames at once
+    errors: "raise" to raise FilenameError for invalid filenames, "coerce" to leave their row empty
+    Returns a DataFrame with a row per path: the path and the fields of FilenameParts as columns."""
+    import pandas as pd
+
+    paths = pd.Series(list(file_paths), dtype=object)
+    groups = paths.map(os.path.basename).str.extract(_ANCHORED_PATTERN)
+    invalid = groups["decision_period"].isna()
+    if invalid.any() and errors == "raise":
+        raise FilenameError(f"Filenames do not follow the evaluation naming convention: {paths[invalid].tolist()}")
+
+    df = pd.DataFrame({"path": paths})
+    for field in ["agent", "model", "model_id", "scene", "build"]:
+        df[field] = groups[field]
+    df["decision_period"] = pd.to_numeric(groups["decision_period"]).astype("Int64")
+    # static: 0, dynamic: 5, dynamic{speed}: any other speed
+    speed = pd.to_numeric(groups["speed"]).fillna(5.0)
+    df["target_speed"] = speed.where(groups["motion"] != "static", 0.0).where(groups["motion"].notna())
+    df["audio_sources"] = pd.to_numeric(groups["audio_sources"]).fillna(1).astype("Int64").where(~invalid)
+    df["los_reward"] = pd.to_numeric(groups["los_reward"]).astype(float)
+    df["seed"] = pd.to_numeric(groups["seed"]).astype("Int64")
+    return df[["path"] + list(FilenameParts._fields)]
 
-    parsed_result = f"agent={agent}, id={id_part}, decision_interval={decision_interval}, scene={scene}"
-    return parsed_result
 
 if __name__ == "__main__":
     # Example usage
@@ -76,8 +94,12 @@ if __name__ == "__main__":
         "Hanning_hanning_ao_5_d1_Easy.csv",
         "ChHanning_channing_ao_36_d6_dididid.csv",
         "HanningAO_hanning-ao-no-los-dynamic_1_d1_static_Complex.csv",
-        "HanningAO_hanning-ao-no-los-dynamic_10_d1_dynamic_Complex.csv"
+        "HanningAO_hanning-ao-no-los-dynamic_10_d1_dynamic_Complex.csv",
+        "HanningAO_hanning_ao_3_d10_a30_l0_s101_blinux_dynamic2.5_Easy.csv",
+        "HanningAO_hanning_ao-1_d1_static_Complex.csv",
+        "Hanning_hanning_agent-2_d1_dynamic_Medium.csv"
     ]
 
     for fname in filenames:
         print(parse_filename(fname))
+    print(parse_many(filenames).to_string())